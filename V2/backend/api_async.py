@@ -0,0 +1,153 @@
+# library_project/backend/api_async.py
+"""
+Endpoints asíncronos (modo DB_ASYNC=1). Atienden las mismas rutas y con el mismo contrato que
+main.py, pero usan AsyncSession y no ocupan un hilo del threadpool mientras esperan a la base de datos.
+main.py incluye este router antes de declarar sus propias rutas, así que estas tienen prioridad.
+"""
+from typing import List, Optional, Union
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, crud_async, schemas
+from .auth import get_current_user
+from .database import get_async_db
+from .metricas import RutaMedida
+from .serializacion import parse_lista_param, respuesta_lista
+
+# include_in_schema=False: la documentación ya la generan los endpoints equivalentes de main.py
+router = APIRouter(include_in_schema=False, route_class=RutaMedida)
+
+# --- Libros y Ejemplares ---
+
+@router.get("/libros/", response_model=List[schemas.LibroExpandido])
+async def leer_libros(skip: int = 0, limit: int = 100, fields: Optional[str] = None, expand: Optional[str] = None, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    campos = parse_lista_param(fields, list(schemas.Libro.model_fields), "fields")
+    expansiones = parse_lista_param(expand, list(crud.EXPANSIONES_LIBRO), "expand")
+    libros = await crud_async.get_libros_filas(db, skip=skip, limit=limit, campos=campos or None, expand=expansiones)
+    if campos:
+        return respuesta_lista(libros, None)
+    return respuesta_lista(libros, "libros_expandidos" if expansiones else "libros")
+
+@router.get("/libros/{libro_id}", response_model=schemas.Libro)
+async def leer_libro(libro_id: int, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    db_libro = await crud_async.get_libro(db, libro_id=libro_id)
+    if db_libro is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Libro no encontrado")
+    return db_libro
+
+@router.get("/ejemplares/", response_model=List[schemas.Ejemplar])
+async def leer_ejemplares(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    ejemplares = await crud_async.get_ejemplares_filas(db, skip=skip, limit=limit)
+    return respuesta_lista(ejemplares, "ejemplares")
+
+@router.get("/ejemplares/{ejemplar_id}", response_model=schemas.Ejemplar)
+async def leer_ejemplar(ejemplar_id: int, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    db_ejemplar = await crud_async.get_ejemplar(db, ejemplar_id=ejemplar_id)
+    if db_ejemplar is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ejemplar no encontrado")
+    return db_ejemplar
+
+@router.get("/libros/{libro_id}/ejemplares/", response_model=List[schemas.Ejemplar])
+async def leer_ejemplares_por_libro(libro_id: int, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    db_libro = await crud_async.get_libro(db, libro_id=libro_id)
+    if not db_libro:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Libro no encontrado")
+    return await crud_async.get_ejemplares_by_libro(db, libro_id=libro_id, skip=skip, limit=limit)
+
+# --- Usuarios ---
+
+@router.get("/usuarios/", response_model=List[Union[schemas.Profesor, schemas.Alumno]])
+async def leer_usuarios(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    usuarios = await crud_async.get_usuarios_filas(db, skip=skip, limit=limit)
+    return respuesta_lista(usuarios, "usuarios")
+
+@router.get("/usuarios/{usuario_id}", response_model=Union[schemas.Profesor, schemas.Alumno])
+async def leer_usuario(usuario_id: int, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    db_usuario = await crud_async.get_usuario(db, usuario_id=usuario_id)
+    if db_usuario is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    if db_usuario.tipo_usuario == "profesor":
+        return schemas.Profesor.model_validate(db_usuario)
+    elif db_usuario.tipo_usuario == "alumno":
+        return schemas.Alumno.model_validate(db_usuario)
+    else:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Tipo de usuario desconocido")
+
+@router.get("/usuarios/{usuario_id}/resumen", response_model=schemas.ResumenUsuario)
+async def leer_resumen_usuario(usuario_id: int, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    resumen = await crud_async.get_resumen_usuario(db, usuario_id=usuario_id)
+    if resumen is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    return resumen
+
+@router.get("/usuarios/{usuario_id}/prestamos/", response_model=List[schemas.Prestamo])
+async def leer_prestamos_usuario(usuario_id: int, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    db_usuario = await crud_async.get_usuario(db, usuario_id=usuario_id)
+    if not db_usuario:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    return await crud_async.get_prestamos_by_usuario(db, usuario_id=usuario_id, skip=skip, limit=limit)
+
+# --- Préstamos y Multas ---
+
+@router.post("/prestamos/", response_model=schemas.Prestamo, status_code=status.HTTP_201_CREATED)
+async def crear_prestamo(prestamo: schemas.PrestamoCreate, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    try:
+        return await crud_async.create_prestamo(db, prestamo=prestamo)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Error de integridad: este ejemplar ya está prestado.")
+
+@router.get("/prestamos/", response_model=List[schemas.Prestamo])
+async def leer_prestamos(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    prestamos = await crud_async.get_prestamos_filas(db, skip=skip, limit=limit)
+    return respuesta_lista(prestamos, "prestamos")
+
+@router.get("/prestamos/{prestamo_id}", response_model=schemas.Prestamo)
+async def leer_prestamo(prestamo_id: int, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    db_prestamo = await crud_async.get_prestamo(db, prestamo_id=prestamo_id)
+    if db_prestamo is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Préstamo no encontrado")
+    return db_prestamo
+
+@router.post("/ejemplares/{ejemplar_id}/devolver/", response_model=schemas.PrestamoHistorico)
+async def devolver_ejemplar_api(ejemplar_id: int, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    try:
+        return await crud_async.devolver_ejemplar(db, ejemplar_id=ejemplar_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/usuarios/{usuario_id}/multa_activa/", response_model=Optional[schemas.Multa])
+async def leer_multa_activa_usuario(usuario_id: int, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    db_usuario = await crud_async.get_usuario(db, usuario_id=usuario_id)
+    if not db_usuario:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    return await crud_async.get_multa_by_usuario(db, usuario_id=usuario_id)
+
+# --- Recomendaciones e Históricos ---
+
+@router.get("/libros/{libro_id}/recomendaciones/", response_model=List[schemas.Recomendacion])
+async def leer_recomendaciones_por_libro(libro_id: int, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    db_libro = await crud_async.get_libro(db, libro_id=libro_id)
+    if not db_libro:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Libro no encontrado")
+    return await crud_async.get_recomendaciones_by_libro_origen(db, libro_id=libro_id, skip=skip, limit=limit)
+
+@router.get("/usuarios/{usuario_id}/historial/prestamos/", response_model=List[schemas.PrestamoHistorico])
+async def leer_historial_prestamos_usuario(usuario_id: int, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    db_usuario = await crud_async.get_usuario(db, usuario_id=usuario_id)
+    if not db_usuario:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    historial = await crud_async.get_prestamos_historicos_filas_by_usuario(db, usuario_id=usuario_id, skip=skip, limit=limit)
+    return respuesta_lista(historial, "prestamos_historicos")
+
+@router.get("/usuarios/{usuario_id}/historial/multas/", response_model=List[schemas.MultaHistorica])
+async def leer_historial_multas_usuario(usuario_id: int, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), usuario_actual: dict = Depends(get_current_user)):
+    db_usuario = await crud_async.get_usuario(db, usuario_id=usuario_id)
+    if not db_usuario:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    historial = await crud_async.get_multas_historicas_filas_by_usuario(db, usuario_id=usuario_id, skip=skip, limit=limit)
+    return respuesta_lista(historial, "multas_historicas")
@@ -0,0 +1,104 @@
+# library_project/backend/arranque.py
+"""
+Calentamiento antes de aceptar tráfico (DB_CALENTAR=1, por defecto).
+
+- Configura los mapeos de SQLAlchemy (relaciones, herencia de Usuario), que de otro modo se
+  configuran en la primera consulta.
+- Ejecuta una vez cada consulta caliente de crud.py con LIMIT 0 o ids inexistentes: el SQL queda
+  compilado en la caché del engine (y de cada réplica) y las estrategias de carga, preparadas.
+- Usa una vez los TypeAdapters de serializacion.py.
+- Abre DB_CONEXIONES_INICIALES conexiones del pool (por defecto DB_POOL_SIZE), para que las primeras
+  peticiones concurrentes no esperen a conectar con PostgreSQL.
+
+Una réplica caída no impide arrancar: se registra un aviso y se sigue sin calentarla (el enrutador
+de réplicas ya la descarta mientras no responda). Un error con la primaria sí detiene el arranque.
+"""
+import logging
+import os
+import time
+
+from sqlalchemy.orm import configure_mappers
+
+from . import crud, database
+from .metricas_pool import DB_POOL_SIZE
+from .serializacion import ADAPTADORES
+
+DB_CALENTAR = os.getenv("DB_CALENTAR", "1") == "1"
+DB_CONEXIONES_INICIALES = int(os.getenv("DB_CONEXIONES_INICIALES", str(DB_POOL_SIZE)))
+
+logger = logging.getLogger(__name__)
+
+CONSULTAS_CALIENTES = [
+    lambda db: crud.get_libro(db, libro_id=0),
+    lambda db: crud.get_libros_filas(db, limit=0),
+    lambda db: crud.get_libros_filas(db, limit=0, expand=list(crud.EXPANSIONES_LIBRO)),
+    lambda db: crud.get_ejemplar(db, ejemplar_id=0),
+    lambda db: crud.get_ejemplares_filas(db, limit=0),
+    lambda db: crud.get_ejemplares_by_libro(db, libro_id=0, limit=0),
+    lambda db: crud.get_usuario(db, usuario_id=0),
+    lambda db: crud.get_usuarios_filas(db, limit=0),
+    lambda db: crud.get_resumen_usuario(db, usuario_id=0),
+    lambda db: crud.get_prestamo(db, prestamo_id=0),
+    lambda db: crud.get_prestamos_filas(db, limit=0),
+    lambda db: crud.get_prestamos_by_usuario(db, usuario_id=0, limit=0),
+    lambda db: crud.get_multa_by_usuario(db, usuario_id=0),
+    lambda db: crud.get_recomendaciones_by_libro_origen(db, libro_id=0, limit=0),
+    lambda db: crud.get_prestamos_historicos_filas_by_usuario(db, usuario_id=0, limit=0),
+    lambda db: crud.get_multas_historicas_filas_by_usuario(db, usuario_id=0, limit=0),
+]
+
+
+def _replicas() -> list:
+    return [replica.engine for replica in database.enrutador_replicas.replicas] if database.enrutador_replicas is not None else []
+
+
+def _en_replica(engine, paso, funcion):
+    try:
+        funcion()
+    except Exception as e:
+        logger.warning("Réplica %s no disponible (%s): %s", engine.url.render_as_string(hide_password=True), paso, e)
+
+
+def _ejecutar_consultas(replica=None):
+    db = database.SessionLocal(replica=replica)
+    try:
+        for consulta in CONSULTAS_CALIENTES:
+            consulta(db)
+    finally:
+        db.close()
+
+
+def calentar_consultas():
+    _ejecutar_consultas()
+    for replica in _replicas():
+        _en_replica(replica, "calentar consultas", lambda: _ejecutar_consultas(replica))
+
+
+def calentar_serializacion():
+    for adaptador in ADAPTADORES.values():
+        adaptador.dump_json(adaptador.validate_python([]))
+
+
+def _abrir_conexiones(engine):
+    conexiones = []
+    try:
+        for _ in range(min(DB_CONEXIONES_INICIALES, engine.pool.size())):
+            conexiones.append(engine.connect())
+    finally:
+        for conexion in conexiones:
+            conexion.close()
+
+
+def abrir_conexiones():
+    _abrir_conexiones(database.engine)
+    for replica in _replicas():
+        _en_replica(replica, "abrir conexiones", lambda: _abrir_conexiones(replica))
+
+
+def calentar():
+    inicio = time.perf_counter()
+    configure_mappers()
+    calentar_serializacion()
+    calentar_consultas()
+    abrir_conexiones()
+    logger.info("Calentamiento completado en %.0f ms", (time.perf_counter() - inicio) * 1000)
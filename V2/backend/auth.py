@@ -1,17 +1,22 @@
 # library_project/backend/auth.py
-from fastapi import Depends, HTTPException, status
+import os
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from keycloak import KeycloakOpenID
 from keycloak.exceptions import KeycloakAuthenticationError
 import jwt
 
+from . import perfilador
+from .metricas import medir
+
 # --- Configuración de Keycloak ---
-KEYCLOAK_SERVER_URL = "http://keycloak:8080/"
-KEYCLOAK_REALM = "master"
-KEYCLOAK_CLIENT_ID = "fastapi-client"
+# Se puede cambiar por variables de entorno (p. ej. el OIDC simulado de benchmarks/oidc_simulado.py)
+KEYCLOAK_SERVER_URL = os.getenv("KEYCLOAK_SERVER_URL", "http://keycloak:8080/")
+KEYCLOAK_REALM = os.getenv("KEYCLOAK_REALM", "master")
+KEYCLOAK_CLIENT_ID = os.getenv("KEYCLOAK_CLIENT_ID", "fastapi-client")
 # ¡IMPORTANTE! Necesitamos el secreto del cliente para obtener tokens.
 # Búscalo en Keycloak -> Clients -> fastapi-client -> Credentials -> Client secret
-KEYCLOAK_CLIENT_SECRET = "ytj93gqzZp7hErvDhOyvyUe2dxxaKz6F" # Reemplaza con tu secreto real
+KEYCLOAK_CLIENT_SECRET = os.getenv("KEYCLOAK_CLIENT_SECRET", "ytj93gqzZp7hErvDhOyvyUe2dxxaKz6F") # Reemplaza con tu secreto real
 
 # --- Instancia de KeycloakOpenID ---
 # Este único objeto se encargará tanto de obtener tokens como de validarlos.
@@ -49,15 +54,28 @@ def get_token(username, password) -> dict:
             detail=f"Error de conexión con el servidor de autenticación: {e}",
         )
 
-async def get_current_user(cred: HTTPAuthorizationCredentials = Depends(oauth2_scheme)) -> dict:
+async def get_current_user(request: Request, cred: HTTPAuthorizationCredentials = Depends(oauth2_scheme)) -> dict:
     """
     Extrae el token del 'Bearer' y lo valida usando el endpoint de introspección de Keycloak.
     Este método es inmune a problemas de desfase de reloj.
     """
+    # Las subpeticiones de /batch ya se autenticaron una vez en la petición principal.
+    # La clave "batch" solo la pone main.py al despachar internamente, nunca viene del cliente.
+    batch = request.scope.get("batch")
+    if batch is not None:
+        request.state.admin = es_admin(batch["usuario"])
+        if request.state.admin:
+            perfilador.iniciar_si_solicitado()
+        request.state.usuario = batch["usuario"].get("preferred_username")
+        request.state.sujeto = batch["usuario"].get("sub")
+        return batch["usuario"]
+
     token = cred.credentials
     try:
         # Usamos el endpoint de introspección. Keycloak nos dirá si el token es activo.
-        token_info = keycloak_openid.introspect(token)
+        # Versión asíncrona: esta dependencia corre en el event loop y no debe bloquearlo.
+        with medir("auth"):
+            token_info = await keycloak_openid.a_introspect(token)
 
         if not token_info.get("active"):
             raise HTTPException(
@@ -69,6 +87,12 @@ async def get_current_user(cred: HTTPAuthorizationCredentials = Depends(oauth2_s
         # Si el token es activo, devolvemos la información.
         # Podemos decodificarlo localmente (sin verificar la firma de tiempo) para obtener los claims.
         payload = jwt.decode(token, options={"verify_signature": False, "verify_aud": False})
+        # Lo consulta el perfilador (X-Perfil) después de ejecutar la petición
+        request.state.admin = es_admin(payload)
+        if request.state.admin:
+            perfilador.iniciar_si_solicitado() # ?_perfil=1 / X-Perfil: 1 (ver perfilador.py)
+        request.state.usuario = payload.get("preferred_username") # Para el log de accesos
+        request.state.sujeto = payload.get("sub") # Para la captura de tráfico (solo se guarda su hash)
         return payload
 
     except Exception as e:
@@ -77,3 +101,15 @@ async def get_current_user(cred: HTTPAuthorizationCredentials = Depends(oauth2_s
             detail=f"Token inválido o error de validación: {e}",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+# Rol de Keycloak (realm) necesario para los endpoints de administración (/admin/...)
+KEYCLOAK_ROL_ADMIN = os.getenv("KEYCLOAK_ROL_ADMIN", "admin")
+
+def es_admin(usuario: dict) -> bool:
+    return KEYCLOAK_ROL_ADMIN in usuario.get("realm_access", {}).get("roles", [])
+
+async def get_usuario_admin(usuario_actual: dict = Depends(get_current_user)) -> dict:
+    """Como get_current_user, pero además exige el rol de administración en el token."""
+    if not es_admin(usuario_actual):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Se necesita el rol de administración")
+    return usuario_actual
\ No newline at end of file
@@ -0,0 +1,109 @@
+# library_project/backend/barrido_nocturno.py
+"""
+Barrido nocturno: una vez al día, a BARRIDO_HORA (hora local del servidor), marca como MOROSO a los
+usuarios con préstamos vencidos, devuelve a ACTIVO a los que ya no los tienen y caduca las reservas
+asignadas que nadie recogió a tiempo (ver la sección "Morosos" de crud.py y crud.caducar_reservas).
+
+- Todo son UPDATE/DELETE por conjuntos en lotes de BARRIDO_LOTE filas, con una transacción por lote
+  y SKIP LOCKED: el barrido no bloquea a las peticiones ni espera por ellas. Los préstamos vencidos se
+  encuentran por el índice de fecha_devolucion_esperada (migración 0004).
+- Cada worker tiene su hilo, pero un advisory lock de PostgreSQL hace que solo uno ejecute el barrido
+  a la vez; los demás lo saltan. Repetirlo no cambia nada (solo cambia filas que aún lo necesitan).
+- Con BARRIDO_NOCTURNO=0 no se arranca el hilo, y el barrido se puede lanzar desde cron:
+      python -m backend.barrido_nocturno [--hoy AAAA-MM-DD]
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+
+from . import crud, database
+
+BARRIDO_NOCTURNO = os.getenv("BARRIDO_NOCTURNO", "1") == "1"
+BARRIDO_HORA = os.getenv("BARRIDO_HORA", "02:30")
+BARRIDO_LOTE = int(os.getenv("BARRIDO_LOTE", "1000"))
+
+# Clave del advisory lock (cualquier bigint fijo, el mismo en todos los procesos)
+_CLAVE_BLOQUEO = 0x62617272 # "barr"
+
+logger = logging.getLogger(__name__)
+
+
+def barrer(hoy: Optional[date] = None, lote: int = BARRIDO_LOTE) -> Optional[dict]:
+    """Ejecuta el barrido completo y devuelve cuántas filas cambió, o None si otro proceso lo está ejecutando."""
+    hoy = hoy or date.today()
+    with database.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as bloqueo:
+        # Bloqueo de sesión en una conexión aparte (sin transacción abierta): los commits de cada lote no lo sueltan
+        if not bloqueo.execute(text("SELECT pg_try_advisory_lock(:clave)"), {"clave": _CLAVE_BLOQUEO}).scalar():
+            return None
+        try:
+            inicio = time.perf_counter()
+            with database.SessionLocal() as db:
+                resultado = {
+                    "morosos": crud.marcar_morosos(db, hoy=hoy, lote=lote),
+                    "rehabilitados": crud.rehabilitar_morosos(db, hoy=hoy, lote=lote),
+                    "reservas_caducadas": crud.caducar_reservas(db, hoy=hoy, lote=lote),
+                }
+            logger.info("Barrido nocturno (%s) en %.1f s: %s", hoy, time.perf_counter() - inicio, resultado)
+            return resultado
+        finally:
+            bloqueo.execute(text("SELECT pg_advisory_unlock(:clave)"), {"clave": _CLAVE_BLOQUEO})
+
+
+def _siguiente(ahora: datetime) -> datetime:
+    horas, minutos = (int(parte) for parte in BARRIDO_HORA.split(":"))
+    siguiente = ahora.replace(hour=horas, minute=minutos, second=0, microsecond=0)
+    return siguiente if siguiente > ahora else siguiente + timedelta(days=1)
+
+
+class Programador:
+    def __init__(self):
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            ahora = datetime.now()
+            # Espera en tramos de como mucho una hora: un cambio de hora del sistema no retrasa el barrido un día
+            if self._parar.wait(min((_siguiente(ahora) - ahora).total_seconds(), 3600)):
+                return
+            if datetime.now() < _siguiente(ahora):
+                continue
+            try:
+                barrer()
+            except Exception:
+                logger.exception("Error en el barrido nocturno")
+
+    def iniciar(self):
+        """Arranca el hilo del barrido de este proceso (evento startup de cada worker)."""
+        if self._hilo is None or not self._hilo.is_alive():
+            self._parar.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="barrido-nocturno", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=10)
+
+
+programador = Programador()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Marca morosos, rehabilita a los que ya no lo son y caduca reservas sin recoger.")
+    parser.add_argument("--hoy", type=date.fromisoformat, default=None, help="Fecha de referencia (por defecto, hoy)")
+    parser.add_argument("--lote", type=int, default=BARRIDO_LOTE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    resultado = barrer(args.hoy, args.lote)
+    print(resultado if resultado is not None else "Otro proceso está ejecutando el barrido.")
+
+
+if __name__ == "__main__":
+    main()
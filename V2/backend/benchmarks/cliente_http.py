@@ -0,0 +1,68 @@
+# library_project/backend/benchmarks/cliente_http.py
+"""
+Cliente HTTP/1.1 mínimo sobre asyncio con conexiones keep-alive, para generar carga en los
+benchmarks sin depender de librerías externas. Solo implementa lo que usan los benchmarks.
+"""
+import asyncio
+from typing import Dict, Optional, Tuple
+
+
+class ConexionHTTP:
+    def __init__(self, host: str, puerto: int):
+        self.host = host
+        self.puerto = puerto
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def abrir(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.puerto)
+
+    async def cerrar(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+    async def peticion(self, metodo: str, ruta: str, cuerpo: bytes = b"", cabeceras: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        if self.writer is None:
+            await self.abrir()
+        lineas = [f"{metodo} {ruta} HTTP/1.1", f"Host: {self.host}:{self.puerto}", f"Content-Length: {len(cuerpo)}"]
+        for nombre, valor in (cabeceras or {}).items():
+            lineas.append(f"{nombre}: {valor}")
+        if cuerpo and not any(nombre.lower() == "content-type" for nombre in (cabeceras or {})):
+            lineas.append("Content-Type: application/json")
+        self.writer.write(("\r\n".join(lineas) + "\r\n\r\n").encode("latin-1") + cuerpo)
+        await self.writer.drain()
+
+        linea_estado = await self.reader.readline()
+        if not linea_estado:
+            await self.cerrar()
+            raise ConnectionError("El servidor cerró la conexión")
+        estado = int(linea_estado.split()[1])
+        cabeceras_resp = {}
+        while True:
+            linea = await self.reader.readline()
+            if linea in (b"\r\n", b"\n", b""):
+                break
+            nombre, _, valor = linea.decode("latin-1").partition(":")
+            cabeceras_resp[nombre.strip().lower()] = valor.strip()
+
+        if cabeceras_resp.get("transfer-encoding") == "chunked":
+            partes = []
+            while True:
+                tamano = int((await self.reader.readline()).strip(), 16)
+                if tamano == 0:
+                    await self.reader.readline()
+                    break
+                partes.append(await self.reader.readexactly(tamano))
+                await self.reader.readline()
+            cuerpo_resp = b"".join(partes)
+        else:
+            cuerpo_resp = await self.reader.readexactly(int(cabeceras_resp.get("content-length", "0")))
+
+        if cabeceras_resp.get("connection") == "close":
+            await self.cerrar()
+        return estado, cabeceras_resp, cuerpo_resp
@@ -0,0 +1,122 @@
+# library_project/backend/benchmarks/oidc_simulado.py
+"""
+Servidor OIDC simulado que imita los endpoints de Keycloak que usa auth.py, para ejecutar la API
+con su autenticación real (token + introspección en cada petición) sin levantar Keycloak.
+
+- GET  /realms/{realm}/.well-known/openid-configuration
+- GET  /realms/{realm}/protocol/openid-connect/certs              (JWKS con la clave RSA generada al arrancar)
+- POST /realms/{realm}/protocol/openid-connect/token              (grant_type=password y refresh_token)
+- POST /realms/{realm}/protocol/openid-connect/token/introspect   (verifica firma y caducidad)
+
+Los tokens son JWT RS256 con los mismos claims que usa la API (preferred_username, sub,
+realm_access.roles). Cualquier usuario y contraseña son válidos salvo la contraseña "incorrecta";
+los usuarios cuyo nombre empieza por "admin" reciben el rol de administración.
+OIDC_LATENCIA_MS añade un retardo fijo a cada respuesta para imitar la red hasta Keycloak.
+
+    OIDC_PUERTO=8180 python -m backend.benchmarks.oidc_simulado
+
+Solo para pruebas locales; nunca usar en producción.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+
+import jwt
+import uvicorn
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Form, HTTPException, Request
+from jwt.algorithms import RSAAlgorithm
+
+OIDC_PUERTO = int(os.getenv("OIDC_PUERTO", "8180"))
+OIDC_LATENCIA_MS = float(os.getenv("OIDC_LATENCIA_MS", "0"))
+OIDC_DURACION_TOKEN_S = int(os.getenv("OIDC_DURACION_TOKEN_S", "3600"))
+CLIENT_SECRET = os.getenv("KEYCLOAK_CLIENT_SECRET", "ytj93gqzZp7hErvDhOyvyUe2dxxaKz6F")
+KID = "oidc-simulado"
+
+clave_privada = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+clave_publica = clave_privada.public_key()
+jwk = dict(json.loads(RSAAlgorithm.to_jwk(clave_publica)), kid=KID, use="sig", alg="RS256")
+
+app = FastAPI(title="OIDC simulado")
+
+
+@app.middleware("http")
+async def latencia(request: Request, call_next):
+    if OIDC_LATENCIA_MS:
+        await asyncio.sleep(OIDC_LATENCIA_MS / 1000)
+    return await call_next(request)
+
+
+def _base(request: Request, realm: str) -> str:
+    return f"{str(request.base_url).rstrip('/')}/realms/{realm}"
+
+
+def _emitir(request: Request, realm: str, usuario: str, client_id: str) -> dict:
+    ahora = int(time.time())
+    claims = {
+        "iss": _base(request, realm), "sub": str(uuid.uuid5(uuid.NAMESPACE_DNS, usuario)), "aud": "account", "azp": client_id,
+        "typ": "Bearer", "iat": ahora, "exp": ahora + OIDC_DURACION_TOKEN_S, "jti": uuid.uuid4().hex,
+        "preferred_username": usuario, "realm_access": {"roles": ["admin"] if usuario.startswith("admin") else ["default-roles-" + realm]},
+    }
+    firmar = lambda datos: jwt.encode(datos, clave_privada, algorithm="RS256", headers={"kid": KID})
+    return {
+        "access_token": firmar(claims), "refresh_token": firmar(dict(claims, typ="Refresh", exp=ahora + 10 * OIDC_DURACION_TOKEN_S)),
+        "expires_in": OIDC_DURACION_TOKEN_S, "refresh_expires_in": 10 * OIDC_DURACION_TOKEN_S, "token_type": "Bearer",
+        "scope": "profile email", "session_state": uuid.uuid4().hex,
+    }
+
+
+def _comprobar_cliente(client_secret: str):
+    if client_secret != CLIENT_SECRET:
+        raise HTTPException(status_code=401, detail={"error": "unauthorized_client", "error_description": "Invalid client secret"})
+
+
+@app.get("/realms/{realm}/.well-known/openid-configuration")
+def configuracion(realm: str, request: Request):
+    base = _base(request, realm)
+    return {
+        "issuer": base,
+        "token_endpoint": f"{base}/protocol/openid-connect/token",
+        "introspection_endpoint": f"{base}/protocol/openid-connect/token/introspect",
+        "jwks_uri": f"{base}/protocol/openid-connect/certs",
+        "grant_types_supported": ["password", "refresh_token"],
+        "id_token_signing_alg_values_supported": ["RS256"],
+    }
+
+
+@app.get("/realms/{realm}/protocol/openid-connect/certs")
+def certificados(realm: str):
+    return {"keys": [jwk]}
+
+
+@app.post("/realms/{realm}/protocol/openid-connect/token")
+def token(realm: str, request: Request, grant_type: str = Form(...), client_id: str = Form(...), client_secret: str = Form(""),
+          username: str = Form(""), password: str = Form(""), refresh_token: str = Form("")):
+    _comprobar_cliente(client_secret)
+    if grant_type == "password":
+        if not username or password == "incorrecta":
+            raise HTTPException(status_code=401, detail={"error": "invalid_grant", "error_description": "Invalid user credentials"})
+        return _emitir(request, realm, username, client_id)
+    if grant_type == "refresh_token":
+        try:
+            claims = jwt.decode(refresh_token, clave_publica, algorithms=["RS256"], options={"verify_aud": False})
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=400, detail={"error": "invalid_grant", "error_description": "Invalid refresh token"})
+        return _emitir(request, realm, claims["preferred_username"], client_id)
+    raise HTTPException(status_code=400, detail={"error": "unsupported_grant_type"})
+
+
+@app.post("/realms/{realm}/protocol/openid-connect/token/introspect")
+def introspeccion(realm: str, token: str = Form(...), client_id: str = Form(...), client_secret: str = Form("")):
+    _comprobar_cliente(client_secret)
+    try:
+        claims = jwt.decode(token, clave_publica, algorithms=["RS256"], options={"verify_aud": False})
+    except jwt.InvalidTokenError:
+        return {"active": False}
+    return dict(claims, active=True, client_id=client_id, username=claims["preferred_username"], token_type="Bearer")
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=OIDC_PUERTO, log_level="warning")
@@ -0,0 +1,18 @@
+# library_project/backend/benchmarks/servidor_bench.py
+"""
+Arranca la API para los benchmarks sin Keycloak: get_current_user se sustituye por un usuario fijo.
+Solo para pruebas locales de rendimiento; nunca usar en producción.
+
+    DATABASE_URL=... BENCH_PUERTO=8100 python -m backend.benchmarks.servidor_bench
+"""
+import os
+
+import uvicorn
+
+from ..auth import get_current_user
+from ..main import app
+
+app.dependency_overrides[get_current_user] = lambda: {"preferred_username": "benchmark", "sub": "benchmark"}
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("BENCH_PUERTO", "8100")), log_level="warning")
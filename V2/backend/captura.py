@@ -0,0 +1,214 @@
+# library_project/backend/captura.py
+"""
+Captura del tráfico real de la API para reproducirlo después contra una instancia de pruebas
+(benchmarks/reproducir_trafico.py).
+
+Con CAPTURA_ARCHIVO definido, metricas.RutaMedida pasa cada petición a registrar() y un hilo aparte
+la añade como una línea JSON compacta a ese archivo (comprimido con gzip si termina en .gz). Cada
+línea tiene: inicio (epoch, s), método, plantilla de la ruta, ruta real, query string, cuerpo JSON,
+estado, duración (ms), hash del sujeto del token y si era administrador.
+
+Saneado: nunca se guardan cabeceras (ni el token ni cookies), los cuerpos que no son JSON (como el
+formulario de /login, con la contraseña) ni los de más de CAPTURA_MAX_CUERPO bytes. Los datos
+personales del cuerpo y de la query string (CAMPOS_PERSONALES, p. ej. /usuarios/?email=...) se
+sustituyen por un seudónimo: el mismo valor da siempre el mismo seudónimo, así que los duplicados
+(login o email repetidos) se reproducen igual. Seudónimos y sujeto ('sub') del token se calculan con
+HMAC-SHA256 y la sal CAPTURA_SAL, que es obligatoria: sin ella cualquiera podría revertirlos probando
+valores, así que sin CAPTURA_SAL no se captura nada. Debe ser secreta y la misma en todos los workers.
+
+CAPTURA_MUESTREO (fracción de 0 a 1) se aplica por sujeto, no por petición: de un usuario se
+captura todo o nada, para que las secuencias (préstamo y devolución) se reproduzcan enteras.
+Como en registro.py, si la cola (CAPTURA_COLA) está llena la petición no se captura y se cuenta en
+biblioteca_captura_descartadas_total, en lugar de bloquear. Cada proceso escribe su propio archivo
+si la ruta contiene '{pid}', y con varios procesos (WEB_CONCURRENCY > 1 o workers creados con fork,
+como gunicorn con preload_app) es obligatorio: las escrituras de varios procesos en el mismo archivo
+se mezclarían. Sin '{pid}' en ese caso no se captura. No se capturan las rutas de CAPTURA_EXCLUIR
+(por defecto /login y /metrics).
+"""
+import atexit
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode
+
+from prometheus_client import Counter
+
+CAPTURA_ARCHIVO = os.getenv("CAPTURA_ARCHIVO", "")
+CAPTURA_MUESTREO = float(os.getenv("CAPTURA_MUESTREO", "1"))
+CAPTURA_MAX_CUERPO = int(os.getenv("CAPTURA_MAX_CUERPO", "65536"))
+CAPTURA_COLA = int(os.getenv("CAPTURA_COLA", "10000"))
+CAPTURA_SAL = os.getenv("CAPTURA_SAL", "").encode()
+# El replayer obtiene sus propios tokens; /login sin su cuerpo (descartado) no se puede reproducir
+CAPTURA_EXCLUIR = set(os.getenv("CAPTURA_EXCLUIR", "/login,/metrics").split(","))
+
+CAMPOS_PERSONALES = {"login", "nombre", "apellidos", "email", "calle", "numero", "piso", "ciudad", "codigo_postal", "telefono_padres"}
+
+DESCARTADAS = Counter("biblioteca_captura_descartadas_total", "Peticiones no capturadas por tener la cola de captura llena")
+
+logger = logging.getLogger(__name__)
+
+activa = bool(CAPTURA_ARCHIVO)
+
+_cola: Optional[queue.Queue] = None
+_hilo: Optional[threading.Thread] = None
+_FIN = object()
+
+
+def _hash(valor: str) -> str:
+    return hmac.new(CAPTURA_SAL, valor.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def _seudonimo(clave: str, valor):
+    if not isinstance(valor, str) or not valor:
+        return valor
+    h = _hash(valor)[:10]
+    return f"{h}@example.com" if clave == "email" else h
+
+
+def sanear(datos):
+    """Copia de un cuerpo JSON con los datos personales sustituidos por seudónimos."""
+    if isinstance(datos, dict):
+        return {k: _seudonimo(k, v) if k in CAMPOS_PERSONALES else sanear(v) for k, v in datos.items()}
+    if isinstance(datos, list):
+        return [sanear(v) for v in datos]
+    return datos
+
+
+def _query_string(request) -> str:
+    query = request.scope.get("query_string", b"").decode("latin-1")
+    pares = parse_qsl(query, keep_blank_values=True)
+    if not any(clave in CAMPOS_PERSONALES for clave, _ in pares):
+        return query # Sin datos personales se guarda tal cual, sin volver a codificarla
+    return urlencode([(clave, _seudonimo(clave, valor) if clave in CAMPOS_PERSONALES else valor) for clave, valor in pares])
+
+
+def _cuerpo(request):
+    # FastAPI ya leyó el cuerpo para validarlo; Request lo guarda en _body
+    cuerpo = getattr(request, "_body", None)
+    if not cuerpo or len(cuerpo) > CAPTURA_MAX_CUERPO:
+        return None
+    if not request.headers.get("content-type", "").startswith("application/json"):
+        return None
+    try:
+        return sanear(json.loads(cuerpo))
+    except ValueError:
+        return None
+
+
+def _capturar_sujeto(sujeto: Optional[str]) -> bool:
+    if CAPTURA_MUESTREO >= 1:
+        return True
+    if sujeto is None:
+        return random.random() < CAPTURA_MUESTREO
+    return int(sujeto[:8], 16) / 0x100000000 < CAPTURA_MUESTREO
+
+
+def registrar(request, ruta: str, estado: int, duracion_s: float):
+    """Encola la petición ya respondida. Lo llama metricas.RutaMedida si la captura está activa."""
+    if _cola is None or "batch" in request.scope or ruta in CAPTURA_EXCLUIR:
+        # Las subpeticiones de /batch se reproducen con la propia petición /batch
+        return
+    sub = getattr(request.state, "sujeto", None)
+    sujeto = _hash(sub) if sub else None
+    if not _capturar_sujeto(sujeto):
+        return
+    evento = {
+        "t": round(time.time() - duracion_s, 4), "m": request.method, "r": ruta, "p": request.url.path,
+        "q": _query_string(request), "s": estado, "d": round(duracion_s * 1000, 2), "u": sujeto,
+    }
+    cuerpo = _cuerpo(request)
+    if cuerpo is not None:
+        evento["b"] = cuerpo
+    if getattr(request.state, "admin", False):
+        evento["a"] = 1
+    try:
+        _cola.put_nowait(evento)
+    except queue.Full:
+        DESCARTADAS.inc()
+
+
+def _abrir():
+    ruta = CAPTURA_ARCHIVO.replace("{pid}", str(os.getpid()))
+    # Modo 'a': nunca se reescribe lo ya capturado. En gzip cada apertura añade un miembro nuevo,
+    # y gzip.open lee los miembros concatenados como un solo archivo.
+    return gzip.open(ruta, "at", encoding="utf-8") if ruta.endswith(".gz") else open(ruta, "a", encoding="utf-8")
+
+
+def _escribir(cola: queue.Queue):
+    with _abrir() as archivo:
+        ultimo_flush = time.monotonic()
+        while True:
+            try:
+                evento = cola.get(timeout=1.0)
+            except queue.Empty:
+                evento = None
+            if evento is _FIN:
+                return
+            if evento is not None:
+                archivo.write(json.dumps(evento, ensure_ascii=False, separators=(",", ":")) + "\n")
+            # Escritura agrupada: un flush por segundo como mucho, o tras un segundo sin peticiones
+            if evento is None or time.monotonic() - ultimo_flush >= 1.0:
+                archivo.flush()
+                ultimo_flush = time.monotonic()
+
+
+def _iniciar():
+    global _cola, _hilo
+    _cola = queue.Queue(CAPTURA_COLA)
+    _hilo = threading.Thread(target=_escribir, args=(_cola,), name="captura-trafico", daemon=True)
+    _hilo.start()
+
+
+def _motivo_para_no_capturar(tras_fork: bool = False) -> Optional[str]:
+    if not CAPTURA_SAL:
+        return "CAPTURA_SAL no está definida"
+    if "{pid}" not in CAPTURA_ARCHIVO and (tras_fork or int(os.getenv("WEB_CONCURRENCY", "1")) > 1):
+        return "con varios procesos CAPTURA_ARCHIVO debe contener '{pid}'"
+    return None
+
+
+def _desactivar(motivo: str):
+    global activa, _cola
+    activa = False
+    _cola = None
+    logger.error("Captura de tráfico desactivada: %s", motivo)
+
+
+def _iniciar_tras_fork():
+    motivo = _motivo_para_no_capturar(tras_fork=True)
+    if motivo:
+        _desactivar(motivo)
+    else:
+        _iniciar()
+
+
+def detener():
+    """Escribe lo pendiente y cierra el archivo."""
+    if _hilo is not None and _hilo.is_alive():
+        _cola.put(_FIN)
+        _hilo.join(timeout=5)
+
+
+def configurar():
+    if not activa or _cola is not None:
+        return
+    motivo = _motivo_para_no_capturar()
+    if motivo:
+        _desactivar(motivo)
+        return
+    _iniciar()
+    # Tras el fork de gunicorn el hilo no existe en el hijo: cada worker abre el archivo y arranca el suyo
+    os.register_at_fork(after_in_child=_iniciar_tras_fork)
+    atexit.register(detener)
+    logger.info("Capturando tráfico en %s (muestreo %s)", CAPTURA_ARCHIVO, CAPTURA_MUESTREO)
+
+
+configurar()
@@ -0,0 +1,264 @@
+# library_project/backend/catalogo.py
+"""
+Catálogo público (/catalogo/...): lecturas sin autenticación de libros, disponibilidad y
+recomendaciones para los quioscos y el OPAC, servidas sin pasar por Keycloak y, casi siempre,
+sin consultar PostgreSQL.
+
+- Caché de respuestas en proceso (CacheRespuestas): guarda el cuerpo JSON ya serializado, su ETag y
+  las variantes comprimidas que se van pidiendo, así un acierto no serializa ni comprime nada.
+- Cada entrada es fresca durante 'frescura' segundos (max-age) y después, durante 'obsoleta'
+  segundos más (stale-while-revalidate), se sigue sirviendo mientras un hilo aparte la regenera.
+  Pasado ese tiempo se regenera en la propia petición, y si llegan varias a la vez solo una consulta
+  la base de datos (las demás esperan su resultado).
+- Las respuestas llevan Cache-Control public con los mismos tiempos, Age y ETag, para que los
+  navegadores y cualquier caché intermedia hagan lo mismo; If-None-Match devuelve 304.
+- Invalidación: al confirmar una transacción de este proceso que toca libros (también sus contadores
+  de disponibilidad, que cambian con préstamos y devoluciones) o recomendaciones, se descartan las
+  entradas afectadas. Los demás workers descartan las de disponibilidad al recibir el NOTIFY de
+  disponibilidad.py; el resto de cambios los ven al caducar la entrada (CATALOGO_FRESCURA_S). Esos
+  mismos libros se marcan para regenerar sus instantáneas en disco (ver instantaneas.py).
+- Las páginas del listado se piden por clave (?despues_de=<último id recibido>), no con OFFSET: el coste
+  no crece con la página y cada una cubre un rango de ids conocido, así que un cambio en un libro solo
+  descarta la página que lo contiene (o la última, si es un libro nuevo).
+- Una invalidación solo afecta a las claves que cumplen su condición: una regeneración en curso de esas
+  claves que empezó antes no se guarda, y las que empiezan en los CATALOGO_VENTANA_PRIMARIA_S segundos
+  siguientes leen de la primaria, porque una réplica podría no tener aún el cambio.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Optional, Set, Tuple
+
+import orjson
+from fastapi import Request, Response
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from . import compresion, instantaneas, models
+from .replicas import DB_REPLICA_LAG_CHECK_S, DB_REPLICA_MAX_LAG_S
+
+CATALOGO_FRESCURA_S = int(os.getenv("CATALOGO_FRESCURA_S", "60"))
+CATALOGO_FRESCURA_DISPONIBILIDAD_S = int(os.getenv("CATALOGO_FRESCURA_DISPONIBILIDAD_S", "10"))
+CATALOGO_OBSOLETA_S = int(os.getenv("CATALOGO_OBSOLETA_S", "300"))
+CATALOGO_CACHE_ENTRADAS = int(os.getenv("CATALOGO_CACHE_ENTRADAS", "5000"))
+CATALOGO_LIMITE = int(os.getenv("CATALOGO_LIMITE", "100"))
+# Retraso máximo con que una réplica en uso puede ver un cambio: el máximo admitido más lo que tarda en comprobarse
+CATALOGO_VENTANA_PRIMARIA_S = float(os.getenv("CATALOGO_VENTANA_PRIMARIA_S", str(DB_REPLICA_MAX_LAG_S + DB_REPLICA_LAG_CHECK_S)))
+
+# Atributos de Libro que aparecen en las recomendaciones (los contadores no)
+_CAMPOS_RECOMENDACION = ("titulo", "autor", "portadaURI")
+
+logger = logging.getLogger(__name__)
+
+
+# Lo que devuelve la función que genera una entrada: el cuerpo y, para las páginas del listado, el
+# rango de ids (despues_de, último id o None si la página no está llena)
+Generado = Tuple[Optional[bytes], Optional[tuple]]
+
+
+class Entrada:
+    __slots__ = ("cuerpo", "rango", "etag", "creada", "frescura", "obsoleta", "revalidando", "variantes")
+
+    def __init__(self, cuerpo: Optional[bytes], frescura: int, obsoleta: int, rango: Optional[tuple] = None):
+        self.cuerpo = cuerpo # None: el recurso no existe (404, también se cachea)
+        self.rango = rango
+        self.etag = hashlib.blake2b(cuerpo or b"", digest_size=12).hexdigest()
+        self.creada = time.monotonic()
+        self.frescura = frescura
+        self.obsoleta = obsoleta
+        self.revalidando = False
+        self.variantes: Dict[str, bytes] = {}
+
+    def edad(self) -> float:
+        return time.monotonic() - self.creada
+
+    def comprimida(self, codificacion: str) -> bytes:
+        variante = self.variantes.get(codificacion)
+        if variante is None:
+            variante = self.variantes[codificacion] = compresion.comprimir_todo(codificacion, self.cuerpo)
+        return variante
+
+
+class CacheRespuestas:
+    """Caché LRU de respuestas con stale-while-revalidate y una sola regeneración a la vez por clave."""
+
+    def __init__(self, maximo: int, ventana_s: float = CATALOGO_VENTANA_PRIMARIA_S):
+        self.maximo = maximo
+        self.ventana_s = ventana_s
+        self._entradas: "OrderedDict[tuple, Entrada]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._en_curso: Dict[tuple, threading.Lock] = {}
+        # (momento, condición) de las invalidaciones de los últimos ventana_s segundos
+        self._invalidaciones: Deque[Tuple[float, Callable]] = deque()
+        self._ejecutor: Optional[ThreadPoolExecutor] = None
+        self._ejecutor_pid = None
+
+    def vigente(self, clave: tuple, generar: Callable[[bool], Generado]) -> Optional[Entrada]:
+        """Entrada fresca u obsoleta (en cuyo caso lanza su regeneración), o None si hay que generarla."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            self._entradas.move_to_end(clave)
+            edad = entrada.edad()
+            if edad < entrada.frescura:
+                return entrada
+            if edad >= entrada.frescura + entrada.obsoleta:
+                return None
+            if entrada.revalidando:
+                return entrada
+            entrada.revalidando = True
+        self._ejecutor_actual().submit(self._revalidar, clave, generar, entrada)
+        return entrada
+
+    def obtener(self, clave: tuple, generar: Callable[[bool], Generado], frescura: int, obsoleta: int) -> Entrada:
+        """Entrada vigente o recién generada. Bloquea: llamar desde un hilo, no desde el event loop."""
+        with self._lock:
+            bloqueo = self._en_curso.setdefault(clave, threading.Lock())
+        with bloqueo:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada.edad() < entrada.frescura + entrada.obsoleta:
+                return entrada # La generó otra petición mientras esta esperaba
+            entrada = self._generar(clave, generar, frescura, obsoleta)
+        with self._lock:
+            self._en_curso.pop(clave, None)
+        return entrada
+
+    def _invalidada(self, clave: tuple, rango: Optional[tuple], desde: float) -> bool:
+        # Llamar con self._lock. Sin rango conocido las condiciones de las páginas dan True (por si acaso)
+        return any(momento >= desde and condicion(clave, rango) for momento, condicion in self._invalidaciones)
+
+    def _podar(self, ahora: float):
+        while self._invalidaciones and ahora - self._invalidaciones[0][0] > self.ventana_s:
+            self._invalidaciones.popleft()
+
+    def _generar(self, clave: tuple, generar, frescura: int, obsoleta: int) -> Entrada:
+        with self._lock:
+            inicio = time.monotonic()
+            self._podar(inicio)
+            primaria = self._invalidada(clave, None, inicio - self.ventana_s)
+        cuerpo, rango = generar(primaria)
+        entrada = Entrada(cuerpo, frescura, obsoleta, rango)
+        with self._lock:
+            # Si la generación duró más que la ventana, ya no se sabe qué invalidaciones hubo mientras tanto
+            if time.monotonic() - inicio <= self.ventana_s and not self._invalidada(clave, rango, inicio):
+                self._entradas[clave] = entrada
+                self._entradas.move_to_end(clave)
+                while len(self._entradas) > self.maximo:
+                    self._entradas.popitem(last=False)
+        return entrada
+
+    def _revalidar(self, clave: tuple, generar, anterior: Entrada):
+        try:
+            self._generar(clave, generar, anterior.frescura, anterior.obsoleta)
+        except Exception:
+            # Se sigue sirviendo la entrada obsoleta; la próxima petición lo vuelve a intentar
+            logger.warning("No se pudo regenerar %s del catálogo", clave, exc_info=True)
+            anterior.revalidando = False
+
+    def _ejecutor_actual(self) -> ThreadPoolExecutor:
+        # Se crea en el primer uso de cada proceso: los hilos no sobreviven al fork de gunicorn
+        if self._ejecutor is None or self._ejecutor_pid != os.getpid():
+            self._ejecutor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="catalogo")
+            self._ejecutor_pid = os.getpid()
+        return self._ejecutor
+
+    def invalidar(self, condicion: Callable[[tuple, Optional[tuple]], bool]):
+        """Descarta las entradas cuya clave y rango cumplen 'condicion' (el rango es None si no se conoce)."""
+        with self._lock:
+            ahora = time.monotonic()
+            self._podar(ahora)
+            self._invalidaciones.append((ahora, condicion))
+            for clave in [c for c, entrada in self._entradas.items() if condicion(c, entrada.rango)]:
+                del self._entradas[clave]
+
+
+cache = CacheRespuestas(CATALOGO_CACHE_ENTRADAS)
+
+
+def _coincide(if_none_match: str, etag: str) -> bool:
+    for valor in if_none_match.split(","):
+        valor = valor.strip()
+        if valor == "*":
+            return True
+        # Las variantes comprimidas llevan el ETag base con el sufijo de la codificación
+        if valor.removeprefix("W/").strip('"').split("-")[0] == etag:
+            return True
+    return False
+
+
+def responder(request: Request, entrada: Entrada) -> Response:
+    cabeceras = {
+        "Cache-Control": f"public, max-age={entrada.frescura}, stale-while-revalidate={entrada.obsoleta}",
+        "Age": str(int(entrada.edad())),
+        "Vary": "Accept-Encoding",
+    }
+    if entrada.cuerpo is None:
+        return Response(orjson.dumps({"detail": "Libro no encontrado"}), status_code=404, media_type="application/json", headers=cabeceras)
+    codificacion = None
+    if len(entrada.cuerpo) >= compresion.COMPRESION_MINIMO:
+        codificacion = compresion.negociar(request.headers.get("accept-encoding", ""))
+    cabeceras["ETag"] = f'"{entrada.etag}-{codificacion}"' if codificacion else f'"{entrada.etag}"'
+    if _coincide(request.headers.get("if-none-match", ""), entrada.etag):
+        return Response(status_code=304, headers=cabeceras)
+    if codificacion is None:
+        return Response(entrada.cuerpo, media_type="application/json", headers=cabeceras)
+    # Variante comprimida guardada en la entrada: el middleware de compresión no la vuelve a comprimir
+    cabeceras["Content-Encoding"] = codificacion
+    return Response(entrada.comprimida(codificacion), media_type="application/json", headers=cabeceras)
+
+
+# --- Invalidación al confirmar escrituras de este proceso ---
+
+def _pagina_incluye(clave: tuple, rango: Optional[tuple], libros: Set[int]) -> bool:
+    # Página ("libros", despues_de, limit): ids en (despues_de, último]. Sin último (página no llena, a la
+    # que van los libros nuevos, o rango aún desconocido) el rango no tiene fin.
+    ultimo = rango[1] if rango is not None else None
+    return any(libro > clave[1] and (ultimo is None or libro <= ultimo) for libro in libros)
+
+
+def condicion_libros(libros: Set[int], origenes: Set[int] = frozenset(), todas_recomendaciones: bool = False) -> Callable:
+    """Condición de invalidar() para un cambio en estos libros y en las recomendaciones de estos orígenes."""
+    def afectada(clave: tuple, rango: Optional[tuple]) -> bool:
+        tipo = clave[0]
+        if tipo == "libros":
+            return _pagina_incluye(clave, rango, libros)
+        if tipo == "recomendaciones":
+            return todas_recomendaciones or clave[1] in origenes
+        return clave[1] in libros
+    return afectada
+
+
+@event.listens_for(Session, "after_flush")
+def _anotar_cambios(sesion, contexto):
+    libros = sesion.info.setdefault("catalogo_libros", set())
+    for obj in (*sesion.new, *sesion.dirty, *sesion.deleted):
+        if isinstance(obj, models.Libro):
+            libros.add(obj.id)
+            estado = inspect(obj)
+            if obj in sesion.deleted or any(estado.attrs[c].history.has_changes() for c in _CAMPOS_RECOMENDACION):
+                sesion.info["catalogo_recomendaciones"] = True
+        elif isinstance(obj, models.Recomendacion):
+            sesion.info.setdefault("catalogo_origenes", set()).add(obj.id_libro_origen)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidar(sesion):
+    libros = sesion.info.pop("catalogo_libros", None) or set()
+    origenes = sesion.info.pop("catalogo_origenes", None) or set()
+    todas_recomendaciones = sesion.info.pop("catalogo_recomendaciones", False)
+    if libros and instantaneas.activas:
+        instantaneas.instantaneas.marcar(libros)
+    if not (libros or origenes):
+        return
+    cache.invalidar(condicion_libros(libros, origenes, todas_recomendaciones))
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_cambios(sesion):
+    for clave in ("catalogo_libros", "catalogo_origenes", "catalogo_recomendaciones"):
+        sesion.info.pop(clave, None)
@@ -0,0 +1,208 @@
+# library_project/backend/compresion.py
+"""
+Compresión de las respuestas negociada con Accept-Encoding: zstd, brotli ("br") o gzip.
+
+Los listados (/libros/, /usuarios/, historiales) devuelven hasta 100 objetos JSON con nombres de
+campo largos y direcciones, muy repetitivos: comprimidos ocupan entre 7 y 10 veces menos, lo que en
+la WAN del campus ahorra mucho más tiempo del que cuesta comprimir (ver benchmarks/bench_compresion.py).
+
+- Solo se comprimen los tipos de COMPRIMIBLES y las respuestas de al menos COMPRESION_MINIMO bytes:
+  por debajo, las cabeceras y la CPU cuestan más de lo que se ahorra.
+- COMPRESION_CODIFICACIONES fija el orden de preferencia del servidor; de las que acepta el cliente
+  se usa la primera. brotli y zstandard son dependencias opcionales: si no están instaladas, esa
+  codificación no se ofrece y se usa gzip.
+- COMPRESION_NIVEL_GZIP, COMPRESION_NIVEL_BR y COMPRESION_NIVEL_ZSTD: nivel de cada una. Con los
+  valores por defecto (gzip 6, br 4, zstd 3) comprimir una página de 100 objetos cuesta menos de
+  medio milisegundo; los niveles altos (brotli 11, zstd 19) son para contenido estático, no por petición.
+- Las respuestas en streaming (StreamingResponse, como /exportar/...) se comprimen fragmento a
+  fragmento, con un flush tras cada uno para que el cliente reciba los datos según se generan.
+- Los cuerpos de COMPRESION_HILO_BYTES o más se comprimen en el threadpool: zlib, brotli y zstd
+  liberan el GIL y así el event loop no se detiene mientras tanto.
+- Las respuestas que ya traen Content-Encoding (archivos precomprimidos) no se tocan.
+"""
+import os
+import zlib
+from functools import lru_cache
+from typing import Optional
+
+import anyio
+
+try:
+    import brotli
+except ImportError: # Dependencia opcional
+    brotli = None
+try:
+    import zstandard
+except ImportError: # Dependencia opcional
+    zstandard = None
+
+COMPRESION_ACTIVA = os.getenv("COMPRESION", "1") == "1"
+COMPRESION_MINIMO = int(os.getenv("COMPRESION_MINIMO", "1024"))
+COMPRESION_HILO_BYTES = int(os.getenv("COMPRESION_HILO_BYTES", "262144"))
+COMPRESION_NIVEL_GZIP = int(os.getenv("COMPRESION_NIVEL_GZIP", "6"))
+COMPRESION_NIVEL_BR = int(os.getenv("COMPRESION_NIVEL_BR", "4"))
+COMPRESION_NIVEL_ZSTD = int(os.getenv("COMPRESION_NIVEL_ZSTD", "3"))
+
+COMPRIMIBLES = ("application/json", "application/x-ndjson", "text/plain", "text/csv", "text/html", "application/javascript")
+
+DISPONIBLES = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+CODIFICACIONES = [c.strip() for c in os.getenv("COMPRESION_CODIFICACIONES", "zstd,br,gzip").split(",") if DISPONIBLES.get(c.strip())]
+
+
+class CompresorGzip:
+    def __init__(self, nivel: int = COMPRESION_NIVEL_GZIP):
+        self._c = zlib.compressobj(nivel, zlib.DEFLATED, 31) # wbits 31: formato gzip
+
+    def comprimir(self, datos: bytes) -> bytes:
+        return self._c.compress(datos) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def terminar(self) -> bytes:
+        return self._c.flush()
+
+
+class CompresorBrotli:
+    def __init__(self, nivel: int = COMPRESION_NIVEL_BR):
+        self._c = brotli.Compressor(quality=nivel)
+
+    def comprimir(self, datos: bytes) -> bytes:
+        return self._c.process(datos) + self._c.flush()
+
+    def terminar(self) -> bytes:
+        return self._c.finish()
+
+
+class CompresorZstd:
+    def __init__(self, nivel: int = COMPRESION_NIVEL_ZSTD):
+        self._c = zstandard.ZstdCompressor(level=nivel).compressobj()
+
+    def comprimir(self, datos: bytes) -> bytes:
+        return self._c.compress(datos) + self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def terminar(self) -> bytes:
+        return self._c.flush()
+
+
+COMPRESORES = {"gzip": CompresorGzip, "br": CompresorBrotli, "zstd": CompresorZstd}
+
+
+def comprimir_todo(codificacion: str, datos: bytes, nivel: Optional[int] = None) -> bytes:
+    """Comprime un cuerpo completo de una vez (sin flush intermedio)."""
+    if codificacion == "gzip":
+        c = zlib.compressobj(COMPRESION_NIVEL_GZIP if nivel is None else nivel, zlib.DEFLATED, 31)
+        return c.compress(datos) + c.flush()
+    if codificacion == "br":
+        return brotli.compress(datos, quality=COMPRESION_NIVEL_BR if nivel is None else nivel)
+    return zstandard.ZstdCompressor(level=COMPRESION_NIVEL_ZSTD if nivel is None else nivel).compress(datos)
+
+
+@lru_cache(maxsize=128)
+def negociar(accept_encoding: str) -> Optional[str]:
+    """Codificación a usar según Accept-Encoding (los clientes repiten la misma cabecera: se cachea)."""
+    aceptadas = {}
+    for parte in accept_encoding.lower().split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        calidad = 1.0
+        parametros = parametros.strip()
+        if parametros.startswith("q="):
+            try:
+                calidad = float(parametros[2:])
+            except ValueError:
+                calidad = 0.0
+        aceptadas[nombre.strip()] = calidad
+    for codificacion in CODIFICACIONES:
+        if aceptadas.get(codificacion, aceptadas.get("*", 0.0)) > 0:
+            return codificacion
+    return None
+
+
+def _comprimible(cabeceras: list) -> bool:
+    tipo = b""
+    for nombre, valor in cabeceras:
+        if nombre == b"content-encoding":
+            return False
+        if nombre == b"content-type":
+            tipo = valor
+    return tipo.decode("latin-1").startswith(COMPRIMIBLES)
+
+
+async def _ejecutar(funcion, *args):
+    # Con cuerpos grandes la compresión se hace en el threadpool (los compresores liberan el GIL)
+    if sum(len(a) for a in args if isinstance(a, bytes)) >= COMPRESION_HILO_BYTES:
+        return await anyio.to_thread.run_sync(funcion, *args)
+    return funcion(*args)
+
+
+class Compresion:
+    """Middleware ASGI: comprime las respuestas según la codificación negociada."""
+
+    def __init__(self, app, minimo: int = COMPRESION_MINIMO):
+        self.app = app
+        self.minimo = minimo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for nombre, valor in scope["headers"]:
+            if nombre == b"accept-encoding":
+                accept_encoding = valor.decode("latin-1")
+                break
+        codificacion = negociar(accept_encoding) if accept_encoding else None
+        estado = {"inicio": None, "compresor": None, "directo": False}
+
+        async def enviar(mensaje):
+            if estado["directo"]:
+                await send(mensaje)
+                return
+            if mensaje["type"] == "http.response.start":
+                # Se retiene hasta ver el primer fragmento del cuerpo y decidir si se comprime
+                estado["inicio"] = mensaje
+                return
+            if mensaje["type"] != "http.response.body":
+                # Otros tipos de cuerpo (http.response.pathsend de FileResponse): se envían tal cual
+                estado["directo"] = True
+                if estado["inicio"] is not None:
+                    await send(estado["inicio"])
+                await send(mensaje)
+                return
+
+            inicio = estado["inicio"]
+            compresor = estado["compresor"]
+            cuerpo = mensaje.get("body", b"")
+            mas = mensaje.get("more_body", False)
+            if compresor is None:
+                cabeceras = list(inicio.get("headers", []))
+                if inicio["status"] in (204, 304) or not _comprimible(cabeceras):
+                    estado["directo"] = True
+                    await send(inicio)
+                    await send(mensaje)
+                    return
+                # Aunque esta respuesta no se comprima, la de otro cliente sí: las cachés deben distinguirlas
+                cabeceras.append((b"vary", b"Accept-Encoding"))
+                if codificacion is None or (not mas and len(cuerpo) < self.minimo):
+                    estado["directo"] = True
+                    await send(dict(inicio, headers=cabeceras))
+                    await send(mensaje)
+                    return
+                cabeceras = [(n, v) for n, v in cabeceras if n != b"content-length"]
+                cabeceras.append((b"content-encoding", codificacion.encode()))
+                if not mas:
+                    # Respuesta completa: compresión de una vez, con Content-Length
+                    comprimido = await _ejecutar(comprimir_todo, codificacion, cuerpo)
+                    cabeceras.append((b"content-length", str(len(comprimido)).encode()))
+                    estado["directo"] = True
+                    await send(dict(inicio, headers=cabeceras))
+                    await send({"type": "http.response.body", "body": comprimido})
+                    return
+                # Streaming: Transfer-Encoding chunked, un flush por fragmento
+                compresor = estado["compresor"] = COMPRESORES[codificacion]()
+                await send(dict(inicio, headers=cabeceras))
+
+            datos = await _ejecutar(compresor.comprimir, cuerpo) if cuerpo else b""
+            if not mas:
+                datos += compresor.terminar()
+            if datos or not mas:
+                await send({"type": "http.response.body", "body": datos, "more_body": mas})
+
+        await self.app(scope, receive, enviar)
@@ -0,0 +1,137 @@
+# library_project/backend/consultas_lentas.py
+"""
+Registro de consultas lentas con captura de EXPLAIN (ANALYZE, BUFFERS).
+
+Cuando una sentencia tarda más de SQL_LENTA_MS se guarda en un buffer circular (las últimas
+SQL_LENTA_BUFFER de este worker) con sus parámetros, la ruta que la originó y su duración, y se
+registra un aviso en el log. GET /admin/consultas-lentas devuelve el buffer.
+
+El plan no se captura en el hilo de la petición: la sentencia se encola y un único hilo aparte
+ejecuta el EXPLAIN ANALYZE en otra conexión, dentro de una transacción que se deshace. Para que
+la captura no añada carga en producción:
+- solo se analizan SELECT (EXPLAIN ANALYZE ejecuta la sentencia de verdad),
+- los SELECT que bloquean filas (FOR UPDATE/FOR SHARE: harían esperar a las peticiones que usan esas
+  filas) o tienen efectos (pg_notify, nextval, setval, advisory locks) se explican sin ANALYZE, con el
+  plan estimado y sin ejecutarlos (una función propia con efectos no se detecta),
+- se captura como mucho un plan por sentencia cada SQL_LENTA_INTERVALO_S segundos,
+- solo se muestrea la fracción SQL_LENTA_MUESTREO de las consultas lentas,
+- si ya hay SQL_LENTA_COLA capturas pendientes, las nuevas se descartan.
+Con el modo asíncrono (asyncpg) se registran las consultas lentas pero sin plan.
+"""
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metricas import ruta_actual
+
+SQL_LENTA_MS = float(os.getenv("SQL_LENTA_MS", "200"))
+SQL_LENTA_BUFFER = int(os.getenv("SQL_LENTA_BUFFER", "100"))
+SQL_LENTA_EXPLAIN = os.getenv("SQL_LENTA_EXPLAIN", "1") == "1"
+SQL_LENTA_MUESTREO = float(os.getenv("SQL_LENTA_MUESTREO", "1"))
+SQL_LENTA_INTERVALO_S = float(os.getenv("SQL_LENTA_INTERVALO_S", "60"))
+SQL_LENTA_COLA = int(os.getenv("SQL_LENTA_COLA", "4"))
+SQL_LENTA_TIMEOUT_EXPLAIN = os.getenv("SQL_LENTA_TIMEOUT_EXPLAIN", "10s") # statement_timeout del EXPLAIN
+
+logger = logging.getLogger(__name__)
+
+# SELECT que no se ejecutan con EXPLAIN ANALYZE (ver arriba)
+_SIN_ANALYZE = re.compile(r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b"
+                          r"|\b(pg_notify|nextval|setval|pg_(try_)?advisory_\w+)\s*\(", re.IGNORECASE)
+
+_registro = deque(maxlen=SQL_LENTA_BUFFER)
+_ultimo_plan = {} # sentencia -> momento de la última captura
+_lock = threading.Lock()
+_pendientes = 0
+_hilo = threading.local() # capturando=True en el hilo de captura mientras ejecuta el EXPLAIN
+# Un solo hilo: como mucho un EXPLAIN ANALYZE a la vez por worker
+_capturador = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain-consultas-lentas")
+
+
+def _texto_parametros(parametros) -> str:
+    texto = repr(parametros)
+    return texto if len(texto) <= 1000 else texto[:1000] + "..."
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _inicio(conn, cursor, statement, parameters, context, executemany):
+    conn.info["inicio_consulta_lenta"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _fin(conn, cursor, statement, parameters, context, executemany):
+    inicio = conn.info.pop("inicio_consulta_lenta", None)
+    if inicio is None:
+        return
+    duracion_ms = (time.perf_counter() - inicio) * 1000
+    if duracion_ms < SQL_LENTA_MS or getattr(_hilo, "capturando", False): # Lo que ejecuta la propia captura no se registra
+        return
+    entrada = {
+        "fecha": datetime.now(timezone.utc),
+        "duracion_ms": round(duracion_ms, 2),
+        "ruta": ruta_actual(),
+        "sentencia": statement,
+        "parametros": _texto_parametros(parameters),
+        "plan": None,
+        "estado_plan": "no capturado",
+    }
+    _registro.append(entrada)
+    if _encolar_plan(conn, statement, parameters, executemany, entrada):
+        return # El aviso se registra con el plan cuando se capture
+    logger.warning("Consulta lenta (%.0f ms) en %s: %s parámetros=%s", duracion_ms, entrada["ruta"], " ".join(statement.split()), entrada["parametros"])
+
+
+def _encolar_plan(conn, statement, parameters, executemany, entrada) -> bool:
+    global _pendientes
+    if not SQL_LENTA_EXPLAIN or executemany or conn.dialect.is_async:
+        return False
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return False
+    if random.random() >= SQL_LENTA_MUESTREO:
+        return False
+    ahora = time.monotonic()
+    with _lock:
+        if _pendientes >= SQL_LENTA_COLA or ahora - _ultimo_plan.get(statement, float("-inf")) < SQL_LENTA_INTERVALO_S:
+            return False
+        _ultimo_plan[statement] = ahora
+        _pendientes += 1
+    entrada["estado_plan"] = "pendiente"
+    _capturador.submit(_capturar_plan, conn.engine, statement, parameters, entrada, not _SIN_ANALYZE.search(statement))
+    return True
+
+
+def _capturar_plan(engine: Engine, statement: str, parameters, entrada: dict, analizar: bool = True):
+    global _pendientes
+    _hilo.capturando = True
+    try:
+        with engine.connect() as conn:
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = '{SQL_LENTA_TIMEOUT_EXPLAIN}'")
+            explain = "EXPLAIN (ANALYZE, BUFFERS) " if analizar else "EXPLAIN "
+            filas = conn.exec_driver_sql(explain + statement, parameters).scalars().all()
+            conn.rollback()
+        entrada["plan"] = "\n".join(filas)
+        entrada["estado_plan"] = "capturado" if analizar else "capturado (estimado, sin ANALYZE)"
+        logger.warning("Consulta lenta (%.0f ms) en %s: %s parámetros=%s\n%s", entrada["duracion_ms"], entrada["ruta"],
+                       " ".join(statement.split()), entrada["parametros"], entrada["plan"])
+    except Exception as e:
+        entrada["estado_plan"] = f"error: {type(e).__name__}"
+        logger.warning("Consulta lenta (%.0f ms) en %s: %s parámetros=%s (no se pudo capturar el plan: %s)", entrada["duracion_ms"],
+                       entrada["ruta"], " ".join(statement.split()), entrada["parametros"], e)
+    finally:
+        _hilo.capturando = False
+        with _lock:
+            _pendientes -= 1
+
+
+def consultas_lentas() -> List[dict]:
+    """Las consultas lentas registradas en este worker, de la más reciente a la más antigua."""
+    return list(reversed(_registro))
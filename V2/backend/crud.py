@@ -1,9 +1,133 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from . import models, schemas
+from sqlalchemy.orm import Session, joinedload, load_only, selectinload
+from sqlalchemy import or_, select, func, literal_column, true, exists, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from . import disponibilidad, models, schemas
 from typing import List, Optional, Union
 from datetime import date, timedelta
 
+# --- Consultas de solo columnas (ruta rápida de los listados) ---
+# Seleccionan únicamente las columnas del esquema de salida y devuelven diccionarios,
+# sin cargar objetos ORM en el identity map ni validar cada fila con Pydantic.
+
+def _select_filas(db: Session, modelo, esquema, *criterios, skip: int = 0, limit: int = 100, campos: Optional[List[str]] = None):
+    columnas = [modelo.__table__.c[nombre] for nombre in (campos or esquema.model_fields)]
+    stmt = select(*columnas).where(*criterios).offset(skip).limit(limit)
+    return [dict(fila) for fila in db.execute(stmt).mappings()]
+
+# Relaciones que se pueden incrustar en el listado de libros, con el esquema de cada elemento
+EXPANSIONES_LIBRO = {
+    "ejemplares": (models.Libro.ejemplares, schemas.Ejemplar),
+    "recomendaciones": (models.Libro.recomendaciones_origen, schemas.Recomendacion),
+}
+
+def get_libros_filas(db: Session, skip: int = 0, limit: int = 100, campos: Optional[List[str]] = None, expand: Optional[List[str]] = None):
+    if not expand:
+        return _select_filas(db, models.Libro, schemas.Libro, skip=skip, limit=limit, campos=campos)
+
+    # Con expansiones se usa el ORM con selectinload: una consulta para los libros y una
+    # por cada relación expandida, sin importar el tamaño de la página.
+    campos = campos or list(schemas.Libro.model_fields)
+    opciones = [load_only(*[getattr(models.Libro, nombre) for nombre in campos])]
+    opciones += [selectinload(EXPANSIONES_LIBRO[nombre][0]) for nombre in expand]
+    libros = db.query(models.Libro).options(*opciones).offset(skip).limit(limit).all()
+
+    filas = []
+    for libro in libros:
+        fila = {nombre: getattr(libro, nombre) for nombre in campos}
+        for nombre in expand:
+            relacion, esquema = EXPANSIONES_LIBRO[nombre]
+            fila[nombre] = [{c: getattr(obj, c) for c in esquema.model_fields} for obj in getattr(libro, relacion.key)]
+        filas.append(fila)
+    return filas
+
+def get_libros_filas_despues_de(db: Session, despues_de: int = 0, limit: int = 100):
+    # Paginación por clave (catálogo público): recorre el índice de la clave primaria desde 'despues_de',
+    # así el coste no depende de la página, como con OFFSET
+    columnas = [models.Libro.__table__.c[nombre] for nombre in schemas.Libro.model_fields]
+    stmt = select(*columnas).where(models.Libro.id > despues_de).order_by(models.Libro.id).limit(limit)
+    return [dict(fila) for fila in db.execute(stmt).mappings()]
+
+def get_libro_fila(db: Session, libro_id: int) -> Optional[dict]:
+    filas = _select_filas(db, models.Libro, schemas.Libro, models.Libro.id == libro_id, limit=1)
+    return filas[0] if filas else None
+
+def get_disponibilidad_fila(db: Session, libro_id: int) -> Optional[dict]:
+    filas = _select_filas(db, models.Libro, schemas.DisponibilidadLibro, models.Libro.id == libro_id, limit=1)
+    return filas[0] if filas else None
+
+def get_libros_recomendados_filas(db: Session, libro_id: int, limit: int = 20):
+    # Los libros recomendados desde 'libro_id', con los datos que muestra el catálogo
+    libros = models.Libro.__table__
+    stmt = (
+        select(*[libros.c[nombre] for nombre in schemas.LibroRecomendado.model_fields])
+        .join(models.Recomendacion.__table__, models.Recomendacion.id_libro_recomendado == libros.c.id)
+        .where(models.Recomendacion.id_libro_origen == libro_id)
+        .order_by(models.Recomendacion.id)
+        .limit(limit)
+    )
+    return [dict(fila) for fila in db.execute(stmt).mappings()]
+
+def get_ejemplares_filas(db: Session, skip: int = 0, limit: int = 100):
+    return _select_filas(db, models.Ejemplar, schemas.Ejemplar, skip=skip, limit=limit)
+
+def get_prestamos_filas(db: Session, skip: int = 0, limit: int = 100):
+    return _select_filas(db, models.Prestamo, schemas.Prestamo, skip=skip, limit=limit)
+
+def get_prestamos_historicos_filas_by_usuario(db: Session, usuario_id: int, skip: int = 0, limit: int = 100):
+    return _select_filas(db, models.PrestamoHistorico, schemas.PrestamoHistorico, models.PrestamoHistorico.id_usuario == usuario_id, skip=skip, limit=limit)
+
+def get_multas_historicas_filas_by_usuario(db: Session, usuario_id: int, skip: int = 0, limit: int = 100):
+    return _select_filas(db, models.MultaHistorica, schemas.MultaHistorica, models.MultaHistorica.id_usuario == usuario_id, skip=skip, limit=limit)
+
+def _select_usuarios():
+    # Herencia por tablas unidas: se traen las columnas de ambos subtipos con outer join
+    # y luego se descarta la que no corresponde a cada fila.
+    usuarios = models.Usuario.__table__
+    profesores = models.Profesor.__table__
+    alumnos = models.Alumno.__table__
+    return (
+        select(*[usuarios.c[nombre] for nombre in schemas.Usuario.model_fields], profesores.c.departamento, alumnos.c.telefono_padres)
+        .select_from(usuarios.outerjoin(profesores, profesores.c.id == usuarios.c.id).outerjoin(alumnos, alumnos.c.id == usuarios.c.id))
+        .where(usuarios.c.tipo_usuario.in_(["profesor", "alumno"]))
+    )
+
+def get_usuarios_filas(db: Session, skip: int = 0, limit: int = 100):
+    stmt = _select_usuarios().offset(skip).limit(limit)
+    return [_fila_usuario(fila) for fila in db.execute(stmt).mappings()]
+
+def _fila_usuario(fila) -> dict:
+    # Deja solo la columna propia del subtipo (departamento o telefono_padres)
+    fila = dict(fila)
+    if fila["tipo_usuario"] == "profesor":
+        del fila["telefono_padres"]
+    else:
+        del fila["departamento"]
+    return fila
+
+# --- Exportaciones completas (por lotes) ---
+
+def _exportar_filas(db: Session, stmt, lote: int):
+    # Cursor de servidor (stream_results): PostgreSQL entrega las filas de 'lote' en 'lote',
+    # sin cargar la tabla entera en memoria.
+    resultado = db.execute(stmt, execution_options={"stream_results": True, "yield_per": lote})
+    for filas in resultado.mappings().partitions():
+        yield filas
+
+def exportar_libros_filas(db: Session, lote: int = 1000):
+    columnas = [models.Libro.__table__.c[nombre] for nombre in schemas.Libro.model_fields]
+    for filas in _exportar_filas(db, select(*columnas).order_by(models.Libro.id), lote):
+        yield [dict(fila) for fila in filas]
+
+def exportar_usuarios_filas(db: Session, lote: int = 1000):
+    for filas in _exportar_filas(db, _select_usuarios().order_by(models.Usuario.__table__.c.id), lote):
+        yield [_fila_usuario(fila) for fila in filas]
+
+def exportar_prestamos_historicos_filas(db: Session, lote: int = 1000):
+    columnas = [models.PrestamoHistorico.__table__.c[nombre] for nombre in schemas.PrestamoHistorico.model_fields]
+    for filas in _exportar_filas(db, select(*columnas).order_by(models.PrestamoHistorico.id), lote):
+        yield [dict(fila) for fila in filas]
+
+
 # --- CRUD para Libros ---
 
 def get_libro(db: Session, libro_id: int):
@@ -26,13 +150,17 @@ def create_libro(db: Session, libro: schemas.LibroCreate):
         portadaURI=libro.portadaURI
     )
     db.add(db_libro)
+    disponibilidad.anotar(db, "alta", db_libro)
     db.commit()
     db.refresh(db_libro)
     return db_libro
 
 def update_libro(db: Session, db_libro: models.Libro, libro_update: schemas.LibroBase):
-    for key, value in libro_update.model_dump(exclude_unset=True).items():
+    cambios = libro_update.model_dump(exclude_unset=True)
+    for key, value in cambios.items():
         setattr(db_libro, key, value)
+    if "numEjemplares" in cambios or "numEjemplaresDisponibles" in cambios:
+        disponibilidad.anotar(db, "ejemplares", db_libro)
     db.add(db_libro)
     db.commit()
     db.refresh(db_libro)
@@ -40,7 +168,11 @@ def update_libro(db: Session, db_libro: models.Libro, libro_update: schemas.Libr
 
 def delete_libro(db: Session, db_libro: models.Libro):
     # Asegúrate de que no haya ejemplares asociados (la verificación se hace en el endpoint)
+    if db_libro.numReservas:
+        # Sin ejemplares solo puede haber reservas en espera: se descartan con el libro
+        db.query(models.Reserva).filter(models.Reserva.id_libro == db_libro.id).delete(synchronize_session=False)
     db.delete(db_libro)
+    disponibilidad.anotar(db, "baja", db_libro)
     db.commit()
 
 
@@ -70,7 +202,8 @@ def create_ejemplar(db: Session, ejemplar: schemas.EjemplarCreate):
     db_libro = get_libro(db, ejemplar.id_libro)
     if db_libro:
         db_libro.numEjemplares += 1
-        db_libro.numEjemplaresDisponibles += 1
+        _asignar_o_liberar(db, db_libro, db_ejemplar) # Si hay cola, el ejemplar nuevo es para la primera reserva
+        disponibilidad.anotar(db, "ejemplares", db_libro, db_ejemplar)
     db.commit()
     db.refresh(db_ejemplar)
     if db_libro:
@@ -91,19 +224,23 @@ def update_ejemplar(db: Session, db_ejemplar: models.Ejemplar, ejemplar_update:
         old_libro = get_libro(db, original_id_libro)
         if old_libro:
             old_libro.numEjemplares -= 1
-            # Cuidado: solo decrementa disponibles si el ejemplar NO estaba prestado
-            if not db_ejemplar.prestamo_activo: # Si el ejemplar no está prestado actualmente
+            # Cuidado: solo decrementa disponibles si el ejemplar NO estaba prestado ni apartado para una reserva
+            if db_ejemplar.reserva:
+                _devolver_a_la_cola(db, db_ejemplar.reserva, old_libro)
+            elif not db_ejemplar.prestamo_activo: # Si el ejemplar no está prestado actualmente
                 old_libro.numEjemplaresDisponibles -= 1
             db.add(old_libro) # Marcar para guardar cambios
+            disponibilidad.anotar(db, "ejemplares", old_libro, db_ejemplar)
 
         # Incrementar en el libro nuevo
         new_libro = get_libro(db, updated_id_libro)
         if new_libro:
             new_libro.numEjemplares += 1
-            # Cuidado: solo incrementa disponibles si el ejemplar NO estaba prestado
+            # Cuidado: solo incrementa disponibles si el ejemplar NO estaba prestado (con cola, va a la primera reserva)
             if not db_ejemplar.prestamo_activo:
-                new_libro.numEjemplaresDisponibles += 1
+                _asignar_o_liberar(db, new_libro, db_ejemplar)
             db.add(new_libro) # Marcar para guardar cambios
+            disponibilidad.anotar(db, "ejemplares", new_libro, db_ejemplar)
 
     db.add(db_ejemplar)
     db.commit()
@@ -120,9 +257,12 @@ def delete_ejemplar(db: Session, db_ejemplar: models.Ejemplar):
     db_libro = get_libro(db, db_ejemplar.id_libro)
     if db_libro:
         db_libro.numEjemplares -= 1
-        if not db_ejemplar.prestamo_activo: # Solo si no está prestado, estaba disponible
+        if db_ejemplar.reserva: # Apartado para una reserva: no contaba como disponible
+            _devolver_a_la_cola(db, db_ejemplar.reserva, db_libro)
+        elif not db_ejemplar.prestamo_activo: # Solo si no está prestado, estaba disponible
             db_libro.numEjemplaresDisponibles -= 1
         db.add(db_libro) # Marcar el libro para guardar cambios
+        disponibilidad.anotar(db, "ejemplares", db_libro, db_ejemplar)
         
     db.delete(db_ejemplar)
     db.commit()
@@ -206,8 +346,84 @@ def update_usuario(db: Session, db_usuario: models.Usuario, usuario_update: Unio
     db.refresh(db_usuario)
     return db_usuario
 
+def get_resumen_usuario(db: Session, usuario_id: int):
+    """
+    Perfil, préstamos activos (con título del libro), multa activa y totales del historial
+    de un usuario, en una sola consulta con subconsultas LATERAL (solo PostgreSQL).
+    Devuelve None si el usuario no existe.
+    """
+    usuarios = models.Usuario.__table__
+    profesores = models.Profesor.__table__
+    alumnos = models.Alumno.__table__
+    prestamos = models.Prestamo.__table__
+    ejemplares = models.Ejemplar.__table__
+    libros = models.Libro.__table__
+    multas = models.Multa.__table__
+    prestamos_historicos = models.PrestamoHistorico.__table__
+    multas_historicas = models.MultaHistorica.__table__
+
+    json_prestamo = func.json_build_object(
+        *[arg for nombre in schemas.Prestamo.model_fields for arg in (nombre, prestamos.c[nombre])],
+        "id_libro", libros.c.id,
+        "titulo", libros.c.titulo,
+    )
+    activos = (
+        select(func.coalesce(func.json_agg(aggregate_order_by(json_prestamo, prestamos.c.fecha_devolucion_esperada)), literal_column("'[]'::json")).label("prestamos_activos"))
+        .select_from(prestamos.join(ejemplares, ejemplares.c.id == prestamos.c.id_ejemplar).join(libros, libros.c.id == ejemplares.c.id_libro))
+        .where(prestamos.c.id_usuario == usuarios.c.id)
+        .lateral("activos")
+    )
+    multa = (
+        select(func.json_build_object(*[arg for nombre in schemas.Multa.model_fields for arg in (nombre, multas.c[nombre])]).label("multa_activa"))
+        .where(multas.c.id_usuario == usuarios.c.id)
+        .lateral("multa")
+    )
+    historial = (
+        select(
+            func.count().label("num_prestamos_historicos"),
+            func.count(prestamos_historicos.c.id_multa).label("num_prestamos_historicos_con_multa"),
+        )
+        .where(prestamos_historicos.c.id_usuario == usuarios.c.id)
+        .lateral("historial")
+    )
+    historial_multas = (
+        select(func.count().label("num_multas_historicas"))
+        .where(multas_historicas.c.id_usuario == usuarios.c.id)
+        .lateral("historial_multas")
+    )
+    stmt = (
+        select(
+            *[usuarios.c[nombre] for nombre in schemas.Usuario.model_fields],
+            profesores.c.departamento,
+            alumnos.c.telefono_padres,
+            activos.c.prestamos_activos,
+            multa.c.multa_activa,
+            historial.c.num_prestamos_historicos,
+            historial.c.num_prestamos_historicos_con_multa,
+            historial_multas.c.num_multas_historicas,
+        )
+        .select_from(
+            usuarios.outerjoin(profesores, profesores.c.id == usuarios.c.id)
+            .outerjoin(alumnos, alumnos.c.id == usuarios.c.id)
+            .join(activos, true())
+            .outerjoin(multa, true())
+            .join(historial, true())
+            .join(historial_multas, true())
+        )
+        .where(usuarios.c.id == usuario_id)
+    )
+    fila = db.execute(stmt).mappings().first()
+    if fila is None:
+        return None
+    fila = dict(fila)
+    resumen = {nombre: fila.pop(nombre) for nombre in schemas.ResumenUsuario.model_fields if nombre != "usuario"}
+    resumen["usuario"] = _fila_usuario(fila)
+    return resumen
+
 def delete_usuario(db: Session, db_usuario: models.Usuario):
     # La verificación de préstamos/multas activas se hace en el endpoint
+    for db_reserva in get_reservas_by_usuario(db, db_usuario.id, limit=None):
+        _quitar_reserva(db, db_reserva)
     db.delete(db_usuario)
     db.commit()
 
@@ -227,7 +443,8 @@ def get_prestamo_by_ejemplar(db: Session, ejemplar_id: int):
     return db.query(models.Prestamo).filter(models.Prestamo.id_ejemplar == ejemplar_id).first()
 
 def create_prestamo(db: Session, prestamo: schemas.PrestamoCreate):
-    db_ejemplar = get_ejemplar(db, prestamo.id_ejemplar)
+    # Con su reserva (si está apartado) en la misma consulta
+    db_ejemplar = db.query(models.Ejemplar).options(joinedload(models.Ejemplar.reserva)).filter(models.Ejemplar.id == prestamo.id_ejemplar).first()
     db_libro = get_libro(db, db_ejemplar.id_libro) if db_ejemplar else None # Mejor cargar con join si se puede
     db_usuario = get_usuario(db, prestamo.id_usuario)
 
@@ -235,8 +452,12 @@ def create_prestamo(db: Session, prestamo: schemas.PrestamoCreate):
         raise ValueError("Ejemplar, libro o usuario no encontrado.")
     if db_ejemplar.prestamo_activo:
         raise ValueError("Este ejemplar ya está prestado.")
-    if db_libro.numEjemplaresDisponibles <= 0:
-        raise ValueError("No hay ejemplares disponibles de este libro.")
+    db_reserva = db_ejemplar.reserva
+    if db_reserva is not None:
+        if db_reserva.id_usuario != db_usuario.id:
+            raise ValueError("Este ejemplar está apartado para el usuario que lo reservó.")
+    elif db_libro.numEjemplaresDisponibles <= 0:
+        raise ValueError("No hay ejemplares disponibles de este libro. Se puede reservar con POST /reservas/.")
     if db_usuario.estado != schemas.EstadoUsuario.ACTIVO:
         raise ValueError(f"El usuario no puede realizar préstamos, su estado es {db_usuario.estado.value}.")
 
@@ -274,7 +495,18 @@ def create_prestamo(db: Session, prestamo: schemas.PrestamoCreate):
     db.add(db_prestamo)
 
     # Actualizar disponibilidad del libro
-    db_libro.numEjemplaresDisponibles -= 1
+    if db_reserva is not None:
+        db.delete(db_reserva) # Recoge el ejemplar que tenía apartado: ya no contaba como disponible
+    else:
+        db_libro.numEjemplaresDisponibles -= 1
+        if db_libro.numReservas > 0:
+            # Si esperaba en la cola de este libro, su reserva ya no hace falta
+            quitadas = db.query(models.Reserva).filter(
+                models.Reserva.id_libro == db_libro.id, models.Reserva.id_usuario == db_usuario.id,
+                models.Reserva.estado == models.EstadoReserva.EN_ESPERA).delete(synchronize_session=False)
+            if quitadas:
+                db_libro.numReservas = models.Libro.numReservas - quitadas
+    disponibilidad.anotar(db, "prestamo", db_libro, db_ejemplar)
     db.commit()
     db.refresh(db_prestamo)
     db.refresh(db_libro) # Refrescar el libro para reflejar el cambio en disponibles
@@ -290,8 +522,9 @@ def delete_prestamo(db: Session, prestamo_id: int):
     # En la devolución normal, ya se maneja el numEjemplaresDisponibles.
     db_ejemplar = get_ejemplar(db, db_prestamo.id_ejemplar)
     if db_ejemplar and db_ejemplar.libro: # Acceder a la relación cargada
-        db_ejemplar.libro.numEjemplaresDisponibles += 1
+        _asignar_o_liberar(db, db_ejemplar.libro, db_ejemplar) # Con cola, el ejemplar va a la primera reserva
         db.add(db_ejemplar.libro) # Marcar el libro para guardar cambios
+        disponibilidad.anotar(db, "prestamo_anulado", db_ejemplar.libro, db_ejemplar)
 
     db.delete(db_prestamo)
     db.commit()
@@ -351,7 +584,8 @@ def resolver_multa(db: Session, multa_id: int):
     if db_usuario:
         # Si un usuario tiene múltiples préstamos atrasados y solo resuelve una multa,
         # podría seguir siendo moroso. Para simplificar, asumimos que al resolver la
-        # multa, su estado vuelve a ACTIVO. Un sistema más complejo podría re-evaluar.
+        # multa, su estado vuelve a ACTIVO; si le quedan préstamos vencidos, el barrido nocturno
+        # (marcar_morosos) lo vuelve a marcar MOROSO.
         db_usuario.estado = schemas.EstadoUsuario.ACTIVO
         db.refresh(db_usuario)
 
@@ -493,11 +727,197 @@ def devolver_ejemplar(db: Session, ejemplar_id: int):
     # Eliminar el préstamo activo
     db.delete(db_prestamo)
 
-    # Actualizar disponibilidad del libro
-    db_libro.numEjemplaresDisponibles += 1
+    # Actualizar disponibilidad del libro, o apartar el ejemplar para la primera reserva de la cola
+    _asignar_o_liberar(db, db_libro, db_ejemplar)
+    disponibilidad.anotar(db, "devolucion", db_libro, db_ejemplar)
     
     db.commit()
     db.refresh(db_prestamo_historico)
     db.refresh(db_libro)
     db.refresh(db_usuario) # Refrescar el usuario para ver su estado actual (Multado o Activo)
-    return db_prestamo_historico
\ No newline at end of file
+    return db_prestamo_historico
+
+# --- Reservas (cola de espera por libro) ---
+# Un ejemplar que queda libre (devolución, préstamo anulado, alta de ejemplar, reserva cancelada o
+# caducada) pasa a la primera reserva en espera de su libro, en la misma transacción, y queda apartado
+# DIAS_RECOGIDA_RESERVA días; solo si no hay nadie esperando suma a numEjemplaresDisponibles. Así los
+# usuarios no tienen que reintentar el préstamo hasta que les toque y nadie se salta la cola.
+# create_reserva y _asignar_o_liberar bloquean la fila del libro (FOR UPDATE) antes de mirar sus
+# contadores: si no, una reserva creada mientras se devuelve un ejemplar podría quedarse esperando con
+# ese ejemplar disponible (la devolución aún no ve la reserva y la reserva aún no ve el ejemplar).
+
+DIAS_RECOGIDA_RESERVA = 3
+
+def get_reserva(db: Session, reserva_id: int, bloquear: bool = False):
+    consulta = db.query(models.Reserva).filter(models.Reserva.id == reserva_id)
+    if bloquear:
+        # FOR UPDATE: si una devolución la está asignando, se espera a ver el estado con el que queda
+        consulta = consulta.populate_existing().with_for_update()
+    return consulta.first()
+
+def get_reservas_by_libro(db: Session, libro_id: int, skip: int = 0, limit: int = 100):
+    # La cola en orden: primero las asignadas (pendientes de recoger) y después las que esperan
+    return (db.query(models.Reserva).filter(models.Reserva.id_libro == libro_id)
+            .order_by(models.Reserva.estado == models.EstadoReserva.EN_ESPERA, models.Reserva.posicion)
+            .offset(skip).limit(limit).all())
+
+def get_reservas_by_usuario(db: Session, usuario_id: int, skip: int = 0, limit: int = 100):
+    return (db.query(models.Reserva).filter(models.Reserva.id_usuario == usuario_id)
+            .order_by(models.Reserva.id).offset(skip).limit(limit).all())
+
+def _bloquear_libro(db: Session, db_libro: models.Libro):
+    # Vuelca lo pendiente (refresh lo descartaría) y relee los contadores con SELECT ... FOR UPDATE
+    db.flush()
+    db.refresh(db_libro, attribute_names=["numEjemplaresDisponibles", "numReservas"], with_for_update=True)
+
+def contar_reservas_delante(db: Session, db_reserva: models.Reserva) -> int:
+    if db_reserva.estado == models.EstadoReserva.ASIGNADA:
+        return 0
+    # Recorre el índice parcial ix_reservas_cola hasta la posición de esta reserva: O(reservas delante),
+    # acotado por la cola de un solo libro (numReservas, unas pocas decenas como mucho), con un index-only
+    # scan. Una posición por libro sin huecos lo haría O(1), pero obligaría a renumerar la cola cada vez
+    # que alguien la deja (cancelación, caducidad, préstamo), que es mucho más frecuente que consultarla.
+    return db.query(func.count(models.Reserva.id)).filter(
+        models.Reserva.id_libro == db_reserva.id_libro,
+        models.Reserva.estado == models.EstadoReserva.EN_ESPERA,
+        models.Reserva.posicion < db_reserva.posicion,
+    ).scalar()
+
+def create_reserva(db: Session, reserva: schemas.ReservaCreate):
+    db_libro = get_libro(db, reserva.id_libro)
+    db_usuario = get_usuario(db, reserva.id_usuario)
+    if not db_libro or not db_usuario:
+        raise ValueError("Libro o usuario no encontrado.")
+    if db_usuario.estado != schemas.EstadoUsuario.ACTIVO:
+        raise ValueError(f"El usuario no puede reservar, su estado es {db_usuario.estado.value}.")
+    _bloquear_libro(db, db_libro) # Hasta el commit, ninguna devolución de este libro puede dejar un ejemplar libre
+    if db_libro.numEjemplaresDisponibles > 0:
+        raise ValueError("Hay ejemplares disponibles de este libro: se puede pedir el préstamo directamente.")
+
+    db_reserva = models.Reserva(id_libro=reserva.id_libro, id_usuario=reserva.id_usuario,
+                                estado=models.EstadoReserva.EN_ESPERA, fecha_reserva=date.today())
+    db.add(db_reserva)
+    # UPDATE ... SET "numReservas" = "numReservas" + 1: sin perder incrementos de reservas simultáneas
+    db_libro.numReservas = models.Libro.numReservas + 1
+    db.commit()
+    db.refresh(db_reserva)
+    return db_reserva
+
+def _siguiente_reserva(db: Session, libro_id: int) -> Optional[models.Reserva]:
+    # Cabeza de la cola por el índice parcial ix_reservas_cola (O(log n)). Se salta a los usuarios
+    # que ahora no pueden llevarse el libro (multados o morosos), que conservan su sitio. SKIP LOCKED:
+    # dos ejemplares liberados a la vez del mismo libro van a dos reservas distintas.
+    return (db.query(models.Reserva)
+            .join(models.Usuario.__table__, models.Usuario.__table__.c.id == models.Reserva.id_usuario)
+            .filter(models.Reserva.id_libro == libro_id,
+                    models.Reserva.estado == models.EstadoReserva.EN_ESPERA,
+                    models.Usuario.__table__.c.estado == models.EstadoUsuario.ACTIVO)
+            .order_by(models.Reserva.posicion)
+            .limit(1)
+            .with_for_update(of=models.Reserva, skip_locked=True)
+            .first())
+
+def _asignar_o_liberar(db: Session, db_libro: models.Libro, db_ejemplar: models.Ejemplar) -> Optional[models.Reserva]:
+    """Ejemplar que queda libre: se aparta para la siguiente reserva del libro o, si no hay, queda disponible."""
+    _bloquear_libro(db, db_libro) # Ve las reservas confirmadas antes y retiene las que se estén creando
+    if db_libro.numReservas > 0: # Sin reservas en espera no se consulta la cola
+        db_reserva = _siguiente_reserva(db, db_libro.id)
+        if db_reserva is not None:
+            if db_ejemplar.id is None:
+                db.flush() # Ejemplar recién creado: hace falta su id
+            db_reserva.estado = models.EstadoReserva.ASIGNADA
+            db_reserva.id_ejemplar = db_ejemplar.id # Por id: asignar la relación cargaría Ejemplar.reserva
+            db_reserva.fecha_limite_recogida = date.today() + timedelta(days=DIAS_RECOGIDA_RESERVA)
+            db_libro.numReservas = models.Libro.numReservas - 1
+            return db_reserva
+    db_libro.numEjemplaresDisponibles += 1
+    return None
+
+def _quitar_reserva(db: Session, db_reserva: models.Reserva):
+    # Borra una reserva viva y, si tenía un ejemplar apartado, lo pasa a la siguiente de la cola
+    db_libro = get_libro(db, db_reserva.id_libro)
+    if db_reserva.estado == models.EstadoReserva.EN_ESPERA:
+        db_libro.numReservas = models.Libro.numReservas - 1
+        db.delete(db_reserva)
+        return
+    db_ejemplar = db_reserva.ejemplar_rel
+    db_reserva.ejemplar_rel = None
+    db.delete(db_reserva)
+    db.flush() # Libera el ejemplar (id_ejemplar es único) antes de apartarlo para otra reserva
+    if _asignar_o_liberar(db, db_libro, db_ejemplar) is None:
+        disponibilidad.anotar(db, "ejemplares", db_libro, db_ejemplar)
+
+def _devolver_a_la_cola(db: Session, db_reserva: models.Reserva, db_libro: models.Libro):
+    # El ejemplar apartado deja de existir o cambia de libro: la reserva vuelve a esperar con su posición
+    db_reserva.estado = models.EstadoReserva.EN_ESPERA
+    db_reserva.ejemplar_rel = None
+    db_reserva.fecha_limite_recogida = None
+    db_libro.numReservas = models.Libro.numReservas + 1
+    db.flush() # El ejemplar queda libre (id_ejemplar es único) por si se aparta para otra reserva
+
+def delete_reserva(db: Session, db_reserva: models.Reserva):
+    _quitar_reserva(db, db_reserva)
+    db.commit()
+
+def caducar_reservas(db: Session, hoy: Optional[date] = None, lote: int = 500) -> int:
+    """Quita las reservas asignadas sin recoger a tiempo y pasa su ejemplar a la siguiente; las cuenta."""
+    hoy = hoy or date.today()
+    caducadas = 0
+    while True:
+        reservas = (db.query(models.Reserva)
+                    .filter(models.Reserva.estado == models.EstadoReserva.ASIGNADA,
+                            models.Reserva.fecha_limite_recogida < hoy)
+                    .order_by(models.Reserva.fecha_limite_recogida)
+                    .limit(lote)
+                    .with_for_update(skip_locked=True)
+                    .all())
+        for db_reserva in reservas:
+            _quitar_reserva(db, db_reserva)
+        db.commit() # Una transacción por lote: los bloqueos duran poco
+        caducadas += len(reservas)
+        if len(reservas) < lote:
+            return caducadas
+
+# --- Morosos (barrido nocturno, ver barrido_nocturno.py) ---
+# Un usuario ACTIVO con algún préstamo vencido pasa a MOROSO (no puede pedir préstamos ni reservar)
+# y vuelve a ACTIVO cuando ya no tiene préstamos vencidos ni multa activa. MULTADO no se toca: la multa
+# ya bloquea y resolver_multa lo devuelve a ACTIVO, y el siguiente barrido decide si sigue moroso.
+# Cada lote es un UPDATE ... WHERE id IN (SELECT ... LIMIT lote FOR UPDATE SKIP LOCKED) confirmado por
+# separado: los bloqueos sobre usuarios duran lo que un lote y los que tiene ocupados una petición en
+# curso se quedan para el siguiente barrido, en lugar de esperarlos.
+
+def _actualizar_por_lotes(db: Session, stmt) -> int:
+    total = 0
+    while True:
+        cambiados = len(db.execute(stmt).all())
+        db.commit()
+        total += cambiados
+        if cambiados == 0:
+            return total
+
+def marcar_morosos(db: Session, hoy: Optional[date] = None, lote: int = 1000) -> int:
+    """Pasa a MOROSO a los usuarios activos con préstamos vencidos antes de 'hoy'; devuelve cuántos."""
+    usuarios, prestamos = models.Usuario.__table__, models.Prestamo.__table__
+    # Se parte de los préstamos vencidos (índice ix_prestamos_fecha_devolucion_esperada), no de la tabla de usuarios
+    vencidos = (select(usuarios.c.id)
+                .join(prestamos, prestamos.c.id_usuario == usuarios.c.id)
+                .where(prestamos.c.fecha_devolucion_esperada < (hoy or date.today()),
+                       usuarios.c.estado == models.EstadoUsuario.ACTIVO)
+                .limit(lote)
+                .with_for_update(of=usuarios, skip_locked=True))
+    return _actualizar_por_lotes(db, update(usuarios).where(usuarios.c.id.in_(vencidos))
+                                 .values(estado=models.EstadoUsuario.MOROSO).returning(usuarios.c.id))
+
+def rehabilitar_morosos(db: Session, hoy: Optional[date] = None, lote: int = 1000) -> int:
+    """Devuelve a ACTIVO a los morosos sin préstamos vencidos ni multa activa; devuelve cuántos."""
+    usuarios, prestamos, multas = models.Usuario.__table__, models.Prestamo.__table__, models.Multa.__table__
+    # Los morosos se recorren por el índice parcial ix_usuarios_morosos
+    resueltos = (select(usuarios.c.id)
+                 .where(usuarios.c.estado == models.EstadoUsuario.MOROSO,
+                        ~exists().where(prestamos.c.id_usuario == usuarios.c.id,
+                                        prestamos.c.fecha_devolucion_esperada < (hoy or date.today())),
+                        ~exists().where(multas.c.id_usuario == usuarios.c.id))
+                 .limit(lote)
+                 .with_for_update(skip_locked=True))
+    return _actualizar_por_lotes(db, update(usuarios).where(usuarios.c.id.in_(resueltos))
+                                 .values(estado=models.EstadoUsuario.ACTIVO).returning(usuarios.c.id))
@@ -0,0 +1,54 @@
+# library_project/backend/crud_async.py
+"""
+Versiones asíncronas de las funciones de crud.py para usar con AsyncSession (asyncpg).
+
+La mayoría reutiliza la función síncrona con AsyncSession.run_sync: el código de crud.py se ejecuta
+dentro de un greenlet y cada consulta espera a asyncpg sin bloquear el event loop, así que las
+reglas de negocio (límites de préstamo, multas, contadores) siguen estando en un solo sitio.
+"""
+from functools import wraps
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import with_polymorphic
+
+from . import crud, models
+
+
+def _en_sesion(funcion):
+    @wraps(funcion)
+    async def envoltura(db: AsyncSession, *args, **kwargs):
+        return await db.run_sync(funcion, *args, **kwargs)
+    return envoltura
+
+
+# --- Libros y ejemplares ---
+get_libro = _en_sesion(crud.get_libro)
+get_libros_filas = _en_sesion(crud.get_libros_filas)
+get_ejemplar = _en_sesion(crud.get_ejemplar)
+get_ejemplares_filas = _en_sesion(crud.get_ejemplares_filas)
+get_ejemplares_by_libro = _en_sesion(crud.get_ejemplares_by_libro)
+
+# --- Usuarios ---
+get_usuarios_filas = _en_sesion(crud.get_usuarios_filas)
+get_resumen_usuario = _en_sesion(crud.get_resumen_usuario)
+
+async def get_usuario(db: AsyncSession, usuario_id: int):
+    # Carga las columnas de Profesor/Alumno en la misma consulta: fuera de la sesión
+    # no se pueden hacer cargas perezosas con AsyncSession.
+    usuario = with_polymorphic(models.Usuario, "*")
+    result = await db.execute(select(usuario).where(usuario.id == usuario_id))
+    return result.scalars().first()
+
+# --- Préstamos y multas ---
+get_prestamo = _en_sesion(crud.get_prestamo)
+get_prestamos_filas = _en_sesion(crud.get_prestamos_filas)
+get_prestamos_by_usuario = _en_sesion(crud.get_prestamos_by_usuario)
+create_prestamo = _en_sesion(crud.create_prestamo)
+devolver_ejemplar = _en_sesion(crud.devolver_ejemplar)
+get_multa_by_usuario = _en_sesion(crud.get_multa_by_usuario)
+
+# --- Recomendaciones e históricos ---
+get_recomendaciones_by_libro_origen = _en_sesion(crud.get_recomendaciones_by_libro_origen)
+get_prestamos_historicos_filas_by_usuario = _en_sesion(crud.get_prestamos_historicos_filas_by_usuario)
+get_multas_historicas_filas_by_usuario = _en_sesion(crud.get_multas_historicas_filas_by_usuario)
@@ -0,0 +1,87 @@
+# library_project/backend/datos_sinteticos.py
+"""
+Conjunto de datos sintético uniforme y pequeño (generate_series) para la regresión de planes de
+consulta (pruebas/test_planes_consulta.py) y los micro-benchmarks. Para volúmenes y distribuciones
+de producción está generar_datos.py.
+
+PLANES_ESCALA libros con 3 ejemplares cada uno; 1 de cada 10 ejemplares prestado (ninguno vencido),
+multa activa en 1 de cada 4 usuarios, historial de préstamos y multas y recomendaciones. Los libros
+con id % 10 = 1 tienen sus 3 ejemplares apartados para reservas ASIGNADAS y 5 reservas más en espera.
+"""
+import os
+
+from sqlalchemy import text
+
+from . import migraciones, models
+from .generar_datos import ajustar_secuencias
+
+# Número de libros; el resto de tablas se escala a partir de él.
+ESCALA = int(os.getenv("PLANES_ESCALA", "20000"))
+
+DATOS_SINTETICOS = """
+INSERT INTO libros (id, isbn, titulo, autor, "numPaginas", "numEjemplares", "numEjemplaresDisponibles")
+SELECT g, 'ISBN-' || g, 'Título ' || g, 'Autor ' || (g % 5000), 100 + g % 900, 3, 3
+FROM generate_series(1, :libros) g;
+
+INSERT INTO ejemplares (id, id_libro, "codigoEjemplar", "adquiridoEl")
+SELECT g, (g - 1) / 3 + 1, 'EJ-' || g, DATE '2020-01-01' + (g % 1000)
+FROM generate_series(1, :libros * 3) g;
+
+INSERT INTO usuarios (id, login, nombre, apellidos, email, calle, numero, ciudad, codigo_postal, tipo_usuario, estado)
+SELECT g, 'usuario' || g, 'Nombre', 'Apellido', 'usuario' || g || '@example.com', 'Calle', '1', 'Quito', '170101',
+       CASE WHEN g % 2 = 0 THEN 'profesor' ELSE 'alumno' END, 'ACTIVO'
+FROM generate_series(1, :usuarios) g;
+
+INSERT INTO profesores (id, departamento) SELECT g, 'Departamento ' || (g % 20) FROM generate_series(2, :usuarios, 2) g;
+
+INSERT INTO alumnos (id, telefono_padres) SELECT g, '099' || g FROM generate_series(1, :usuarios, 2) g;
+
+INSERT INTO prestamos (id, id_ejemplar, id_usuario, fecha_prestamo, fecha_devolucion_esperada)
+SELECT g / 10, g, g % :usuarios + 1, CURRENT_DATE - 3, CURRENT_DATE + 4
+FROM generate_series(10, :libros * 3, 10) g;
+
+INSERT INTO multas (id, id_usuario, fecha_inicio, dias_acumulados, fecha_finalizacion)
+SELECT g / 4, g, CURRENT_DATE - 2, 5, CURRENT_DATE + 3
+FROM generate_series(4, :usuarios, 4) g;
+
+INSERT INTO multas_historicas (id, id_usuario, fecha_inicio, dias_acumulados, fecha_finalizacion)
+SELECT g, g % :usuarios + 1, DATE '2023-01-01', 3, DATE '2023-01-04'
+FROM generate_series(1, :usuarios * 2) g;
+
+INSERT INTO prestamos_historicos (id, id_ejemplar, id_usuario, fecha_prestamo, fecha_devolucion_esperada, fecha_devolucion_real, id_multa)
+SELECT g, g % (:libros * 3) + 1, g % :usuarios + 1, DATE '2023-01-01', DATE '2023-01-08', DATE '2023-01-08',
+       CASE WHEN g % 20 = 0 THEN (g / 20) % (:usuarios * 2) + 1 END
+FROM generate_series(1, :libros * 10) g;
+
+INSERT INTO recomendaciones (id, id_libro_origen, id_libro_recomendado, comentario)
+SELECT g, g % :libros + 1, (g * 7) % :libros + 1, 'Recomendación ' || g
+FROM generate_series(1, :libros * 2) g;
+
+UPDATE libros SET "numEjemplaresDisponibles" = 0, "numReservas" = 5 WHERE id % 10 = 1 AND id <= :libros / 10 * 10;
+
+INSERT INTO reservas (id, id_libro, id_usuario, posicion, estado, fecha_reserva, id_ejemplar, fecha_limite_recogida)
+SELECT g, ((g - 1) / 8) * 10 + 1, g % :usuarios + 1, nextval('reservas_posicion_seq'),
+       CAST(CASE WHEN (g - 1) % 8 < 3 THEN 'ASIGNADA' ELSE 'EN_ESPERA' END AS estadoreserva), DATE '2025-01-01',
+       CASE WHEN (g - 1) % 8 < 3 THEN ((g - 1) / 8) * 30 + (g - 1) % 8 + 1 END,
+       CASE WHEN (g - 1) % 8 < 3 THEN CURRENT_DATE + 3 END
+FROM generate_series(1, :libros / 10 * 8) g;
+"""
+
+
+def preparar_base(engine):
+    """Borra y vuelve a crear todas las tablas de la base de 'engine' y carga los datos sintéticos."""
+    models.Base.metadata.drop_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS schema_migraciones"))
+    models.Base.metadata.create_all(bind=engine)
+    migraciones.aplicar_migraciones(engine)
+    parametros = {"libros": ESCALA, "usuarios": max(ESCALA // 2, 100)}
+    with engine.begin() as conn:
+        for sentencia in DATOS_SINTETICOS.split(";"):
+            if sentencia.strip():
+                conn.execute(text(sentencia), parametros)
+        # Los datos se insertan con id explícito: las secuencias se colocan detrás para que los
+        # INSERT de la API (benchmarks de carga) no choquen con ids existentes
+        ajustar_secuencias(conn)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE"))
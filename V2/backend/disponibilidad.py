@@ -0,0 +1,263 @@
+# library_project/backend/disponibilidad.py
+"""
+Disponibilidad en tiempo real: los cambios de numEjemplaresDisponibles y los préstamos y devoluciones
+se publican con NOTIFY de PostgreSQL y se reenvían a los clientes suscritos por Server-Sent Events
+(GET /catalogo/disponibilidad/eventos), en lugar de que las pantallas de disponibilidad consulten
+/libros/{id} cada pocos segundos.
+
+- Publicación: las funciones de escritura de crud.py anotan el evento en la sesión (anotar) y, al
+  confirmar, un único SELECT pg_notify(...) los envía todos dentro de la misma transacción. PostgreSQL
+  solo entrega las notificaciones si la transacción se confirma, así que nunca se anuncia un préstamo
+  que luego se deshace. Funciona igual con las sesiones síncronas que con AsyncSession (api_async.py
+  llama a las mismas funciones de crud.py).
+- Recepción: cada worker abre una única conexión psycopg2 dedicada (fuera del pool) con
+  LISTEN DISPONIBILIDAD_CANAL y la atiende desde el event loop con add_reader, sin hilos. Si la
+  conexión se pierde se reintenta con espera creciente y, al recuperarla, se envía 'resincronizar' a
+  todos los clientes: las notificaciones de mientras no se recuperan. Cada notificación invalida
+  además la caché del catálogo de ese libro (ver catalogo.py), también en los workers que no hicieron
+  la escritura.
+- Difusión: cada cliente tiene su cola de DISPONIBILIDAD_COLA mensajes ya serializados (cada evento
+  se serializa una vez, no una por cliente) y un índice por libro evita recorrer a todos los
+  suscriptores en cada evento. Si un cliente no lee al ritmo al que llegan los eventos (su conexión
+  TCP no drena y la cola se llena), los nuevos se descartan solo para él, se cuentan en
+  biblioteca_disponibilidad_descartados_total y recibe 'resincronizar' con el número de perdidos: el
+  resto de clientes y el worker no se ven afectados.
+- Cada DISPONIBILIDAD_LATIDO_S sin eventos se envía un comentario SSE para que los proxies no cierren
+  la conexión y para detectar los clientes desconectados. Como mucho DISPONIBILIDAD_MAX_CLIENTES
+  conexiones por worker (después, 503).
+- Cada flujo se cierra a los DISPONIBILIDAD_DURACION_MAX_S (±10%) y el navegador (EventSource) se
+  reconecta solo: así los clientes se reparten entre workers nuevos y un worker que se apaga no
+  espera indefinidamente a que terminen sus respuestas.
+
+El cliente debe suscribirse primero y después leer el estado actual (/catalogo/libros/{id}/disponibilidad),
+y volver a leerlo al recibir 'resincronizar'. Formato de los eventos ('data' en JSON):
+
+    event: prestamo
+    data: {"tipo": "prestamo", "libro": 12, "ejemplar": 345, "disponibles": 2, "total": 5}
+
+Tipos: prestamo, devolucion, prestamo_anulado, ejemplares (alta, baja o cambio de libro de un
+ejemplar, o cambio manual de los contadores), alta y baja (del libro).
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Dict, Iterable, Optional, Set
+
+import anyio
+import orjson
+from prometheus_client import Counter, Gauge
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from . import catalogo, models
+
+DISPONIBILIDAD_NOTIFY = os.getenv("DISPONIBILIDAD_NOTIFY", "1") == "1"
+DISPONIBILIDAD_CANAL = os.getenv("DISPONIBILIDAD_CANAL", "disponibilidad")
+DISPONIBILIDAD_COLA = int(os.getenv("DISPONIBILIDAD_COLA", "256"))
+DISPONIBILIDAD_LATIDO_S = float(os.getenv("DISPONIBILIDAD_LATIDO_S", "15"))
+DISPONIBILIDAD_MAX_CLIENTES = int(os.getenv("DISPONIBILIDAD_MAX_CLIENTES", "10000"))
+DISPONIBILIDAD_MAX_LIBROS = int(os.getenv("DISPONIBILIDAD_MAX_LIBROS", "500"))
+DISPONIBILIDAD_DURACION_MAX_S = float(os.getenv("DISPONIBILIDAD_DURACION_MAX_S", "600"))
+DISPONIBILIDAD_RECONEXION_MS = int(os.getenv("DISPONIBILIDAD_RECONEXION_MS", "3000")) # 'retry' que se indica al cliente
+
+CLIENTES = Gauge("biblioteca_disponibilidad_clientes", "Clientes suscritos a los eventos de disponibilidad", multiprocess_mode="livesum")
+EVENTOS = Counter("biblioteca_disponibilidad_eventos_total", "Notificaciones de disponibilidad recibidas por el worker")
+DESCARTADOS = Counter("biblioteca_disponibilidad_descartados_total", "Eventos no enviados a un cliente por tener su cola llena")
+
+logger = logging.getLogger(__name__)
+
+
+# --- Publicación (en la transacción de la escritura) ---
+
+def anotar(sesion: Session, tipo: str, libro: models.Libro, ejemplar: Optional[models.Ejemplar] = None):
+    """Anota un evento del libro; se publica al confirmar la transacción de la sesión."""
+    if DISPONIBILIDAD_NOTIFY:
+        sesion.info.setdefault("disponibilidad_eventos", []).append((tipo, libro, ejemplar))
+
+
+@event.listens_for(Session, "before_commit")
+def _publicar(sesion):
+    eventos = sesion.info.pop("disponibilidad_eventos", None)
+    if not eventos:
+        return
+    # Después del flush: los ejemplares nuevos ya tienen id y los contadores, el valor que se guarda
+    sesion.flush()
+    cargas = []
+    for tipo, libro, ejemplar in eventos:
+        datos = {"tipo": tipo, "libro": libro.id, "disponibles": libro.numEjemplaresDisponibles, "total": libro.numEjemplares}
+        if ejemplar is not None:
+            datos["ejemplar"] = ejemplar.id
+        cargas.append(orjson.dumps(datos).decode())
+    sesion.execute(text("SELECT pg_notify(:canal, carga) FROM unnest(CAST(:cargas AS text[])) AS carga"),
+                   {"canal": DISPONIBILIDAD_CANAL, "cargas": cargas})
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar(sesion):
+    sesion.info.pop("disponibilidad_eventos", None)
+
+
+# --- Recepción y difusión (una conexión LISTEN por worker) ---
+
+def _mensaje(evento: str, datos: bytes) -> bytes:
+    return b"event: " + evento.encode() + b"\ndata: " + datos + b"\n\n"
+
+
+class Suscripcion:
+    __slots__ = ("libros", "cola", "perdidos")
+
+    def __init__(self, libros: Optional[frozenset]):
+        self.libros = libros # None: todos los libros
+        self.cola: asyncio.Queue = asyncio.Queue(DISPONIBILIDAD_COLA)
+        self.perdidos = 0
+
+    def entregar(self, mensaje: bytes):
+        try:
+            self.cola.put_nowait(mensaje)
+        except asyncio.QueueFull:
+            self.perdidos += 1
+            DESCARTADOS.inc()
+
+
+class Difusor:
+    """Conexión LISTEN del worker y reparto de las notificaciones a las suscripciones SSE."""
+
+    def __init__(self):
+        self._todos: Set[Suscripcion] = set()
+        self._por_libro: Dict[int, Set[Suscripcion]] = {}
+        self.clientes = 0
+        self._tarea: Optional[asyncio.Task] = None
+
+    def alta(self, libros: Optional[Iterable[int]]) -> Suscripcion:
+        suscripcion = Suscripcion(frozenset(libros) if libros is not None else None)
+        if suscripcion.libros is None:
+            self._todos.add(suscripcion)
+        else:
+            for libro in suscripcion.libros:
+                self._por_libro.setdefault(libro, set()).add(suscripcion)
+        self.clientes += 1
+        CLIENTES.inc()
+        return suscripcion
+
+    def baja(self, suscripcion: Suscripcion):
+        if suscripcion.libros is None:
+            self._todos.discard(suscripcion)
+        else:
+            for libro in suscripcion.libros:
+                suscritos = self._por_libro.get(libro)
+                if suscritos is not None:
+                    suscritos.discard(suscripcion)
+                    if not suscritos:
+                        del self._por_libro[libro]
+        self.clientes -= 1
+        CLIENTES.dec()
+
+    def difundir(self, carga: str):
+        EVENTOS.inc()
+        try:
+            datos = orjson.loads(carga)
+            libro, tipo = int(datos["libro"]), str(datos["tipo"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Notificación de disponibilidad no válida: %.200s", carga)
+            return
+        # La caché del catálogo de los demás workers no se entera de la escritura por otra vía
+        catalogo.cache.invalidar(catalogo.condicion_libros({libro}))
+        mensaje = _mensaje(tipo, carga.encode())
+        for suscripcion in self._todos:
+            suscripcion.entregar(mensaje)
+        for suscripcion in self._por_libro.get(libro, ()):
+            suscripcion.entregar(mensaje)
+
+    def _a_todos(self, mensaje: bytes):
+        for suscripcion in self._todos.union(*self._por_libro.values()):
+            suscripcion.entregar(mensaje)
+
+    async def flujo(self, libros: Optional[Iterable[int]]):
+        """Cuerpo de la respuesta text/event-stream: suscribe al cliente mientras dura."""
+        suscripcion = self.alta(libros)
+        # Con reparto aleatorio para que no se reconecten todos a la vez
+        fin = time.monotonic() + DISPONIBILIDAD_DURACION_MAX_S * random.uniform(0.9, 1.1)
+        try:
+            yield f"retry: {DISPONIBILIDAD_RECONEXION_MS}\n\n".encode()
+            while (restante := fin - time.monotonic()) > 0:
+                try:
+                    mensaje = await asyncio.wait_for(suscripcion.cola.get(), min(DISPONIBILIDAD_LATIDO_S, restante))
+                except asyncio.TimeoutError:
+                    # Si el cliente se fue, este envío falla y termina el flujo
+                    yield b": latido\n\n"
+                    continue
+                partes = [mensaje]
+                # Lo que ya esté en la cola sale en la misma escritura
+                while not suscripcion.cola.empty():
+                    partes.append(suscripcion.cola.get_nowait())
+                if suscripcion.perdidos:
+                    partes.append(_mensaje("resincronizar", orjson.dumps({"perdidos": suscripcion.perdidos})))
+                    suscripcion.perdidos = 0
+                yield b"".join(partes)
+        finally:
+            self.baja(suscripcion)
+
+    def _conectar(self):
+        import psycopg2 # Mismo driver que el engine síncrono; la conexión no sale del pool
+        from . import database # Aquí y no arriba: crud.py importa este módulo y no necesita el engine
+
+        cargs, cparams = database.engine.dialect.create_connect_args(database.engine.url)
+        # Keepalives de TCP: una conexión caída sin aviso se detecta en menos de un minuto
+        conexion = psycopg2.connect(*cargs, **cparams, application_name="biblioteca-disponibilidad",
+                                    keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
+        conexion.autocommit = True
+        with conexion.cursor() as cursor:
+            cursor.execute(f'LISTEN "{DISPONIBILIDAD_CANAL}"')
+        return conexion
+
+    async def _escuchar(self):
+        bucle = asyncio.get_running_loop()
+        espera, reconexion = 1.0, False
+        while True:
+            try:
+                conexion = await anyio.to_thread.run_sync(self._conectar)
+            except Exception:
+                logger.warning("No se pudo abrir la conexión LISTEN de disponibilidad; reintento en %.0f s", espera, exc_info=True)
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, 30.0)
+                continue
+            espera = 1.0
+            if reconexion:
+                self._a_todos(_mensaje("resincronizar", b'{"motivo": "reconexion"}'))
+            reconexion = True
+            legible = asyncio.Event()
+            descriptor = conexion.fileno() # Después de un error la conexión ya no lo devuelve
+            bucle.add_reader(descriptor, legible.set)
+            try:
+                while True:
+                    await legible.wait()
+                    legible.clear()
+                    conexion.poll()
+                    while conexion.notifies:
+                        self.difundir(conexion.notifies.pop(0).payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Conexión LISTEN de disponibilidad perdida; reconectando", exc_info=True)
+            finally:
+                bucle.remove_reader(descriptor)
+                conexion.close()
+
+    def iniciar(self):
+        """Arranca la escucha en el event loop del worker (evento de arranque de la aplicación)."""
+        if self._tarea is None:
+            self._tarea = asyncio.get_running_loop().create_task(self._escuchar())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+
+difusor = Difusor()
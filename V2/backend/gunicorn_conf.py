@@ -0,0 +1,78 @@
+# library_project/backend/gunicorn_conf.py
+"""
+Configuración opcional de gunicorn como supervisor de varios workers uvicorn. El Dockerfile sigue
+arrancando un solo proceso uvicorn; para usar gunicorn hay que cambiar su CMD por:
+
+    gunicorn backend.main:app -c backend/gunicorn_conf.py
+
+- WEB_CONCURRENCY workers (por defecto, uno por núcleo). Cada worker tiene su propio pool de
+  conexiones: WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) debe caber en max_connections.
+- preload_app: la aplicación se importa una vez en el maestro y los workers se crean con fork(),
+  así arrancan antes y comparten memoria. El esquema (create_all + migraciones) también se prepara
+  una sola vez en el maestro.
+- Reinicios sin cortes:
+    kill -HUP <pid maestro>   arranca workers nuevos y cierra los antiguos cuando terminan sus
+                              peticiones en curso (máximo GRACEFUL_TIMEOUT segundos). Con preload_app
+                              los workers nuevos usan el código ya cargado en el maestro.
+    kill -USR2 <pid maestro>  para desplegar código nuevo: arranca un maestro nuevo con el código
+                              actual; cuando responda, kill -TERM al maestro antiguo.
+  MAX_REQUESTS recicla cada worker tras ese número de peticiones (0 = nunca), escalonado con
+  MAX_REQUESTS_JITTER para que no se reinicien todos a la vez.
+
+Rendimiento medido con benchmarks/bench_workers.py (ver su docstring): en 1 vCPU, gunicorn x2 es
+más lento que un solo proceso; falta medir en una máquina con varios núcleos antes de hacerlo el
+comando por defecto.
+"""
+import multiprocessing
+import os
+import shutil
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+accesslog = os.getenv("ACCESSLOG") # Sin valor, sin log de accesos (ahorra una escritura por petición)
+
+# Métricas de Prometheus compartidas entre workers (ver metricas.py). Se fija antes de cargar la
+# aplicación porque prometheus_client decide el modo al importarse.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/metricas_prometheus")
+
+
+def on_starting(server):
+    # Se ejecuta en el maestro con la aplicación ya importada (preload_app), antes de crear los workers
+    # Los valores de una ejecución anterior no deben sumarse a los nuevos
+    carpeta_metricas = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(carpeta_metricas, ignore_errors=True)
+    os.makedirs(carpeta_metricas)
+
+    from backend import arranque, database, main
+
+    main.preparar_esquema()
+    # Lo que se calienta aquí (mapeos, SQL compilado) lo heredan los workers; las conexiones las abre
+    # cada worker en su propio calentamiento al arrancar.
+    if arranque.DB_CALENTAR:
+        arranque.calentar()
+    # Las conexiones abiertas por el maestro no deben heredarse en los workers
+    database.engine.dispose()
+    if database.enrutador_replicas is not None:
+        for replica in database.enrutador_replicas.replicas:
+            replica.engine.dispose()
+    os.environ["DB_PREPARAR_ESQUEMA"] = "0"
+
+
+def post_fork(server, worker):
+    from backend import database
+
+    database.reiniciar_pools_tras_fork()
+
+
+def child_exit(server, worker):
+    # Las peticiones en curso (livesum) de un worker que termina dejan de contar
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
\ No newline at end of file
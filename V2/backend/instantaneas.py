@@ -0,0 +1,267 @@
+# library_project/backend/instantaneas.py
+"""
+Instantáneas estáticas del catálogo para el listado completo del OPAC: la tabla libros (con la
+disponibilidad de cada libro) materializada en fragmentos JSON ya comprimidos en disco, que la API
+sirve con FileResponse sin consultar la base de datos ni serializar nada.
+
+- Se activan con INSTANTANEAS_DIR (carpeta compartida por todos los workers).
+- El fragmento k contiene los libros con id entre k*INSTANTANEAS_TAM_FRAGMENTO y el siguiente
+  múltiplo, ordenados por id. Cada uno se escribe en JSON y en gzip, brotli y zstd (los que estén
+  instalados) con los niveles de INSTANTANEAS_NIVELES: se comprimen una vez y se sirven muchas.
+  Para 500 libros (86 kB), gzip 9 + br 9 + zstd 15 cuestan unos 35 ms; brotli 11 sola, 180 ms.
+- Los archivos llevan en el nombre el hash de su contenido, que es también su ETag: el ETag es el
+  mismo en todos los workers y entre regeneraciones si el contenido no cambia. indice.json dice qué
+  archivo corresponde a cada fragmento; se reemplaza de forma atómica y los archivos que dejan de
+  estar en él se borran pasados INSTANTANEAS_GRACIA_S (las respuestas en curso pueden estar leyéndolos).
+- Regeneración incremental: al confirmar una escritura que toca libros (también sus contadores de
+  disponibilidad, es decir préstamos, devoluciones y cambios de ejemplares), catalogo.py marca sus
+  fragmentos y un hilo por worker los regenera cada INSTANTANEAS_INTERVALO_S. Cada
+  INSTANTANEAS_COMPLETA_S se revisan todos (cambios hechos fuera de la API); solo se reescriben los
+  fragmentos cuyo contenido cambió. Un flock sobre la carpeta evita que dos procesos regeneren a la vez.
+- GET /catalogo/instantanea devuelve el índice; GET /catalogo/instantanea/{k} el fragmento, en la
+  variante comprimida que acepte el cliente. Con ?v=<etag> del índice la respuesta se puede cachear
+  como immutable; sin él, max-age corto y revalidación con If-None-Match (304).
+
+FileResponse envía el archivo con http.response.pathsend (sendfile sin copias) cuando el servidor
+ASGI lo soporta; si no, lo lee por bloques en un hilo, sin pasar por la base de datos en ningún caso.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Optional
+
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy import select
+
+from . import compresion, database, models, schemas
+
+INSTANTANEAS_DIR = os.getenv("INSTANTANEAS_DIR", "")
+INSTANTANEAS_TAM_FRAGMENTO = int(os.getenv("INSTANTANEAS_TAM_FRAGMENTO", "500"))
+INSTANTANEAS_INTERVALO_S = float(os.getenv("INSTANTANEAS_INTERVALO_S", "2"))
+INSTANTANEAS_COMPLETA_S = float(os.getenv("INSTANTANEAS_COMPLETA_S", "300"))
+INSTANTANEAS_GRACIA_S = float(os.getenv("INSTANTANEAS_GRACIA_S", "300"))
+INSTANTANEAS_MAX_AGE_S = int(os.getenv("INSTANTANEAS_MAX_AGE_S", "30"))
+INSTANTANEAS_NIVELES = dict(
+    (codificacion, int(nivel)) for codificacion, nivel in (par.split(":") for par in os.getenv("INSTANTANEAS_NIVELES", "gzip:9,br:9,zstd:15").split(","))
+    if compresion.DISPONIBLES.get(codificacion)
+)
+EXTENSIONES = {"gzip": ".gz", "br": ".br", "zstd": ".zst"}
+
+activas = bool(INSTANTANEAS_DIR)
+
+logger = logging.getLogger(__name__)
+
+
+def _etag(cuerpo: bytes) -> str:
+    return hashlib.blake2b(cuerpo, digest_size=12).hexdigest()
+
+
+class Instantaneas:
+    def __init__(self, carpeta: str):
+        self.carpeta = Path(carpeta)
+        self._indice: Optional[dict] = None
+        self._indice_bytes = b""
+        self._indice_etag = ""
+        self._indice_mtime = None
+        self._comprobado = 0.0
+        self._pendientes = set()
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    # --- Lectura (peticiones) ---
+
+    def indice(self) -> Optional[dict]:
+        # Otro worker puede haber regenerado: se mira la fecha del índice como mucho una vez por segundo
+        ahora = time.monotonic()
+        if ahora - self._comprobado >= 1.0:
+            self._comprobado = ahora
+            try:
+                mtime = (self.carpeta / "indice.json").stat().st_mtime_ns
+            except FileNotFoundError:
+                return self._indice
+            if mtime != self._indice_mtime:
+                self._indice_bytes = (self.carpeta / "indice.json").read_bytes()
+                self._indice = orjson.loads(self._indice_bytes)
+                self._indice_etag = _etag(self._indice_bytes)
+                self._indice_mtime = mtime
+        return self._indice
+
+    def servir_indice(self, request: Request) -> Response:
+        indice = self.indice()
+        if indice is None:
+            return _no_disponible()
+        etag = self._indice_etag
+        cabeceras = {"ETag": f'"{etag}"', "Cache-Control": f"public, max-age={min(INSTANTANEAS_MAX_AGE_S, 5)}"}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=cabeceras)
+        return Response(self._indice_bytes, media_type="application/json", headers=cabeceras)
+
+    def servir_fragmento(self, request: Request, fragmento: int, version: Optional[str]) -> Response:
+        indice = self.indice()
+        if indice is None:
+            return _no_disponible()
+        datos = indice["fragmentos"].get(str(fragmento))
+        if datos is None:
+            return Response(orjson.dumps({"detail": "Fragmento no encontrado"}), status_code=404, media_type="application/json")
+        etag = datos["etag"]
+        # Con ?v= igual al ETag actual la URL identifica un contenido que no cambia
+        cache_control = "public, max-age=31536000, immutable" if version == etag else f"public, max-age={INSTANTANEAS_MAX_AGE_S}"
+        cabeceras = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in if_none_match:
+            return Response(status_code=304, headers=dict(cabeceras, ETag=f'"{etag}"'))
+        codificacion = compresion.negociar(request.headers.get("accept-encoding", ""))
+        base = self.carpeta / f"libros-{fragmento:05d}-{etag}.json"
+        if codificacion in datos["variantes"]:
+            cabeceras.update({"ETag": f'"{etag}-{codificacion}"', "Content-Encoding": codificacion})
+            return FileResponse(f"{base}{EXTENSIONES[codificacion]}", media_type="application/json", headers=cabeceras)
+        cabeceras["ETag"] = f'"{etag}"'
+        return FileResponse(base, media_type="application/json", headers=cabeceras)
+
+    # --- Regeneración ---
+
+    def marcar(self, libros: Iterable[int]):
+        """Marca para regenerar los fragmentos de estos libros (lo llama catalogo.py tras cada commit)."""
+        with self._lock:
+            self._pendientes.update(libro_id // INSTANTANEAS_TAM_FRAGMENTO for libro_id in libros if libro_id is not None)
+        self._despertar.set()
+
+    def regenerar(self, fragmentos: Optional[set] = None) -> int:
+        """Regenera los fragmentos indicados (None: todos). Devuelve cuántos archivos JSON se reescribieron."""
+        self.carpeta.mkdir(parents=True, exist_ok=True)
+        with open(self.carpeta / ".bloqueo", "w") as bloqueo:
+            fcntl.flock(bloqueo, fcntl.LOCK_EX)
+            ruta_indice = self.carpeta / "indice.json"
+            indice = orjson.loads(ruta_indice.read_bytes()) if ruta_indice.exists() else None
+            if indice is None or indice["tam_fragmento"] != INSTANTANEAS_TAM_FRAGMENTO:
+                indice, fragmentos = {"tam_fragmento": INSTANTANEAS_TAM_FRAGMENTO, "fragmentos": {}}, None
+            completa = fragmentos is None
+            if completa and time.time() - indice.get("revisado", 0) < INSTANTANEAS_COMPLETA_S / 2 and indice["fragmentos"]:
+                return 0 # Otro worker acaba de hacer la revisión completa
+            nuevos = {}
+            with database.SessionLocal() as db:
+                for k, filas in self._leer(db, fragmentos):
+                    nuevos[k] = filas
+            escritos, cambiado = 0, completa
+            for k in (set(indice["fragmentos"]) | {str(k) for k in nuevos}) if completa else {str(k) for k in fragmentos}:
+                filas = nuevos.get(int(k))
+                if not filas:
+                    cambiado |= indice["fragmentos"].pop(k, None) is not None # Fragmento sin libros
+                    continue
+                cuerpo = orjson.dumps(filas)
+                etag = _etag(cuerpo)
+                anterior = indice["fragmentos"].get(k)
+                if anterior is not None and anterior["etag"] == etag:
+                    continue
+                variantes = self._escribir(int(k), etag, cuerpo)
+                indice["fragmentos"][k] = {"libros": len(filas), "desde": filas[0]["id"], "hasta": filas[-1]["id"], "etag": etag,
+                                           "url": f"/catalogo/instantanea/{k}?v={etag}", "variantes": variantes}
+                escritos += 1
+                cambiado = True
+            indice["fragmentos"] = dict(sorted(indice["fragmentos"].items(), key=lambda par: int(par[0])))
+            indice["total"] = sum(f["libros"] for f in indice["fragmentos"].values())
+            indice["generado"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+            if completa:
+                indice["revisado"] = time.time()
+            if cambiado:
+                temporal = self.carpeta / "indice.json.tmp"
+                temporal.write_bytes(orjson.dumps(indice, option=orjson.OPT_INDENT_2))
+                os.replace(temporal, ruta_indice)
+            self._limpiar(indice)
+        return escritos
+
+    def _leer(self, db, fragmentos: Optional[set]):
+        # Filas del esquema Libro agrupadas por fragmento; en la revisión completa, recorriendo la tabla con un cursor de servidor
+        tabla = models.Libro.__table__
+        stmt = select(*[tabla.c[nombre] for nombre in schemas.Libro.model_fields]).order_by(tabla.c.id)
+        tam = INSTANTANEAS_TAM_FRAGMENTO
+        if fragmentos is None:
+            actual, filas = None, []
+            resultado = db.execute(stmt, execution_options={"stream_results": True, "yield_per": 5000})
+            for fila in resultado.mappings():
+                k = fila["id"] // tam
+                if k != actual and filas:
+                    yield actual, filas
+                    filas = []
+                actual = k
+                filas.append(dict(fila))
+            if filas:
+                yield actual, filas
+            return
+        for k in sorted(fragmentos):
+            yield k, [dict(f) for f in db.execute(stmt.where(tabla.c.id >= k * tam, tabla.c.id < (k + 1) * tam)).mappings()]
+
+    def _escribir(self, k: int, etag: str, cuerpo: bytes) -> list:
+        base = self.carpeta / f"libros-{k:05d}-{etag}.json"
+        contenidos = {"": cuerpo}
+        for codificacion, nivel in INSTANTANEAS_NIVELES.items():
+            contenidos[EXTENSIONES[codificacion]] = compresion.comprimir_todo(codificacion, cuerpo, nivel)
+        for extension, datos in contenidos.items():
+            destino = Path(f"{base}{extension}")
+            if not destino.exists(): # Mismo nombre = mismo contenido
+                temporal = Path(f"{destino}.tmp")
+                temporal.write_bytes(datos)
+                os.replace(temporal, destino)
+        return list(INSTANTANEAS_NIVELES)
+
+    def _limpiar(self, indice: dict):
+        en_uso = {f"libros-{int(k):05d}-{datos['etag']}.json" for k, datos in indice["fragmentos"].items()}
+        limite = time.time() - INSTANTANEAS_GRACIA_S
+        for archivo in self.carpeta.glob("libros-*.json*"):
+            nombre = archivo.name
+            for extension in EXTENSIONES.values():
+                nombre = nombre.removesuffix(extension)
+            if nombre not in en_uso and archivo.stat().st_mtime < limite:
+                archivo.unlink(missing_ok=True)
+
+    def _bucle(self):
+        ultima_completa = 0.0
+        while not self._parar.is_set():
+            try:
+                if time.monotonic() - ultima_completa >= INSTANTANEAS_COMPLETA_S:
+                    ultima_completa = time.monotonic()
+                    with self._lock:
+                        self._pendientes.clear()
+                    escritos = self.regenerar()
+                    if escritos:
+                        logger.info("Instantáneas del catálogo: %d fragmentos regenerados (revisión completa)", escritos)
+                with self._lock:
+                    pendientes, self._pendientes = self._pendientes, set()
+                if pendientes:
+                    self.regenerar(pendientes)
+            except Exception:
+                logger.exception("Error al regenerar las instantáneas del catálogo")
+            self._despertar.wait(INSTANTANEAS_COMPLETA_S)
+            self._despertar.clear()
+            # Agrupa las escrituras de los próximos segundos en una sola regeneración
+            self._parar.wait(INSTANTANEAS_INTERVALO_S)
+
+    def iniciar(self):
+        """Arranca el hilo de regeneración de este proceso (evento startup de cada worker)."""
+        if self._hilo is None or not self._hilo.is_alive():
+            self._parar.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="instantaneas", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=10)
+
+
+def _no_disponible() -> Response:
+    return Response(orjson.dumps({"detail": "Instantánea del catálogo no disponible todavía"}), status_code=503,
+                    media_type="application/json", headers={"Retry-After": "5"})
+
+
+instantaneas = Instantaneas(INSTANTANEAS_DIR) if activas else None
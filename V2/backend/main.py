@@ -1,19 +1,43 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Response
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from typing import List, Union, Optional
 from datetime import date
+import anyio
+import orjson
+import logging
+import os
+from . import registro # Primero: configura el logging antes de que otros módulos registren nada
 from . import auth
 
-from . import models, schemas, crud, database
-from .auth import get_current_user  # Importa la dependencia de autenticación
+from . import models, schemas, crud, database, migraciones, arranque, metricas, consultas_lentas, perfilador, captura, compresion, catalogo, instantaneas, disponibilidad, barrido_nocturno
+from .replicas import LecturasPropias
+from .serializacion import parse_lista_param, respuesta_lista
+from .auth import get_current_user, get_usuario_admin  # Importa la dependencia de autenticación
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="API de Gestión de Biblioteca (Protegida por Keycloak)",
     description="API RESTful para la gestión de libros, ejemplares, usuarios, préstamos y multas en una biblioteca escolar.",
     version="1.0.0",
 )
+# Todas las rutas registran latencia, estado y tiempo por fase para /metrics (ver metricas.py)
+app.router.route_class = metricas.RutaMedida
+# Compresión gzip/brotli/zstd negociada con Accept-Encoding (ver compresion.py)
+if compresion.COMPRESION_ACTIVA:
+    app.add_middleware(compresion.Compresion)
+# Tras una escritura con éxito, las lecturas de ese cliente van a la primaria durante DB_REPLICA_STICKY_S segundos
+if database.enrutador_replicas is not None:
+    app.add_middleware(LecturasPropias)
+
+# En modo asíncrono (DB_ASYNC=1) los endpoints de api_async.py se registran primero y atienden
+# esas rutas; el resto sigue usando los endpoints síncronos de este archivo.
+if database.DB_ASYNC:
+    from .api_async import router as router_async
+    app.include_router(router_async)
 
 # --- NUEVO ENDPOINT DE LOGIN ---
 @app.post("/login", tags=["Autenticación"])
@@ -24,26 +48,187 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     token_data = auth.get_token(username=form_data.username, password=form_data.password)
     return {"access_token": token_data['access_token'], "refresh_token": token_data['refresh_token'], "token_type": "bearer"}
 
+# Hilos del threadpool de anyio en el que se ejecutan los endpoints 'def' (40 por defecto en anyio).
+# Más hilos que DB_POOL_SIZE + DB_MAX_OVERFLOW solo sirven para esperar una conexión del pool.
+THREADPOOL_HILOS = int(os.getenv("THREADPOOL_HILOS", "40"))
+# Con DB_FORZAR_ESQUEMA=1 se ejecutan create_all y las migraciones aunque la huella coincida
+# (p. ej. después de modificar la base de datos a mano).
+DB_FORZAR_ESQUEMA = os.getenv("DB_FORZAR_ESQUEMA", "0") == "1"
+
+def preparar_esquema():
+    # create_all consulta el catálogo tabla por tabla; si la huella guardada coincide con la del
+    # código actual, basta una consulta para saber que no hace falta ningún DDL.
+    huella = migraciones.huella_esquema(models.Base.metadata)
+    if not DB_FORZAR_ESQUEMA and migraciones.esquema_al_dia(database.engine, huella):
+        logger.info("Esquema al día (huella %s), no se ejecuta DDL.", huella[:12])
+        return
+    logger.info("Intentando crear tablas en la base de datos...")
+    models.Base.metadata.create_all(bind=database.engine)
+    logger.info("Tablas creadas (o ya existentes) en PostgreSQL.")
+    aplicadas = migraciones.aplicar_migraciones(database.engine)
+    if aplicadas:
+        logger.info("Migraciones aplicadas: %s", ", ".join(aplicadas))
+    migraciones.registrar_huella(database.engine, huella)
+
 # Crea todas las tablas en la base de datos (solo si no existen)
 @app.on_event("startup")
 def create_tables():
-    print("Intentando crear tablas en la base de datos...")
-    models.Base.metadata.create_all(bind=database.engine)
-    print("Tablas creadas (o ya existentes) en PostgreSQL.")
+    # Con gunicorn (gunicorn_conf.py) el esquema lo prepara el proceso maestro una sola vez
+    # y los workers arrancan con DB_PREPARAR_ESQUEMA=0.
+    if os.getenv("DB_PREPARAR_ESQUEMA", "1") == "1":
+        preparar_esquema()
+
+@app.on_event("startup")
+async def configurar_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_HILOS
+
+# Async para ejecutarse en el hilo del event loop, que es uno de los que muestrea el perfilador
+@app.on_event("startup")
+async def iniciar_perfilador():
+    perfilador.iniciar_continuo()
+
+# Mapeos, consultas calientes, TypeAdapters y conexiones del pool listos antes de la primera petición
+@app.on_event("startup")
+def calentar():
+    if arranque.DB_CALENTAR:
+        arranque.calentar()
+
+# uvicorn termina con la señal recibida después del apagado ordenado, así que atexit no llega a
+# ejecutarse: el archivo de captura (gzip) se cierra aquí para que quede completo
+@app.on_event("shutdown")
+def cerrar_captura():
+    captura.detener()
+
+# Un hilo por worker regenera los fragmentos de las instantáneas del catálogo tocados por escrituras
+@app.on_event("startup")
+def iniciar_instantaneas():
+    if instantaneas.activas:
+        instantaneas.instantaneas.iniciar()
+
+@app.on_event("shutdown")
+def detener_instantaneas():
+    if instantaneas.activas:
+        instantaneas.instantaneas.detener()
+
+# Una conexión LISTEN por worker reparte los eventos de disponibilidad a los clientes SSE (ver disponibilidad.py)
+@app.on_event("startup")
+async def iniciar_disponibilidad():
+    if disponibilidad.DISPONIBILIDAD_NOTIFY:
+        disponibilidad.difusor.iniciar()
+
+@app.on_event("shutdown")
+async def detener_disponibilidad():
+    await disponibilidad.difusor.detener()
+
+# Morosos y reservas caducadas una vez al día; un advisory lock hace que solo lo ejecute un worker (ver barrido_nocturno.py)
+@app.on_event("startup")
+def iniciar_barrido_nocturno():
+    if barrido_nocturno.BARRIDO_NOCTURNO:
+        barrido_nocturno.programador.iniciar()
+
+@app.on_event("shutdown")
+def detener_barrido_nocturno():
+    barrido_nocturno.programador.detener()
 
 # Dependency para obtener la sesión de la base de datos
-def get_db():
-    db = database.SessionLocal()
+def get_db(request: Request):
+    # Las subpeticiones de /batch comparten la sesión de la petición principal
+    batch = request.scope.get("batch")
+    if batch is not None:
+        yield batch["db"]
+        return
+    # POST /batch solo agrupa GET: lee de las réplicas como ellos (la cookie de lecturas propias la pone replicas.LecturasPropias)
+    metodo = "GET" if request.url.path == "/batch" else request.method
+    db = database.SessionLocal(replica=database.replica_para_lectura(metodo, request.cookies))
     try:
         yield db
     finally:
         db.close()
 
+# --- Catálogo público (sin autenticación, con caché en proceso; ver catalogo.py) ---
+
+def _leer_catalogo(consulta, primaria: bool, rango=None) -> catalogo.Generado:
+    # Sesión propia: también se ejecuta en el hilo que regenera las entradas obsoletas, fuera de la petición.
+    # Justo después de invalidar la clave se lee de la primaria: la réplica podría no tener aún el cambio.
+    with database.SessionLocal(replica=None if primaria else database.replica_para_lectura("GET", {})) as db:
+        filas = consulta(db)
+    if filas is None:
+        return None, None
+    return orjson.dumps(filas), rango(filas) if rango is not None else None
+
+async def _respuesta_catalogo(request: Request, clave: tuple, consulta, frescura: int = catalogo.CATALOGO_FRESCURA_S, rango=None) -> Response:
+    generar = lambda primaria: _leer_catalogo(consulta, primaria, rango)
+    entrada = catalogo.cache.vigente(clave, generar)
+    if entrada is None:
+        entrada = await anyio.to_thread.run_sync(catalogo.cache.obtener, clave, generar, frescura, catalogo.CATALOGO_OBSOLETA_S)
+    return catalogo.responder(request, entrada)
+
+@app.get("/catalogo/libros", response_model=List[schemas.Libro], tags=["Catálogo público"])
+async def catalogo_libros(request: Request, despues_de: int = 0, limit: int = catalogo.CATALOGO_LIMITE):
+    """
+    Página del catálogo, por orden de id. No requiere autenticación; `limit` como mucho CATALOGO_LIMITE.
+    La página siguiente se pide con `despues_de` = id del último libro recibido.
+    """
+    despues_de, limit = max(despues_de, 0), min(max(limit, 1), catalogo.CATALOGO_LIMITE)
+    return await _respuesta_catalogo(request, ("libros", despues_de, limit),
+                                     lambda db: crud.get_libros_filas_despues_de(db, despues_de=despues_de, limit=limit),
+                                     rango=lambda filas: (despues_de, filas[-1]["id"] if len(filas) == limit else None))
+
+@app.get("/catalogo/libros/{libro_id}", response_model=schemas.Libro, tags=["Catálogo público"])
+async def catalogo_libro(libro_id: int, request: Request):
+    return await _respuesta_catalogo(request, ("libro", libro_id), lambda db: crud.get_libro_fila(db, libro_id))
+
+@app.get("/catalogo/libros/{libro_id}/disponibilidad", response_model=schemas.DisponibilidadLibro, tags=["Catálogo público"])
+async def catalogo_disponibilidad(libro_id: int, request: Request):
+    """Ejemplares totales y disponibles. Cambia con cada préstamo: se cachea menos tiempo que el resto."""
+    return await _respuesta_catalogo(request, ("disponibilidad", libro_id), lambda db: crud.get_disponibilidad_fila(db, libro_id),
+                                     frescura=catalogo.CATALOGO_FRESCURA_DISPONIBILIDAD_S)
+
+@app.get("/catalogo/libros/{libro_id}/recomendaciones", response_model=List[schemas.LibroRecomendado], tags=["Catálogo público"])
+async def catalogo_recomendaciones(libro_id: int, request: Request):
+    return await _respuesta_catalogo(request, ("recomendaciones", libro_id), lambda db: crud.get_libros_recomendados_filas(db, libro_id))
+
+@app.get("/catalogo/instantanea", tags=["Catálogo público"])
+async def catalogo_instantanea(request: Request):
+    """Índice de la instantánea completa del catálogo: un fragmento por rango de ids, con su URL y ETag."""
+    if not instantaneas.activas:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Instantáneas del catálogo no activadas (INSTANTANEAS_DIR)")
+    return instantaneas.instantaneas.servir_indice(request)
+
+@app.get("/catalogo/instantanea/{fragmento}", response_model=List[schemas.Libro], tags=["Catálogo público"])
+async def catalogo_instantanea_fragmento(fragmento: int, request: Request, v: Optional[str] = None):
+    """Fragmento de la instantánea, servido desde disco ya comprimido (ver instantaneas.py)."""
+    if not instantaneas.activas:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Instantáneas del catálogo no activadas (INSTANTANEAS_DIR)")
+    return instantaneas.instantaneas.servir_fragmento(request, fragmento, v)
+
+@app.get("/catalogo/disponibilidad/eventos", tags=["Catálogo público"])
+async def catalogo_disponibilidad_eventos(libros: Optional[str] = None):
+    """
+    Server-Sent Events con los cambios de disponibilidad y los préstamos y devoluciones de los libros
+    indicados (ids separados por comas) o de todos. Sustituye a consultar /libros/{id} periódicamente.
+    """
+    if not disponibilidad.DISPONIBILIDAD_NOTIFY:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Eventos de disponibilidad no activados (DISPONIBILIDAD_NOTIFY)")
+    ids = None
+    if libros:
+        try:
+            ids = {int(v) for v in libros.split(",") if v.strip()}
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'libros' debe ser una lista de ids separados por comas")
+        if len(ids) > disponibilidad.DISPONIBILIDAD_MAX_LIBROS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Como máximo {disponibilidad.DISPONIBILIDAD_MAX_LIBROS} libros por suscripción")
+    if disponibilidad.difusor.clientes >= disponibilidad.DISPONIBILIDAD_MAX_CLIENTES:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Demasiados clientes suscritos", headers={"Retry-After": "5"})
+    # X-Accel-Buffering: que nginx no retenga los eventos en su búfer
+    return StreamingResponse(disponibilidad.difusor.flujo(ids), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- Endpoints para Libros (Protegidos) ---
 
 @app.post("/libros/", response_model=schemas.Libro, status_code=status.HTTP_201_CREATED, tags=["Libros"])
 def crear_libro(libro: schemas.LibroCreate, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
-    print(f"Petición para crear libro recibida del usuario: {usuario_actual.get('preferred_username')}")
+    logger.info("Petición para crear libro", extra={"campos": {"usuario": usuario_actual.get("preferred_username"), "isbn": libro.isbn}})
     db_libro = crud.get_libro_by_isbn(db, isbn=libro.isbn)
     if db_libro:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Ya existe un libro con este ISBN")
@@ -55,10 +240,18 @@ def crear_libro(libro: schemas.LibroCreate, db: Session = Depends(get_db), usuar
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-@app.get("/libros/", response_model=List[schemas.Libro], tags=["Libros"])
-def leer_libros(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
-    libros = crud.get_libros(db, skip=skip, limit=limit)
-    return libros
+@app.get("/libros/", response_model=List[schemas.LibroExpandido], tags=["Libros"])
+def leer_libros(skip: int = 0, limit: int = 100, fields: Optional[str] = None, expand: Optional[str] = None, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
+    """
+    Lista libros. `fields` limita las columnas devueltas (ej. `fields=id,titulo`) y `expand`
+    incrusta relaciones (`expand=ejemplares,recomendaciones`) con un número fijo de consultas.
+    """
+    campos = parse_lista_param(fields, list(schemas.Libro.model_fields), "fields")
+    expansiones = parse_lista_param(expand, list(crud.EXPANSIONES_LIBRO), "expand")
+    libros = crud.get_libros_filas(db, skip=skip, limit=limit, campos=campos or None, expand=expansiones)
+    if campos:
+        return respuesta_lista(libros, None)
+    return respuesta_lista(libros, "libros_expandidos" if expansiones else "libros")
 
 @app.get("/libros/{libro_id}", response_model=schemas.Libro, tags=["Libros"])
 def leer_libro(libro_id: int, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
@@ -111,8 +304,8 @@ def crear_ejemplar(ejemplar: schemas.EjemplarCreate, db: Session = Depends(get_d
 
 @app.get("/ejemplares/", response_model=List[schemas.Ejemplar], tags=["Ejemplares"])
 def leer_ejemplares(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
-    ejemplares = crud.get_ejemplares(db, skip=skip, limit=limit)
-    return ejemplares
+    ejemplares = crud.get_ejemplares_filas(db, skip=skip, limit=limit)
+    return respuesta_lista(ejemplares, "ejemplares")
 
 @app.get("/ejemplares/{ejemplar_id}", response_model=schemas.Ejemplar, tags=["Ejemplares"])
 def leer_ejemplar(ejemplar_id: int, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
@@ -192,14 +385,8 @@ def crear_alumno(alumno: schemas.AlumnoCreate, db: Session = Depends(get_db), us
 
 @app.get("/usuarios/", response_model=List[Union[schemas.Profesor, schemas.Alumno]], tags=["Usuarios"])
 def leer_usuarios(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
-    usuarios = crud.get_usuarios(db, skip=skip, limit=limit)
-    response_users = []
-    for user in usuarios:
-        if user.tipo_usuario == "profesor":
-            response_users.append(schemas.Profesor.model_validate(user))
-        elif user.tipo_usuario == "alumno":
-            response_users.append(schemas.Alumno.model_validate(user))
-    return response_users
+    usuarios = crud.get_usuarios_filas(db, skip=skip, limit=limit)
+    return respuesta_lista(usuarios, "usuarios")
 
 @app.get("/usuarios/{usuario_id}", response_model=Union[schemas.Profesor, schemas.Alumno], tags=["Usuarios"])
 def leer_usuario(usuario_id: int, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
@@ -213,6 +400,24 @@ def leer_usuario(usuario_id: int, db: Session = Depends(get_db), usuario_actual:
     else:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Tipo de usuario desconocido")
 
+@app.get("/usuarios/{usuario_id}/resumen", response_model=schemas.ResumenUsuario, tags=["Usuarios"])
+def leer_resumen_usuario(usuario_id: int, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
+    """
+    Estado completo de la cuenta: perfil, préstamos activos con título, multa activa y totales del historial.
+    """
+    resumen = crud.get_resumen_usuario(db, usuario_id=usuario_id)
+    if resumen is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    return resumen
+
+@app.get("/usuarios/{usuario_id}/prestamos/", response_model=List[schemas.Prestamo], tags=["Préstamos"])
+def leer_prestamos_usuario(usuario_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
+    db_usuario = crud.get_usuario(db, usuario_id=usuario_id)
+    if not db_usuario:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    prestamos = crud.get_prestamos_by_usuario(db, usuario_id=usuario_id, skip=skip, limit=limit)
+    return prestamos
+
 @app.put("/usuarios/{usuario_id}", response_model=Union[schemas.Profesor, schemas.Alumno], tags=["Usuarios"])
 def actualizar_usuario(usuario_id: int, usuario_update: Union[schemas.ProfesorCreate, schemas.AlumnoCreate], db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
     db_usuario = crud.get_usuario(db, usuario_id=usuario_id)
@@ -267,8 +472,8 @@ def crear_prestamo(prestamo: schemas.PrestamoCreate, db: Session = Depends(get_d
 
 @app.get("/prestamos/", response_model=List[schemas.Prestamo], tags=["Préstamos"])
 def leer_prestamos(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
-    prestamos = crud.get_prestamos(db, skip=skip, limit=limit)
-    return prestamos
+    prestamos = crud.get_prestamos_filas(db, skip=skip, limit=limit)
+    return respuesta_lista(prestamos, "prestamos")
 
 @app.get("/prestamos/{prestamo_id}", response_model=schemas.Prestamo, tags=["Préstamos"])
 def leer_prestamo(prestamo_id: int, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
@@ -293,6 +498,48 @@ def devolver_ejemplar_api(ejemplar_id: int, db: Session = Depends(get_db), usuar
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+# --- Endpoints para Reservas (Protegidos) ---
+# Cola de espera por libro: al devolverse un ejemplar se aparta para la primera reserva (ver crud.py)
+
+@app.post("/reservas/", response_model=schemas.Reserva, status_code=status.HTTP_201_CREATED, tags=["Reservas"])
+def crear_reserva(reserva: schemas.ReservaCreate, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
+    try:
+        return crud.create_reserva(db=db, reserva=reserva)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="El usuario ya tiene una reserva de este libro.")
+
+@app.get("/reservas/{reserva_id}", response_model=schemas.ReservaEnCola, tags=["Reservas"])
+def leer_reserva(reserva_id: int, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
+    db_reserva = crud.get_reserva(db, reserva_id=reserva_id)
+    if db_reserva is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reserva no encontrada (o ya recogida, cancelada o caducada)")
+    delante = crud.contar_reservas_delante(db, db_reserva)
+    return schemas.ReservaEnCola(**schemas.Reserva.model_validate(db_reserva).model_dump(), delante=delante)
+
+@app.delete("/reservas/{reserva_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Reservas"])
+def cancelar_reserva(reserva_id: int, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
+    db_reserva = crud.get_reserva(db, reserva_id=reserva_id, bloquear=True)
+    if db_reserva is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reserva no encontrada")
+    crud.delete_reserva(db=db, db_reserva=db_reserva)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@app.get("/libros/{libro_id}/reservas/", response_model=List[schemas.Reserva], tags=["Reservas"])
+def leer_reservas_libro(libro_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
+    return crud.get_reservas_by_libro(db, libro_id=libro_id, skip=skip, limit=limit)
+
+@app.get("/usuarios/{usuario_id}/reservas/", response_model=List[schemas.Reserva], tags=["Reservas"])
+def leer_reservas_usuario(usuario_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
+    return crud.get_reservas_by_usuario(db, usuario_id=usuario_id, skip=skip, limit=limit)
+
+@app.post("/reservas/caducar", tags=["Reservas"])
+def caducar_reservas(db: Session = Depends(get_db), usuario_actual: dict = Depends(get_usuario_admin)):
+    """Quita las reservas con el plazo de recogida vencido y pasa sus ejemplares a la siguiente de cada cola."""
+    return {"caducadas": crud.caducar_reservas(db)}
+
 # --- Endpoints para Multas (Protegidos) ---
 
 @app.get("/multas/{multa_id}", response_model=schemas.Multa, tags=["Multas"])
@@ -365,8 +612,8 @@ def leer_historial_prestamos_usuario(usuario_id: int, skip: int = 0, limit: int
     db_usuario = crud.get_usuario(db, usuario_id=usuario_id)
     if not db_usuario:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
-    historial = crud.get_prestamos_historicos_by_usuario(db, usuario_id=usuario_id, skip=skip, limit=limit)
-    return historial
+    historial = crud.get_prestamos_historicos_filas_by_usuario(db, usuario_id=usuario_id, skip=skip, limit=limit)
+    return respuesta_lista(historial, "prestamos_historicos")
 
 @app.get("/historial/multas/{multa_historica_id}", response_model=schemas.MultaHistorica, tags=["Históricos"])
 def leer_multa_historica(multa_historica_id: int, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
@@ -380,5 +627,157 @@ def leer_historial_multas_usuario(usuario_id: int, skip: int = 0, limit: int = 1
     db_usuario = crud.get_usuario(db, usuario_id=usuario_id)
     if not db_usuario:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
-    historial = crud.get_multas_historicas_by_usuario(db, usuario_id=usuario_id, skip=skip, limit=limit)
-    return historial
+    historial = crud.get_multas_historicas_filas_by_usuario(db, usuario_id=usuario_id, skip=skip, limit=limit)
+    return respuesta_lista(historial, "multas_historicas")
+
+# --- Exportaciones completas en NDJSON (Protegidas) ---
+
+EXPORTAR_LOTE = int(os.getenv("EXPORTAR_LOTE", "1000"))
+
+def _exportar_ndjson(request: Request, nombre: str, generar) -> StreamingResponse:
+    # Una línea JSON por fila, enviada por lotes según llega de la base de datos (el middleware de
+    # compresión comprime cada lote al vuelo). La sesión se abre en el propio generador porque vive
+    # mientras dura el envío, más allá de la función del endpoint.
+    replica = database.replica_para_lectura(request.method, request.cookies)
+
+    def lineas():
+        with database.SessionLocal(replica=replica) as db:
+            for filas in generar(db, lote=EXPORTAR_LOTE):
+                yield b"".join(orjson.dumps(fila, option=orjson.OPT_APPEND_NEWLINE) for fila in filas)
+
+    return StreamingResponse(lineas(), media_type="application/x-ndjson", headers={"Content-Disposition": f'attachment; filename="{nombre}.ndjson"'})
+
+@app.get("/exportar/libros", response_class=StreamingResponse, tags=["Exportación"])
+def exportar_libros(request: Request, usuario_actual: dict = Depends(get_current_user)):
+    """Catálogo completo, un libro por línea (NDJSON)."""
+    return _exportar_ndjson(request, "libros", crud.exportar_libros_filas)
+
+@app.get("/exportar/usuarios", response_class=StreamingResponse, tags=["Exportación"])
+def exportar_usuarios(request: Request, usuario_actual: dict = Depends(get_usuario_admin)):
+    """Todos los usuarios con sus datos personales, uno por línea (NDJSON). Solo administración."""
+    return _exportar_ndjson(request, "usuarios", crud.exportar_usuarios_filas)
+
+@app.get("/exportar/historial/prestamos", response_class=StreamingResponse, tags=["Exportación"])
+def exportar_historial_prestamos(request: Request, usuario_actual: dict = Depends(get_usuario_admin)):
+    """Historial completo de préstamos, uno por línea (NDJSON). Solo administración."""
+    return _exportar_ndjson(request, "historial_prestamos", crud.exportar_prestamos_historicos_filas)
+
+# --- Endpoint de peticiones agrupadas (Protegido) ---
+
+# Respuestas en streaming (exportaciones NDJSON, eventos SSE): se acumularían enteras en memoria o no
+# terminarían nunca, así que no se admiten como subpeticiones
+RUTAS_FUERA_DE_BATCH = ("/exportar/", "/catalogo/disponibilidad/eventos")
+
+async def _despachar_subpeticion(request: Request, sub: schemas.SubPeticionBatch, db: Session, usuario_actual: dict) -> schemas.RespuestaSubPeticion:
+    # Ejecuta un GET contra la propia aplicación (ASGI en proceso), reutilizando el usuario y la sesión.
+    path, _, query = sub.path.partition("?")
+    if not path.startswith("/") or path.rstrip("/") == "/batch" or path.startswith(RUTAS_FUERA_DE_BATCH):
+        return schemas.RespuestaSubPeticion(id=sub.id, status=status.HTTP_400_BAD_REQUEST, body={"detail": "Ruta no válida para /batch"})
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": request.url.scheme,
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": request.scope.get("root_path", ""),
+        "headers": [(k, v) for k, v in request.scope["headers"] if k in (b"authorization", b"host", b"accept")],
+        "client": request.scope.get("client"),
+        "server": request.scope.get("server"),
+        "batch": {"db": db, "usuario": usuario_actual},
+    }
+    respuesta = {"status": 500, "tipo": "", "body": b""}
+    cuerpo_leido, terminada = False, anyio.Event()
+
+    async def receive():
+        # El cuerpo (vacío) una vez; después, como un cliente conectado hasta que termina la respuesta
+        nonlocal cuerpo_leido
+        if not cuerpo_leido:
+            cuerpo_leido = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await terminada.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(mensaje):
+        if mensaje["type"] == "http.response.start":
+            respuesta["status"] = mensaje["status"]
+            respuesta["tipo"] = next((v.decode("latin-1") for k, v in mensaje.get("headers", []) if k == b"content-type"), "")
+        elif mensaje["type"] == "http.response.body":
+            respuesta["body"] += mensaje.get("body", b"")
+            if not mensaje.get("more_body", False):
+                terminada.set()
+
+    try:
+        await app(scope, receive, send)
+    except Exception:
+        # Un error en una subpetición no debe dejar la sesión compartida inutilizable para las demás
+        db.rollback()
+        respuesta["status"] = status.HTTP_500_INTERNAL_SERVER_ERROR
+    finally:
+        terminada.set()
+    body = None
+    if respuesta["body"]:
+        tipo = respuesta["tipo"].split(";")[0].strip()
+        if tipo == "application/json" or tipo.endswith("+json"):
+            try:
+                body = orjson.loads(respuesta["body"])
+            except orjson.JSONDecodeError:
+                respuesta["status"] = status.HTTP_502_BAD_GATEWAY
+                body = {"detail": "La subpetición devolvió un JSON no válido"}
+        else:
+            # /metrics, /docs, exportaciones NDJSON...: el cuerpo se devuelve como texto
+            body = respuesta["body"].decode("utf-8", errors="replace")
+    return schemas.RespuestaSubPeticion(id=sub.id, status=respuesta["status"], body=body)
+
+@app.post("/batch", response_model=List[schemas.RespuestaSubPeticion], tags=["Batch"])
+async def batch(peticion: schemas.PeticionBatch, request: Request, db: Session = Depends(get_db), usuario_actual: dict = Depends(get_current_user)):
+    """
+    Ejecuta varias peticiones GET de la API en una sola llamada: el token se valida una vez
+    y todas las subpeticiones comparten la misma sesión de base de datos.
+    Como una sesión de SQLAlchemy no admite uso concurrente, las subpeticiones se ejecutan en orden.
+    """
+    return [await _despachar_subpeticion(request, sub, db, usuario_actual) for sub in peticion.peticiones]
+
+# --- Métricas ---
+
+@app.get("/metrics", include_in_schema=False)
+def exportar_metricas():
+    """Métricas en formato Prometheus (sumadas entre workers si PROMETHEUS_MULTIPROC_DIR está definido)."""
+    contenido, tipo = metricas.exportar()
+    return Response(content=contenido, media_type=tipo)
+
+@app.get("/metricas/pool", response_model=schemas.MetricasPools, tags=["Métricas"])
+def leer_metricas_pool(usuario_actual: dict = Depends(get_current_user)):
+    """
+    Estado y contadores del pool de conexiones de este worker: checkouts, esperas por falta de
+    conexiones libres, tiempo de espera, timeouts y uso del overflow. Sirve para dimensionar
+    DB_POOL_SIZE/DB_MAX_OVERFLOW según el número de workers y max_connections de PostgreSQL.
+    Si hay réplicas de lectura configuradas incluye su retraso, si se están usando y sus pools.
+    """
+    return database.metricas_pool()
+
+# --- Administración ---
+
+@app.get("/admin/consultas-lentas", response_model=List[schemas.ConsultaLenta], tags=["Administración"])
+def leer_consultas_lentas(usuario_actual: dict = Depends(get_usuario_admin)):
+    """
+    Últimas sentencias SQL que superaron SQL_LENTA_MS en este worker, con la ruta que las originó,
+    sus parámetros y, para los SELECT muestreados, el plan de EXPLAIN (ANALYZE, BUFFERS).
+    Requiere el rol KEYCLOAK_ROL_ADMIN.
+    """
+    return consultas_lentas.consultas_lentas()
+
+@app.get("/admin/perfil", response_class=PlainTextResponse, tags=["Administración"])
+def leer_perfil_continuo(ruta: Optional[str] = None, usuario_actual: dict = Depends(get_usuario_admin)):
+    """
+    Pilas muestreadas por el perfilador continuo (PERFIL_CONTINUO=1) en la última ventana de este
+    worker, en formato colapsado para flamegraph.pl/speedscope. El primer marco de cada pila es la
+    ruta ("GET /libros/"), o "(event loop)"; con ?ruta= se filtra por una sola ruta.
+    Para perfilar una sola petición, enviarla con la cabecera X-Perfil: 1.
+    """
+    pilas = perfilador.perfil_continuo(ruta)
+    if pilas is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="El perfilador continuo no está activo (PERFIL_CONTINUO=1)")
+    return pilas
@@ -0,0 +1,290 @@
+# library_project/backend/metricas.py
+"""
+Métricas de la API en formato Prometheus (GET /metrics).
+
+- biblioteca_peticiones_total{metodo, ruta, estado}: peticiones atendidas por ruta y código de estado.
+- biblioteca_duracion_peticion_segundos{metodo, ruta}: histograma de latencia por ruta.
+- biblioteca_peticiones_en_curso{metodo, ruta}: peticiones en curso en este momento.
+- biblioteca_tiempo_fase_segundos{metodo, ruta, fase}: tiempo de cada petición en autenticación con Keycloak
+  ("auth"), consultas a la base de datos ("db"), serialización de la respuesta ("serializacion") y
+  el resto ("otros").
+- biblioteca_consultas_sql_por_peticion{metodo, ruta}: histograma de sentencias SQL por petición.
+
+Además, cada petición cuenta sus sentencias SQL:
+- Si supera el presupuesto de su ruta (PRESUPUESTO_CONSULTAS, o SQL_PRESUPUESTO_POR_DEFECTO) se
+  registra un aviso, y otro si una misma sentencia se repite SQL_UMBRAL_N_MAS_1 veces o más
+  (típico N+1: una relación perezosa recorrida en un bucle).
+- Con SQL_CABECERAS_DEBUG=1 la respuesta incluye X-Consultas-SQL y X-Tiempo-DB-ms.
+
+'ruta' es la plantilla de la ruta (/libros/{libro_id}), no la URL, para que el número de series no crezca.
+
+Cada petición se registra también en el log de accesos, con su id de correlación (ver registro.py), y
+en la captura de tráfico si CAPTURA_ARCHIVO está definido (ver captura.py).
+
+Con varios workers (gunicorn) cada proceso tiene sus propios contadores: si PROMETHEUS_MULTIPROC_DIR
+apunta a una carpeta, prometheus_client guarda los valores ahí y /metrics devuelve la suma de todos
+los workers. gunicorn_conf.py vacía la carpeta al arrancar y marca los workers que terminan.
+"""
+import inspect
+import logging
+import os
+import time
+from collections import Counter as Contador
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, List, Optional
+
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.exceptions import HTTPException
+from starlette.responses import PlainTextResponse
+
+from . import captura, perfilador, registro
+
+MULTIPROCESO = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+SQL_CABECERAS_DEBUG = os.getenv("SQL_CABECERAS_DEBUG", "0") == "1"
+SQL_PRESUPUESTO_POR_DEFECTO = int(os.getenv("SQL_PRESUPUESTO_POR_DEFECTO", "10"))
+SQL_UMBRAL_N_MAS_1 = int(os.getenv("SQL_UMBRAL_N_MAS_1", "5"))
+
+# Máximo de sentencias esperado en las rutas calientes (medido con las consultas actuales de crud.py)
+PRESUPUESTO_CONSULTAS = {
+    ("GET", "/libros/"): 3, # 1, o 1 + una por relación con ?expand=
+    ("GET", "/libros/{libro_id}"): 1,
+    ("GET", "/ejemplares/"): 1,
+    ("GET", "/usuarios/"): 1,
+    ("GET", "/usuarios/{usuario_id}"): 2,
+    ("GET", "/usuarios/{usuario_id}/resumen"): 1,
+    ("GET", "/usuarios/{usuario_id}/prestamos/"): 2,
+    ("GET", "/usuarios/{usuario_id}/historial/prestamos/"): 2,
+    ("GET", "/usuarios/{usuario_id}/historial/multas/"): 2,
+    ("GET", "/prestamos/"): 1,
+    ("POST", "/ejemplares/"): 11, # 9 (con el SELECT ... FOR UPDATE del libro), + 2 si el libro tiene cola de reservas (el ejemplar va a la primera)
+    ("POST", "/ejemplares/{ejemplar_id}/devolver/"): 13, # 11 (con el pg_notify de disponibilidad.py y el FOR UPDATE del libro), + 2 si hay cola de reservas
+}
+
+logger = logging.getLogger(__name__)
+
+PETICIONES = Counter("biblioteca_peticiones_total", "Peticiones HTTP atendidas", ["metodo", "ruta", "estado"])
+DURACION = Histogram("biblioteca_duracion_peticion_segundos", "Duración de las peticiones HTTP", ["metodo", "ruta"])
+EN_CURSO = Gauge("biblioteca_peticiones_en_curso", "Peticiones HTTP en curso", ["metodo", "ruta"], multiprocess_mode="livesum")
+CONSULTAS = Histogram("biblioteca_consultas_sql_por_peticion", "Sentencias SQL ejecutadas por petición", ["metodo", "ruta"],
+                      buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+FASES = Histogram("biblioteca_tiempo_fase_segundos", "Tiempo de cada petición por fase (auth, db, serializacion, otros)", ["metodo", "ruta", "fase"],
+                  buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+
+# Tiempos por fase de la petición en curso. Los endpoints síncronos se ejecutan en el threadpool con una
+# copia del contexto, pero la copia apunta al mismo diccionario, así que lo que suman se ve aquí.
+_tiempos: ContextVar[Optional[dict]] = ContextVar("tiempos_peticion", default=None)
+# Sentencias SQL de la petición en curso y cuántas veces se ha ejecutado cada una
+_sentencias: ContextVar[Optional[Contador]] = ContextVar("sentencias_peticion", default=None)
+# "METODO /plantilla/de/ruta" de la petición en curso, para atribuir lo que se mide fuera de este módulo
+_ruta: ContextVar[Optional[str]] = ContextVar("ruta_peticion", default=None)
+
+
+def ruta_actual() -> Optional[str]:
+    return _ruta.get()
+
+
+def sumar(fase: str, segundos: float):
+    tiempos = _tiempos.get()
+    if tiempos is not None:
+        tiempos[fase] = tiempos.get(fase, 0.0) + segundos
+
+
+@contextmanager
+def medir(fase: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        sumar(fase, time.perf_counter() - inicio)
+
+
+# --- Tiempo en la base de datos: todas las consultas de cualquier engine (primaria, réplicas, asyncpg) ---
+@event.listens_for(Engine, "before_cursor_execute")
+def _inicio_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info["inicio_consulta"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _fin_consulta(conn, cursor, statement, parameters, context, executemany):
+    inicio = conn.info.pop("inicio_consulta", None)
+    if inicio is not None:
+        sumar("db", time.perf_counter() - inicio)
+    sentencias = _sentencias.get()
+    if sentencias is not None:
+        sentencias[statement] += 1
+
+
+def _revisar_consultas(metodo: str, ruta: str, sentencias: Contador) -> int:
+    total = sum(sentencias.values())
+    CONSULTAS.labels(metodo, ruta).observe(total)
+    presupuesto = PRESUPUESTO_CONSULTAS.get((metodo, ruta), SQL_PRESUPUESTO_POR_DEFECTO)
+    if total > presupuesto:
+        logger.warning("%s %s ejecutó %d sentencias SQL (presupuesto: %d)", metodo, ruta, total, presupuesto)
+    for sentencia, veces in sentencias.items():
+        if veces >= SQL_UMBRAL_N_MAS_1:
+            logger.warning("Posible N+1 en %s %s: %d ejecuciones de %s", metodo, ruta, veces, " ".join(sentencia.split())[:200])
+    return total
+
+
+def _marcar_fin(tiempos: Optional[dict]):
+    if tiempos is not None:
+        tiempos["fin_endpoint"] = time.perf_counter()
+
+
+def _marcar_fin_endpoint(endpoint: Callable) -> Callable:
+    # Lo que pasa entre el final del endpoint y la respuesta construida es serialización (response_model)
+    if inspect.iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def envoltura(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _marcar_fin(_tiempos.get())
+    else:
+        @wraps(endpoint)
+        def envoltura(*args, **kwargs):
+            try:
+                with perfilador.hilo_en_peticion(_ruta.get()):
+                    return endpoint(*args, **kwargs)
+            finally:
+                _marcar_fin(_tiempos.get())
+    return envoltura
+
+
+class RutaMedida(APIRoute):
+    """
+    APIRoute que registra las métricas de cada petición: se usa como route_class de la aplicación y de
+    los routers, así las etiquetas usan la plantilla de la ruta ya resuelta por FastAPI.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _marcar_fin_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        ruta = self.path
+
+        async def handler_medido(request):
+            metodo = request.method
+            en_curso = EN_CURSO.labels(metodo, ruta)
+            en_curso.inc()
+            tiempos = {"auth": 0.0, "db": 0.0, "serializacion": 0.0}
+            sentencias = Contador()
+            token = _tiempos.set(tiempos)
+            token_sentencias = _sentencias.set(sentencias)
+            token_ruta = _ruta.set(f"{metodo} {ruta}")
+            token_id = registro.asignar_id_peticion(request)
+            respuesta = None
+            estado = 500
+            inicio = time.perf_counter()
+            try:
+                if perfilador.solicitado(request):
+                    respuesta = await _perfilar(handler, request)
+                else:
+                    respuesta = await handler(request)
+                estado = respuesta.status_code
+                return respuesta
+            except HTTPException as e:
+                estado = e.status_code
+                e.headers = {**(e.headers or {}), registro.CABECERA_ID_PETICION: registro.id_peticion()}
+                raise
+            except RequestValidationError:
+                estado = 422
+                raise
+            finally:
+                fin = time.perf_counter()
+                _tiempos.reset(token)
+                _sentencias.reset(token_sentencias)
+                _ruta.reset(token_ruta)
+                en_curso.dec()
+                duracion = fin - inicio
+                PETICIONES.labels(metodo, ruta, str(estado)).inc()
+                DURACION.labels(metodo, ruta).observe(duracion)
+                fin_endpoint = tiempos.pop("fin_endpoint", None)
+                if fin_endpoint is not None:
+                    tiempos["serializacion"] += fin - fin_endpoint
+                tiempos["otros"] = max(duracion - sum(tiempos.values()), 0.0)
+                for fase, segundos in tiempos.items():
+                    FASES.labels(metodo, ruta, fase).observe(segundos)
+                total = _revisar_consultas(metodo, ruta, sentencias)
+                registro.registrar_acceso(metodo, ruta, estado, duracion, tiempos["db"], total, getattr(request.state, "usuario", None))
+                if captura.activa:
+                    captura.registrar(request, ruta, estado, duracion)
+                if respuesta is not None:
+                    respuesta.headers[registro.CABECERA_ID_PETICION] = registro.id_peticion()
+                    if SQL_CABECERAS_DEBUG:
+                        respuesta.headers["X-Consultas-SQL"] = str(total)
+                        respuesta.headers["X-Tiempo-DB-ms"] = f"{tiempos['db'] * 1000:.2f}"
+                registro.restaurar_id_peticion(token_id)
+
+        return handler_medido
+
+
+async def _perfilar(handler, request):
+    with perfilador.perfilar() as perfil:
+        respuesta = await handler(request)
+    # Solo hay muestreador si auth.get_current_user comprobó que el usuario tiene el rol de administración
+    muestreador = perfil.muestreador
+    if muestreador is None:
+        return respuesta
+    return PlainTextResponse(perfilador.colapsar(muestreador.pilas), headers={
+        "X-Estado-Original": str(respuesta.status_code),
+        "X-Perfil-Muestras": str(muestreador.muestras),
+        "X-Perfil-Intervalo-ms": str(perfilador.PERFIL_INTERVALO_MS),
+    })
+
+
+def exportar() -> tuple:
+    """Cuerpo y content-type de /metrics; en modo multiproceso, agregando todos los workers."""
+    if MULTIPROCESO:
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = REGISTRY
+    return generate_latest(registro), CONTENT_TYPE_LATEST
+
+
+class ContadorConsultas:
+    """
+    Cuenta las sentencias SQL que ejecuta cualquier engine mientras está activo, sin depender del
+    contexto de la petición (sirve con TestClient, que atiende la petición en otro hilo). Pensado para
+    pruebas: ver el fixture consultas_sql de pytest_consultas.py.
+
+        with ContadorConsultas() as contador:
+            with contador.limite(2):
+                cliente.get("/usuarios/1/resumen")
+    """
+
+    def __init__(self):
+        self.sentencias: List[str] = []
+        self.parametros: List = [] # Los de cada sentencia, en el mismo orden (para repetirla con EXPLAIN)
+
+    def _registrar(self, conn, cursor, statement, parameters, context, executemany):
+        self.sentencias.append(statement)
+        self.parametros.append(parameters)
+
+    def __enter__(self):
+        event.listen(Engine, "after_cursor_execute", self._registrar)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, "after_cursor_execute", self._registrar)
+
+    @property
+    def total(self) -> int:
+        return len(self.sentencias)
+
+    @contextmanager
+    def limite(self, maximo: int):
+        """Falla (AssertionError) si dentro del bloque se ejecutan más de `maximo` sentencias."""
+        antes = len(self.sentencias)
+        yield
+        nuevas = self.sentencias[antes:]
+        assert len(nuevas) <= maximo, f"{len(nuevas)} sentencias SQL (máximo {maximo}):\n" + "\n".join(" ".join(s.split())[:200] for s in nuevas)
@@ -0,0 +1,128 @@
+# library_project/backend/metricas_pool.py
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# --- Configuración del pool (variables de entorno) ---
+# Conexiones totales por proceso = DB_POOL_SIZE + DB_MAX_OVERFLOW; multiplicar por el número de workers
+# para comprobar que no se supera max_connections de PostgreSQL.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1")) # Segundos; -1 = no reciclar
+# Estrategia de comprobación de conexiones al sacarlas del pool:
+#   "siempre"   -> pool_pre_ping de SQLAlchemy: un round trip en cada checkout (comportamiento anterior)
+#   "inactivas" -> solo se comprueban las que llevan más de DB_PRE_PING_INACTIVIDAD segundos sin usarse
+#   "nunca"     -> sin comprobación; una conexión caída falla una vez y el pool se invalida
+DB_PRE_PING = os.getenv("DB_PRE_PING", "siempre")
+DB_PRE_PING_INACTIVIDAD = float(os.getenv("DB_PRE_PING_INACTIVIDAD", "30"))
+
+if DB_PRE_PING not in ("siempre", "inactivas", "nunca"):
+    raise ValueError(f"DB_PRE_PING no válido: {DB_PRE_PING} (use siempre, inactivas o nunca)")
+
+
+class _MedicionPool:
+    """
+    Cuenta checkouts, esperas por falta de conexiones libres, tiempo de espera, timeouts
+    y el uso máximo del overflow. Se mezcla con QueuePool / AsyncAdaptedQueuePool.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock_metricas = threading.Lock()
+        self._metricas = {
+            "checkouts_total": 0,
+            "esperas_total": 0,
+            "tiempo_espera_total_s": 0.0,
+            "tiempo_espera_max_s": 0.0,
+            "timeouts_total": 0,
+            "overflow_max": 0,
+            "pre_pings_total": 0,
+        }
+
+    def _do_get(self):
+        # Sin conexiones libres y con el overflow agotado, el checkout tiene que esperar a que se devuelva una
+        espera = self.checkedin() == 0 and self._max_overflow > -1 and self._overflow >= self._max_overflow
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._lock_metricas:
+                self._metricas["timeouts_total"] += 1
+            raise
+        finally:
+            duracion = time.perf_counter() - inicio
+            with self._lock_metricas:
+                m = self._metricas
+                m["checkouts_total"] += 1
+                if espera:
+                    m["esperas_total"] += 1
+                    m["tiempo_espera_total_s"] += duracion
+                    m["tiempo_espera_max_s"] = max(m["tiempo_espera_max_s"], duracion)
+                m["overflow_max"] = max(m["overflow_max"], self.overflow())
+
+    def contar_pre_ping(self):
+        with self._lock_metricas:
+            self._metricas["pre_pings_total"] += 1
+
+    def metricas(self) -> dict:
+        with self._lock_metricas:
+            datos = dict(self._metricas)
+        datos.update({
+            "pool_size": self.size(),
+            "max_overflow": self._max_overflow,
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+        })
+        return datos
+
+
+class PoolMedido(_MedicionPool, QueuePool):
+    pass
+
+
+class PoolAsyncMedido(_MedicionPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def opciones_engine(asincrono: bool = False) -> dict:
+    """Argumentos de create_engine / create_async_engine según la configuración del entorno."""
+    return {
+        "poolclass": PoolAsyncMedido if asincrono else PoolMedido,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_PRE_PING == "siempre",
+    }
+
+
+def instalar_pre_ping_inactivas(engine):
+    """
+    Para DB_PRE_PING=inactivas: comprueba con SELECT 1 solo las conexiones que llevan tiempo sin usarse.
+    Si la comprobación falla, DisconnectionError hace que el pool descarte la conexión y abra otra.
+    """
+    if DB_PRE_PING != "inactivas":
+        return
+
+    @event.listens_for(engine, "checkin")
+    def marcar_devolucion(dbapi_connection, connection_record):
+        connection_record.info["devuelta_el"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def comprobar_inactiva(dbapi_connection, connection_record, connection_proxy):
+        devuelta_el = connection_record.info.get("devuelta_el")
+        if devuelta_el is None or time.monotonic() - devuelta_el < DB_PRE_PING_INACTIVIDAD:
+            return
+        engine.pool.contar_pre_ping()
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except Exception as e:
+            raise exc.DisconnectionError() from e
+        finally:
+            cursor.close()
@@ -0,0 +1,6 @@
+-- Índices para las consultas de préstamos activos e históricos por usuario
+-- (resumen de usuario, historial y límite de préstamos en create_prestamo).
+-- Los nombres coinciden con los que genera index=True en models.py, así que en una base
+-- nueva creada con create_all estas sentencias no hacen nada.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_prestamos_id_usuario ON prestamos (id_usuario);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_prestamos_historicos_id_usuario ON prestamos_historicos (id_usuario);
@@ -0,0 +1,9 @@
+-- Índices para el resto de claves foráneas que se filtran o se unen en crud.py:
+-- ejemplares por libro, recomendaciones por libro origen y destino, historial por ejemplar,
+-- préstamos históricos por multa y multas históricas por usuario.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ejemplares_id_libro ON ejemplares (id_libro);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_recomendaciones_id_libro_origen ON recomendaciones (id_libro_origen);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_recomendaciones_id_libro_recomendado ON recomendaciones (id_libro_recomendado);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_prestamos_historicos_id_ejemplar ON prestamos_historicos (id_ejemplar);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_prestamos_historicos_id_multa ON prestamos_historicos (id_multa);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_multas_historicas_id_usuario ON multas_historicas (id_usuario);
@@ -0,0 +1,3 @@
+-- Contador de reservas en espera por libro (models.Libro.numReservas). En las bases creadas antes
+-- de las reservas create_all no añade la columna, y con DEFAULT constante PostgreSQL no reescribe la tabla.
+ALTER TABLE libros ADD COLUMN IF NOT EXISTS "numReservas" INTEGER NOT NULL DEFAULT 0;
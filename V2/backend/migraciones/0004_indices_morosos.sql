@@ -0,0 +1,5 @@
+-- Índices del barrido nocturno de morosos (barrido_nocturno.py): préstamos vencidos por fecha de
+-- devolución esperada y usuarios en estado MOROSO (índice parcial, pequeño). Los nombres coinciden
+-- con los de models.py, así que en una base nueva creada con create_all no hacen nada.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_prestamos_fecha_devolucion_esperada ON prestamos (fecha_devolucion_esperada);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_usuarios_morosos ON usuarios (id) WHERE estado = 'MOROSO';
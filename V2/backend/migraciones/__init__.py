@@ -0,0 +1,134 @@
+# library_project/backend/migraciones/__init__.py
+import hashlib
+import re
+from pathlib import Path
+
+from sqlalchemy import Enum, MetaData, exc, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+# Carpeta con los scripts .sql numerados (0001_..., 0002_...). Se aplican en orden y una sola vez.
+CARPETA_MIGRACIONES = Path(__file__).parent
+
+# Clave del advisory lock que serializa las migraciones entre instancias que arrancan a la vez
+_CLAVE_BLOQUEO = 0x6D696772 # "migr"
+
+# Literales, identificadores entre comillas, dollar quoting y comentarios: un ';' dentro no separa sentencias
+_TROZOS_SQL = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(\$\w*\$).*?\1|--[^\n]*|/\*.*?\*/|;", re.S)
+_INDICE_CONCURRENTE = re.compile(r"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?\"?(\w+)", re.I)
+
+
+def _sentencias(script: str):
+    inicio = 0
+    for trozo in _TROZOS_SQL.finditer(script):
+        if trozo.group() == ";":
+            yield from _no_vacia(script[inicio:trozo.start()])
+            inicio = trozo.end()
+    yield from _no_vacia(script[inicio:])
+
+
+def _sin_comentarios(sentencia: str) -> str:
+    return _TROZOS_SQL.sub(lambda m: "" if m.group().startswith(("--", "/*")) else m.group(), sentencia)
+
+
+def _no_vacia(sentencia: str):
+    # Una sentencia hecha solo de comentarios haría fallar a PostgreSQL ("empty query")
+    if _sin_comentarios(sentencia).strip():
+        yield sentencia
+
+
+def _indice_invalido(conn, nombre: str) -> bool:
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid"
+        " WHERE c.relname = :nombre AND c.relnamespace = 'public'::regnamespace AND NOT i.indisvalid"
+    ), {"nombre": nombre}).scalar())
+
+
+def _ejecutar(conn, sentencia: str):
+    concurrente = _INDICE_CONCURRENTE.match(_sin_comentarios(sentencia))
+    if concurrente is None:
+        conn.execute(text(sentencia))
+        return
+    # Un CREATE INDEX CONCURRENTLY que falla deja el índice creado pero INVALID, y con IF NOT EXISTS
+    # el siguiente intento lo daría por bueno: se borra antes de reintentar y se comprueba al terminar
+    nombre = concurrente.group(1)
+    if _indice_invalido(conn, nombre):
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{nombre}"'))
+    try:
+        conn.execute(text(sentencia))
+    finally:
+        invalido = _indice_invalido(conn, nombre)
+        if invalido:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{nombre}"'))
+    if invalido:
+        raise RuntimeError(f"El índice {nombre} quedó INVALID tras CREATE INDEX CONCURRENTLY; se ha borrado para reintentarlo")
+
+
+def aplicar_migraciones(engine: Engine) -> list:
+    """
+    Aplica los scripts .sql pendientes y los registra en la tabla schema_migraciones.
+    Se ejecuta en modo AUTOCOMMIT para poder usar CREATE INDEX CONCURRENTLY, que no bloquea
+    las escrituras mientras se construye el índice en tablas grandes.
+    """
+    aplicadas_ahora = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Varias instancias que arrancan a la vez: la primera aplica y las demás esperan y no encuentran
+        # nada pendiente. Es de sesión, así que se suelta también si la conexión se cierra tras un error.
+        conn.execute(text("SELECT pg_advisory_lock(:clave)"), {"clave": _CLAVE_BLOQUEO})
+        try:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migraciones ("
+                " version VARCHAR PRIMARY KEY,"
+                " aplicada_el TIMESTAMP NOT NULL DEFAULT now())"
+            ))
+            aplicadas = set(conn.execute(text("SELECT version FROM schema_migraciones")).scalars())
+            for archivo in sorted(CARPETA_MIGRACIONES.glob("*.sql")):
+                version = archivo.stem
+                if version in aplicadas:
+                    continue
+                for sentencia in _sentencias(archivo.read_text(encoding="utf-8")):
+                    _ejecutar(conn, sentencia)
+                conn.execute(text("INSERT INTO schema_migraciones (version) VALUES (:version)"), {"version": version})
+                aplicadas_ahora.append(version)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:clave)"), {"clave": _CLAVE_BLOQUEO})
+    return aplicadas_ahora
+
+
+def huella_esquema(metadata: MetaData) -> str:
+    """
+    Hash del DDL que generaría create_all (tablas, índices y valores de los enums) y del contenido
+    de los scripts de migración. Cambia cuando cambia cualquiera de los dos.
+    """
+    dialecto = postgresql.dialect()
+    huella = hashlib.sha256()
+    for tabla in metadata.sorted_tables:
+        huella.update(str(CreateTable(tabla).compile(dialect=dialecto)).encode())
+        for indice in sorted(tabla.indexes, key=lambda i: i.name or ""):
+            huella.update(str(CreateIndex(indice).compile(dialect=dialecto)).encode())
+        for columna in tabla.columns:
+            if isinstance(columna.type, Enum):
+                huella.update(",".join(columna.type.enums).encode())
+    for archivo in sorted(CARPETA_MIGRACIONES.glob("*.sql")):
+        huella.update(archivo.name.encode())
+        huella.update(archivo.read_bytes())
+    return huella.hexdigest()
+
+
+def esquema_al_dia(engine: Engine, huella: str) -> bool:
+    """Una sola consulta para decidir si hace falta DDL: compara la huella guardada con la esperada."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT huella FROM schema_huella WHERE id = 1")).scalar() == huella
+    except exc.ProgrammingError:
+        # Base de datos nueva: todavía no existe la tabla schema_huella
+        return False
+
+
+def registrar_huella(engine: Engine, huella: str):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO schema_huella (id, huella) VALUES (1, :huella)"
+            " ON CONFLICT (id) DO UPDATE SET huella = EXCLUDED.huella"
+        ), {"huella": huella})
\ No newline at end of file
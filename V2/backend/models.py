@@ -1,5 +1,5 @@
 # library_project/backend/models.py
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Enum
+from sqlalchemy import BigInteger, Column, Integer, String, Date, ForeignKey, Enum, Index, Sequence, UniqueConstraint, text
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import date
@@ -14,6 +14,11 @@ class EstadoUsuario(str, enum.Enum):
     MOROSO = "MOROSO"
     MULTADO = "MULTADO"
 
+# --- Enum para el estado de una reserva ---
+class EstadoReserva(str, enum.Enum):
+    EN_ESPERA = "EN_ESPERA" # En la cola del libro
+    ASIGNADA = "ASIGNADA" # Tiene un ejemplar apartado hasta fecha_limite_recogida
+
 # --- Modelo para Libro (IRQ 2.5.3, punto 43) ---
 class Libro(Base):
     __tablename__ = "libros"
@@ -26,6 +31,8 @@ class Libro(Base):
     numEjemplares: Mapped[int] = mapped_column(Integer, default=0) # IRQ 2.5.3, punto 47
     numEjemplaresDisponibles: Mapped[int] = mapped_column(Integer, default=0) # IRQ 2.5.3, punto 48
     portadaURI: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    # Reservas en espera: si es 0, devolver un ejemplar no consulta la cola (columna: migración 0003)
+    numReservas: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
 
     # Relación uno a muchos con Ejemplar
     ejemplares: Mapped[list["Ejemplar"]] = relationship("Ejemplar", back_populates="libro")
@@ -40,7 +47,7 @@ class Ejemplar(Base):
     __tablename__ = "ejemplares"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True) # IRQ 2.5.4, punto 92
-    id_libro: Mapped[int] = mapped_column(Integer, ForeignKey("libros.id")) # IRQ 2.5.3, punto 54
+    id_libro: Mapped[int] = mapped_column(Integer, ForeignKey("libros.id"), index=True) # IRQ 2.5.3, punto 54 (índice: migración 0002)
     codigoEjemplar: Mapped[str] = mapped_column(String, unique=True, index=True) # IRQ 2.5.3, punto 53
     adquiridoEl: Mapped[date] = mapped_column(Date, default=date.today) # IRQ 2.5.3, punto 55
     observaciones: Mapped[str] = mapped_column(String, nullable=True) # IRQ 2.5.3, punto 56
@@ -51,6 +58,8 @@ class Ejemplar(Base):
     prestamo_activo: Mapped[Optional["Prestamo"]] = relationship("Prestamo", back_populates="ejemplar_rel", uselist=False)
     # Relación uno a muchos con PrestamoHistorico
     prestamos_historicos: Mapped[list["PrestamoHistorico"]] = relationship("PrestamoHistorico", back_populates="ejemplar_rel")
+    # Reserva para la que está apartado (devuelto y pendiente de recoger), si la hay
+    reserva: Mapped[Optional["Reserva"]] = relationship("Reserva", back_populates="ejemplar_rel", uselist=False)
 
 
 # --- Modelo para Usuario (Base) (IRQ 2.5.3, punto 29) ---
@@ -77,6 +86,11 @@ class Usuario(Base):
     prestamos_historicos: Mapped[list["PrestamoHistorico"]] = relationship("PrestamoHistorico", back_populates="usuario_rel")
     multas_historicas: Mapped[list["MultaHistorica"]] = relationship("MultaHistorica", back_populates="usuario_rel")
 
+    __table_args__ = (
+        # Los pocos usuarios morosos, para que el barrido nocturno los revise sin recorrer la tabla (migración 0004)
+        Index("ix_usuarios_morosos", "id", postgresql_where=text("estado = 'MOROSO'")),
+    )
+
     __mapper_args__ = {
         "polymorphic_identity": "usuario",
         "polymorphic_on": tipo_usuario,
@@ -111,15 +125,44 @@ class Prestamo(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True) # IRQ 2.5.4, punto 92
     id_ejemplar: Mapped[int] = mapped_column(Integer, ForeignKey("ejemplares.id"), unique=True) # Un ejemplar solo puede estar prestado una vez activamente
-    id_usuario: Mapped[int] = mapped_column(Integer, ForeignKey("usuarios.id")) #
+    id_usuario: Mapped[int] = mapped_column(Integer, ForeignKey("usuarios.id"), index=True) # Índice para consultas por usuario (migración 0001)
     fecha_prestamo: Mapped[date] = mapped_column(Date, default=date.today) # IRQ 2.5.3, punto 59
-    fecha_devolucion_esperada: Mapped[date] = mapped_column(Date) # IRQ 2.5.3, punto 59
+    fecha_devolucion_esperada: Mapped[date] = mapped_column(Date, index=True) # IRQ 2.5.3, punto 59 (índice para el barrido de morosos: migración 0004)
 
     # Relaciones
     ejemplar_rel: Mapped["Ejemplar"] = relationship("Ejemplar", back_populates="prestamo_activo")
     usuario_rel: Mapped["Usuario"] = relationship("Usuario", back_populates="prestamos_actuales")
 
 
+# --- Modelo para Reserva (cola de espera por libro) ---
+# Solo las reservas vivas: al recoger el ejemplar, cancelarla o caducar se borra la fila.
+class Reserva(Base):
+    __tablename__ = "reservas"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    id_libro: Mapped[int] = mapped_column(Integer, ForeignKey("libros.id"))
+    id_usuario: Mapped[int] = mapped_column(Integer, ForeignKey("usuarios.id"), index=True)
+    # Orden de llegada (secuencia global): la cola de un libro es su orden por posicion
+    posicion: Mapped[int] = mapped_column(BigInteger, Sequence("reservas_posicion_seq"), nullable=False)
+    estado: Mapped[EstadoReserva] = mapped_column(Enum(EstadoReserva), default=EstadoReserva.EN_ESPERA)
+    fecha_reserva: Mapped[date] = mapped_column(Date, default=date.today)
+    id_ejemplar: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("ejemplares.id"), unique=True, nullable=True)
+    fecha_limite_recogida: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("id_libro", "id_usuario", name="uq_reservas_libro_usuario"), # Una reserva por libro y usuario
+        # Cabeza de la cola en O(log n): primera reserva en espera del libro por posicion
+        Index("ix_reservas_cola", "id_libro", "posicion", postgresql_where=text("estado = 'EN_ESPERA'")),
+        # Reservas asignadas sin recoger a tiempo (crud.caducar_reservas)
+        Index("ix_reservas_recogida", "fecha_limite_recogida", postgresql_where=text("estado = 'ASIGNADA'")),
+    )
+
+    # Relaciones
+    libro_rel: Mapped["Libro"] = relationship("Libro")
+    usuario_rel: Mapped["Usuario"] = relationship("Usuario")
+    ejemplar_rel: Mapped[Optional["Ejemplar"]] = relationship("Ejemplar", back_populates="reserva")
+
+
 # --- Modelo para Multa (activa) (IRQ 2.5.3, punto 60) ---
 class Multa(Base):
     __tablename__ = "multas"
@@ -139,8 +182,8 @@ class Recomendacion(Base):
     __tablename__ = "recomendaciones"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True) # IRQ 2.5.4, punto 92
-    id_libro_origen: Mapped[int] = mapped_column(Integer, ForeignKey("libros.id"))
-    id_libro_recomendado: Mapped[int] = mapped_column(Integer, ForeignKey("libros.id"))
+    id_libro_origen: Mapped[int] = mapped_column(Integer, ForeignKey("libros.id"), index=True) # Índice: migración 0002
+    id_libro_recomendado: Mapped[int] = mapped_column(Integer, ForeignKey("libros.id"), index=True) # Índice: migración 0002
     comentario: Mapped[str] = mapped_column(String, nullable=True) # IRQ 2.5.3, punto 51
 
     # Relaciones
@@ -153,12 +196,12 @@ class PrestamoHistorico(Base):
     __tablename__ = "prestamos_historicos"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True) # IRQ 2.5.4, punto 92
-    id_ejemplar: Mapped[int] = mapped_column(Integer, ForeignKey("ejemplares.id")) # IRQ 2.5.3, punto 67
-    id_usuario: Mapped[int] = mapped_column(Integer, ForeignKey("usuarios.id")) # IRQ 2.5.3, punto 67
+    id_ejemplar: Mapped[int] = mapped_column(Integer, ForeignKey("ejemplares.id"), index=True) # IRQ 2.5.3, punto 67 (índice: migración 0002)
+    id_usuario: Mapped[int] = mapped_column(Integer, ForeignKey("usuarios.id"), index=True) # IRQ 2.5.3, punto 67 (índice: migración 0001)
     fecha_prestamo: Mapped[date] = mapped_column(Date)
     fecha_devolucion_esperada: Mapped[date] = mapped_column(Date)
     fecha_devolucion_real: Mapped[date] = mapped_column(Date) # IRQ 2.5.3, punto 68
-    id_multa: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("multas_historicas.id"), nullable=True) # IRQ 2.5.3, punto 67
+    id_multa: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("multas_historicas.id"), nullable=True, index=True) # IRQ 2.5.3, punto 67 (índice: migración 0002)
 
     # Relaciones
     ejemplar_rel: Mapped["Ejemplar"] = relationship("Ejemplar", back_populates="prestamos_historicos")
@@ -171,11 +214,21 @@ class MultaHistorica(Base):
     __tablename__ = "multas_historicas"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True) # IRQ 2.5.4, punto 92
-    id_usuario: Mapped[int] = mapped_column(Integer, ForeignKey("usuarios.id")) # IRQ 2.5.3, punto 67
+    id_usuario: Mapped[int] = mapped_column(Integer, ForeignKey("usuarios.id"), index=True) # IRQ 2.5.3, punto 67 (índice: migración 0002)
     fecha_inicio: Mapped[date] = mapped_column(Date)
     dias_acumulados: Mapped[int] = mapped_column(Integer)
     fecha_finalizacion: Mapped[date] = mapped_column(Date)
 
     # Relaciones
     usuario_rel: Mapped["Usuario"] = relationship("Usuario", back_populates="multas_historicas")
-    prestamos_historicos_rel: Mapped[list["PrestamoHistorico"]] = relationship("PrestamoHistorico", back_populates="multa_rel")
\ No newline at end of file
+    prestamos_historicos_rel: Mapped[list["PrestamoHistorico"]] = relationship("PrestamoHistorico", back_populates="multa_rel")
+
+
+# --- Huella del esquema (ver migraciones.huella_esquema) ---
+# Una sola fila con el hash del DDL que espera esta versión del código. Al estar en Base.metadata,
+# drop_all/create_all la borran y la crean junto con el resto de tablas.
+class SchemaHuella(Base):
+    __tablename__ = "schema_huella"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    huella: Mapped[str] = mapped_column(String(64))
\ No newline at end of file
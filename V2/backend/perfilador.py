@@ -0,0 +1,206 @@
+# library_project/backend/perfilador.py
+"""
+Perfilador por muestreo (solo biblioteca estándar: sys._current_frames) para encontrar en qué se
+va la CPU de una petición (serialización, validación de Pydantic, crud...) sin reproducirlo en local.
+
+Perfil de una petición: con la cabecera "X-Perfil: 1" o el parámetro "?_perfil=1", y solo si el usuario
+tiene el rol de administración, un hilo toma una muestra de la pila cada PERFIL_INTERVALO_MS y en lugar
+de la respuesta normal se devuelven las pilas en formato "colapsado" (una línea "marco;marco;...;marco
+muestras"), que entienden flamegraph.pl, speedscope o inferno. El código de estado original va en
+X-Estado-Original. El muestreo empieza cuando auth.get_current_user comprueba el rol (iniciar_si_solicitado),
+así que para cualquier otro cliente la cabecera no cuesta nada; la autenticación queda fuera del perfil.
+Se perfila una sola petición a la vez por worker; si ya hay otra, la petición se atiende sin perfil.
+
+Modo continuo (PERFIL_CONTINUO=1): un hilo toma muestras de todos los hilos ocupados cada
+PERFIL_CONTINUO_INTERVALO_MS y las agrupa por ruta en ventanas de PERFIL_CONTINUO_VENTANA_S segundos.
+GET /admin/perfil devuelve la última ventana completa. Con el intervalo por defecto (10 ms) el coste es
+de decenas de microsegundos por muestra.
+
+Qué se muestrea: el hilo del event loop mientras dura la petición y el hilo del threadpool que ejecuta el
+endpoint si es síncrono. El event loop lo comparten todas las peticiones en curso, así que sus muestras
+pueden incluir trabajo de otras peticiones concurrentes; en el modo continuo se agrupan como "(event loop)".
+"""
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Set
+
+PERFIL_INTERVALO_MS = float(os.getenv("PERFIL_INTERVALO_MS", "1"))
+PERFIL_PROFUNDIDAD = int(os.getenv("PERFIL_PROFUNDIDAD", "128"))
+PERFIL_CONTINUO = os.getenv("PERFIL_CONTINUO", "0") == "1"
+PERFIL_CONTINUO_INTERVALO_MS = float(os.getenv("PERFIL_CONTINUO_INTERVALO_MS", "10"))
+PERFIL_CONTINUO_VENTANA_S = float(os.getenv("PERFIL_CONTINUO_VENTANA_S", "60"))
+CABECERA_PERFIL = "X-Perfil"
+PARAMETRO_PERFIL = "_perfil"
+RUTA_EVENT_LOOP = "(event loop)"
+
+# Hilos que se muestrean para la petición perfilada en curso (None si no se está perfilando)
+_hilos_perfil: ContextVar[Optional[Set[int]]] = ContextVar("hilos_perfil", default=None)
+# Perfil solicitado por la petición en curso, a la espera de comprobar el rol (ver iniciar_si_solicitado)
+_perfil: ContextVar[Optional["Perfil"]] = ContextVar("perfil", default=None)
+# Hilos del threadpool ejecutando un endpoint -> "METODO /ruta"
+_rutas_por_hilo: Dict[int, str] = {}
+_perfil_en_curso = threading.Lock()
+_hilo_event_loop: Optional[int] = None
+
+
+def _pila(frame) -> str:
+    marcos = []
+    while frame is not None and len(marcos) < PERFIL_PROFUNDIDAD:
+        codigo = frame.f_code
+        marcos.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(marcos))
+
+
+def _inactivo(frame) -> bool:
+    # El event loop esperando en select() no está haciendo trabajo de ninguna petición
+    return frame.f_code.co_filename.endswith("selectors.py")
+
+
+def colapsar(pilas: Counter) -> str:
+    return "\n".join(f"{pila} {muestras}" for pila, muestras in pilas.most_common()) + "\n"
+
+
+class _Muestreador(threading.Thread, ABC):
+    def __init__(self, intervalo_ms: float):
+        super().__init__(daemon=True, name="perfilador")
+        self.intervalo = intervalo_ms / 1000
+        self._parar = threading.Event()
+
+    @abstractmethod
+    def muestrear(self, frames: dict):
+        """Procesa una muestra: los frames de todos los hilos (sys._current_frames())."""
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            self.muestrear(sys._current_frames())
+
+    def detener(self):
+        self._parar.set()
+        self.join()
+
+
+class _MuestreadorPeticion(_Muestreador):
+    def __init__(self, hilos: Set[int]):
+        super().__init__(PERFIL_INTERVALO_MS)
+        self.hilos = hilos
+        self.pilas = Counter()
+        self.muestras = 0
+
+    def muestrear(self, frames: dict):
+        self.muestras += 1
+        for hilo in list(self.hilos):
+            frame = frames.get(hilo)
+            if frame is not None and not _inactivo(frame):
+                self.pilas[_pila(frame)] += 1
+
+
+class _MuestreadorContinuo(_Muestreador):
+    def __init__(self):
+        super().__init__(PERFIL_CONTINUO_INTERVALO_MS)
+        self.actual = Counter()
+        self.anterior = Counter()
+        self.inicio_ventana = time.monotonic()
+        self.fin_anterior: Optional[float] = None
+
+    def muestrear(self, frames: dict):
+        ahora = time.monotonic()
+        if ahora - self.inicio_ventana >= PERFIL_CONTINUO_VENTANA_S:
+            self.anterior, self.actual = self.actual, Counter()
+            self.inicio_ventana = self.fin_anterior = ahora
+        for hilo, ruta in list(_rutas_por_hilo.items()):
+            frame = frames.get(hilo)
+            if frame is not None:
+                self.actual[f"{ruta};{_pila(frame)}"] += 1
+        frame = frames.get(_hilo_event_loop)
+        if frame is not None and not _inactivo(frame):
+            self.actual[f"{RUTA_EVENT_LOOP};{_pila(frame)}"] += 1
+
+
+_continuo: Optional[_MuestreadorContinuo] = None
+
+
+def iniciar_continuo():
+    """Se llama en el startup (dentro del event loop) de cada worker."""
+    global _continuo, _hilo_event_loop
+    _hilo_event_loop = threading.get_ident()
+    if PERFIL_CONTINUO and _continuo is None:
+        _continuo = _MuestreadorContinuo()
+        _continuo.start()
+
+
+def perfil_continuo(ruta: Optional[str] = None) -> Optional[str]:
+    """Pilas colapsadas de la última ventana completa (la actual si aún no hay ninguna), con la ruta como primer marco."""
+    if _continuo is None:
+        return None
+    pilas = _continuo.anterior if _continuo.fin_anterior is not None else _continuo.actual
+    if ruta is not None:
+        pilas = Counter({pila: n for pila, n in pilas.items() if pila.split(";", 1)[0] == ruta})
+    return colapsar(pilas)
+
+
+@contextmanager
+def hilo_en_peticion(ruta: Optional[str]):
+    """Marca el hilo actual (del threadpool) como ocupado con la petición 'ruta' mientras dura el bloque."""
+    hilo = threading.get_ident()
+    hilos = _hilos_perfil.get()
+    if hilos is not None:
+        hilos.add(hilo)
+    _rutas_por_hilo[hilo] = ruta or "(sin ruta)"
+    try:
+        yield
+    finally:
+        _rutas_por_hilo.pop(hilo, None)
+        if hilos is not None:
+            hilos.discard(hilo)
+
+
+def solicitado(request) -> bool:
+    return request.headers.get(CABECERA_PERFIL) == "1" or request.query_params.get(PARAMETRO_PERFIL) == "1"
+
+
+class Perfil:
+    def __init__(self):
+        self.hilos = {threading.get_ident()}
+        self.muestreador: Optional[_MuestreadorPeticion] = None # None mientras no se haya iniciado
+
+    def iniciar(self):
+        if self.muestreador is None and _perfil_en_curso.acquire(blocking=False):
+            self.muestreador = _MuestreadorPeticion(self.hilos)
+            self.muestreador.start()
+
+    def detener(self):
+        if self.muestreador is not None:
+            self.muestreador.detener()
+            _perfil_en_curso.release()
+
+
+@contextmanager
+def perfilar():
+    """
+    Prepara el perfil de la petición en curso para el bloque y lo entrega. El muestreo no empieza hasta
+    iniciar_si_solicitado; si nunca se llama, o ya se está perfilando otra petición en este worker, el
+    perfil termina sin muestreador.
+    """
+    perfil = Perfil()
+    token = _perfil.set(perfil)
+    token_hilos = _hilos_perfil.set(perfil.hilos)
+    try:
+        yield perfil
+    finally:
+        perfil.detener()
+        _hilos_perfil.reset(token_hilos)
+        _perfil.reset(token)
+
+
+def iniciar_si_solicitado():
+    """Empieza a muestrear si la petición en curso pidió perfil; auth.get_current_user la llama con un administrador."""
+    perfil = _perfil.get()
+    if perfil is not None:
+        perfil.iniciar()
@@ -0,0 +1,28 @@
+# library_project/backend/pruebas/test_batch.py
+"""POST /batch: subpeticiones JSON, de texto y en streaming."""
+
+
+def test_subpeticion_json(cliente):
+    r = cliente.post("/batch", json={"peticiones": [{"id": "libro", "path": "/libros/1"}]})
+    assert r.status_code == 200
+    (libro,) = r.json()
+    assert libro["id"] == "libro" and libro["status"] == 200
+    assert libro["body"]["isbn"] == "PR-1"
+
+
+def test_subpeticion_no_json_se_devuelve_como_texto(cliente):
+    r = cliente.post("/batch", json={"peticiones": [{"id": "metricas", "path": "/metrics"}, {"id": "libro", "path": "/libros/2"}]})
+    assert r.status_code == 200
+    metricas, libro = r.json()
+    assert metricas["status"] == 200
+    assert isinstance(metricas["body"], str) and "# TYPE" in metricas["body"]
+    assert libro["status"] == 200 and libro["body"]["isbn"] == "PR-2"
+
+
+def test_subpeticiones_en_streaming_se_rechazan(cliente):
+    rutas = ["/exportar/historial/prestamos", "/catalogo/disponibilidad/eventos?libros=1"]
+    r = cliente.post("/batch", json={"peticiones": [{"path": ruta} for ruta in rutas] + [{"path": "/libros/3"}]})
+    assert r.status_code == 200
+    exportacion, eventos, libro = r.json()
+    assert exportacion["status"] == 400 and eventos["status"] == 400
+    assert libro["status"] == 200 and libro["body"]["isbn"] == "PR-3"
@@ -0,0 +1,20 @@
+# library_project/backend/pruebas/test_captura.py
+"""Saneado de la captura de tráfico (captura.py): datos personales del cuerpo y de la query string."""
+from types import SimpleNamespace
+
+from backend import captura
+
+
+def _peticion(query: bytes):
+    return SimpleNamespace(scope={"query_string": query})
+
+
+def test_query_string_con_datos_personales_se_seudonimiza():
+    q = captura._query_string(_peticion(b"email=ana%40example.org&skip=10&login=ana"))
+    assert "ana" not in q and "skip=10" in q
+    # El mismo valor da el mismo seudónimo que en el cuerpo
+    assert captura.sanear({"login": "ana"})["login"] in q
+
+
+def test_query_string_sin_datos_personales_se_guarda_tal_cual():
+    assert captura._query_string(_peticion(b"skip=10&limit=5&expand=ejemplares")) == "skip=10&limit=5&expand=ejemplares"
@@ -0,0 +1,56 @@
+# library_project/backend/pruebas/test_catalogo.py
+"""Catálogo público: paginación por clave y caché que solo descarta lo afectado por cada cambio (catalogo.py)."""
+import pytest
+
+from backend import catalogo
+
+
+@pytest.fixture
+def cache():
+    catalogo.cache._entradas.clear()
+    catalogo.cache._invalidaciones.clear()
+    return catalogo.cache
+
+
+def _ids(respuesta):
+    assert respuesta.status_code == 200
+    return [libro["id"] for libro in respuesta.json()]
+
+
+def test_paginas_por_clave(cliente, cache):
+    assert _ids(cliente.get("/catalogo/libros?limit=2")) == [1, 2]
+    assert _ids(cliente.get("/catalogo/libros?despues_de=2&limit=2")) == [3, 4]
+    assert _ids(cliente.get("/catalogo/libros?despues_de=4&limit=2")) == [5]
+
+
+def test_un_cambio_solo_descarta_la_pagina_del_libro(cliente, cache):
+    for despues_de in (0, 2, 4):
+        cliente.get(f"/catalogo/libros?despues_de={despues_de}&limit=2")
+    cliente.get("/catalogo/libros/1")
+    r = cliente.put("/libros/3", json={"isbn": "PR-3", "titulo": "Libro 3 (2.ª ed.)", "autor": "Autor", "numPaginas": 100})
+    assert r.status_code == 200, r.text
+    assert set(cache._entradas) == {("libros", 0, 2), ("libros", 4, 2), ("libro", 1)}
+    # Un libro nuevo (id mayor que todos) solo cae en la última página, la que no está llena
+    cache.invalidar(catalogo.condicion_libros({6}))
+    assert set(cache._entradas) == {("libros", 0, 2), ("libro", 1)}
+    assert _ids(cliente.get("/catalogo/libros?despues_de=2&limit=2")) == [3, 4]
+
+
+def test_regeneracion_invalidada_a_medias_no_se_guarda():
+    cache = catalogo.CacheRespuestas(10, ventana_s=60)
+    primarias = []
+
+    def generar(clave_invalidada):
+        def generar_entrada(primaria):
+            primarias.append(primaria)
+            cache.invalidar(lambda clave, rango: clave == clave_invalidada)
+            return b"[]", None
+        return generar_entrada
+
+    cache.obtener(("libro", 1), generar(("libro", 1)), 60, 60)
+    cache.obtener(("libro", 2), generar(("libro", 3)), 60, 60)
+    assert list(cache._entradas) == [("libro", 2)]
+    # Tras invalidar una clave, su siguiente regeneración lee de la primaria; la de las demás, no
+    cache.obtener(("libro", 1), lambda primaria: primarias.append(primaria) or (b"[]", None), 60, 60)
+    cache.obtener(("libro", 4), lambda primaria: primarias.append(primaria) or (b"[]", None), 60, 60)
+    assert primarias == [False, False, True, False]
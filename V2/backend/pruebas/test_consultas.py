@@ -0,0 +1,25 @@
+# library_project/backend/pruebas/test_consultas.py
+"""Presupuesto de sentencias SQL por petición con el fixture consultas_sql (ver pytest_consultas.py)."""
+import pytest
+from sqlalchemy import select
+
+from backend import database, metricas, models
+
+PRESUPUESTO_LIBROS = metricas.PRESUPUESTO_CONSULTAS[("GET", "/libros/")]
+
+
+@pytest.mark.parametrize("url", ["/libros/", "/libros/?expand=ejemplares,recomendaciones"])
+def test_listado_de_libros_dentro_del_presupuesto(cliente, consultas_sql, url):
+    with consultas_sql.limite(PRESUPUESTO_LIBROS):
+        r = cliente.get(url)
+    assert r.status_code == 200
+    assert len(r.json()) == 5
+
+
+def test_n_mas_1_supera_el_presupuesto(cliente, consultas_sql):
+    # Recorrer la relación perezosa libro.ejemplares en un bucle: una consulta por libro
+    with pytest.raises(AssertionError, match="sentencias SQL"):
+        with consultas_sql.limite(PRESUPUESTO_LIBROS), database.SessionLocal() as db:
+            for libro in db.scalars(select(models.Libro)):
+                assert len(libro.ejemplares) == 2
+    assert consultas_sql.total >= 1 + 5
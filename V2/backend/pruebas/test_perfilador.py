@@ -0,0 +1,34 @@
+# library_project/backend/pruebas/test_perfilador.py
+"""El perfil de una petición solo muestrea tras comprobar el rol de administración (ver perfilador.py)."""
+import time
+
+import pytest
+
+from backend import perfilador
+
+
+def test_sin_rol_comprobado_no_se_muestrea():
+    with perfilador.perfilar() as perfil:
+        time.sleep(0.01)
+    assert perfil.muestreador is None
+    assert not perfilador._perfil_en_curso.locked()
+
+
+def test_se_muestrea_tras_iniciar_si_solicitado():
+    with perfilador.perfilar() as perfil:
+        perfilador.iniciar_si_solicitado()
+        fin = time.monotonic() + 0.05
+        while time.monotonic() < fin:
+            pass
+    assert perfil.muestreador is not None and perfil.muestreador.muestras > 0
+    assert not perfilador._perfil_en_curso.locked()
+
+
+def test_iniciar_fuera_de_una_peticion_perfilada_no_hace_nada():
+    perfilador.iniciar_si_solicitado()
+    assert not perfilador._perfil_en_curso.locked()
+
+
+def test_muestreador_es_abstracto():
+    with pytest.raises(TypeError):
+        perfilador._Muestreador(1)
@@ -0,0 +1,41 @@
+# library_project/backend/pruebas/test_replicas.py
+"""Cookie de lecturas propias (replicas.LecturasPropias): solo tras escrituras con éxito y nunca en /batch."""
+import pytest
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.testclient import TestClient
+
+from backend.replicas import COOKIE_LECTURA_PRIMARIA, LecturasPropias
+
+app = FastAPI()
+app.add_middleware(LecturasPropias)
+
+
+@app.get("/libros/1")
+def leer():
+    return {}
+
+
+@app.delete("/libros/1", status_code=204)
+def eliminar():
+    return Response(status_code=204)
+
+
+@app.post("/libros/")
+def crear_con_error():
+    raise HTTPException(status_code=409)
+
+
+@app.post("/batch")
+def batch():
+    return []
+
+
+@pytest.mark.parametrize("metodo, ruta, con_cookie", [
+    ("DELETE", "/libros/1", True),
+    ("GET", "/libros/1", False),
+    ("POST", "/libros/", False),
+    ("POST", "/batch", False),
+])
+def test_cookie_de_lecturas_propias(metodo, ruta, con_cookie):
+    r = TestClient(app).request(metodo, ruta)
+    assert (COOKIE_LECTURA_PRIMARIA in r.cookies) == con_cookie
@@ -0,0 +1,78 @@
+# library_project/backend/pruebas/test_reservas.py
+"""Cola de reservas (crud.py): asignación de ejemplares devueltos y bloqueo de la fila del libro."""
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+
+from backend import crud, database, metricas, schemas
+
+
+def _alumno(cliente, login):
+    r = cliente.post("/usuarios/alumno/", json={"login": login, "nombre": "Nombre", "apellidos": "Apellido", "email": f"{login}@example.com",
+                                               "calle": "Calle", "numero": "1", "ciudad": "Quito", "codigo_postal": "170101", "telefono_padres": "0990000000"})
+    assert r.status_code == 201, r.text
+    return r.json()["id"]
+
+
+@pytest.fixture
+def libro_prestado(cliente):
+    """Libro con un único ejemplar, prestado: (id del libro, id del ejemplar, id del usuario que lo tiene)."""
+    sufijo = time.monotonic_ns()
+    r = cliente.post("/libros/", json={"isbn": f"RS-{sufijo}", "titulo": "Reservable", "autor": "Autor", "numPaginas": 100, "numEjemplares": 0})
+    assert r.status_code == 201, r.text
+    libro_id = r.json()["id"]
+    r = cliente.post("/ejemplares/", json={"id_libro": libro_id, "codigoEjemplar": f"RS-{sufijo}"})
+    assert r.status_code == 201, r.text
+    ejemplar_id = r.json()["id"]
+    usuario_id = _alumno(cliente, f"rs{sufijo}")
+    r = cliente.post("/prestamos/", json={"id_ejemplar": ejemplar_id, "id_usuario": usuario_id,
+                                           "fecha_devolucion_esperada": str(date.today() + timedelta(days=7))})
+    assert r.status_code == 201, r.text
+    return libro_id, ejemplar_id, usuario_id
+
+
+def test_devolucion_asigna_el_ejemplar_a_la_reserva(cliente, consultas_sql, libro_prestado):
+    libro_id, ejemplar_id, _ = libro_prestado
+    usuario_id = _alumno(cliente, f"espera{time.monotonic_ns()}")
+    r = cliente.post("/reservas/", json={"id_libro": libro_id, "id_usuario": usuario_id})
+    assert r.status_code == 201, r.text
+    with consultas_sql.limite(metricas.PRESUPUESTO_CONSULTAS[("POST", "/ejemplares/{ejemplar_id}/devolver/")]):
+        assert cliente.post(f"/ejemplares/{ejemplar_id}/devolver/").status_code == 200
+    (reserva,) = cliente.get(f"/libros/{libro_id}/reservas/").json()
+    assert reserva["estado"] == "ASIGNADA" and reserva["id_ejemplar"] == ejemplar_id
+    assert cliente.get(f"/libros/{libro_id}").json()["numEjemplaresDisponibles"] == 0
+
+
+def test_alta_de_ejemplar_con_cola_dentro_del_presupuesto(cliente, consultas_sql, libro_prestado):
+    libro_id, _, _ = libro_prestado
+    usuario_id = _alumno(cliente, f"espera{time.monotonic_ns()}")
+    assert cliente.post("/reservas/", json={"id_libro": libro_id, "id_usuario": usuario_id}).status_code == 201
+    with consultas_sql.limite(metricas.PRESUPUESTO_CONSULTAS[("POST", "/ejemplares/")]):
+        r = cliente.post("/ejemplares/", json={"id_libro": libro_id, "codigoEjemplar": f"RS-nuevo-{time.monotonic_ns()}"})
+    assert r.status_code == 201, r.text
+
+
+def test_reserva_espera_a_la_devolucion_en_curso(cliente, libro_prestado):
+    # Mientras una devolución del libro no confirma, una reserva nueva espera y después ve el ejemplar libre
+    libro_id, ejemplar_id, _ = libro_prestado
+    usuario_id = _alumno(cliente, f"carrera{time.monotonic_ns()}")
+    with database.SessionLocal() as devolucion:
+        crud._asignar_o_liberar(devolucion, crud.get_libro(devolucion, libro_id), crud.get_ejemplar(devolucion, ejemplar_id))
+        resultado = {}
+
+        def reservar():
+            with database.SessionLocal() as db:
+                try:
+                    resultado["reserva"] = crud.create_reserva(db, schemas.ReservaCreate(id_libro=libro_id, id_usuario=usuario_id))
+                except ValueError as e:
+                    resultado["error"] = str(e)
+
+        hilo = threading.Thread(target=reservar)
+        hilo.start()
+        time.sleep(0.3)
+        assert hilo.is_alive() # Bloqueada en el SELECT ... FOR UPDATE del libro
+        devolucion.commit()
+    hilo.join(timeout=10)
+    assert "Hay ejemplares disponibles" in resultado.get("error", "")
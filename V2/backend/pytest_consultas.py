@@ -0,0 +1,22 @@
+# library_project/backend/pytest_consultas.py
+"""
+Plugin de pytest con el fixture `consultas_sql`, para fijar en pruebas cuántas sentencias SQL
+ejecuta un endpoint y detectar N+1 antes de que lleguen a producción.
+
+Se activa desde un conftest.py con:
+    pytest_plugins = ["backend.pytest_consultas"]
+
+Ejemplo:
+    def test_resumen_en_una_consulta(cliente, consultas_sql):
+        with consultas_sql.limite(1):
+            assert cliente.get("/usuarios/1/resumen").status_code == 200
+"""
+import pytest
+
+from .metricas import ContadorConsultas
+
+
+@pytest.fixture
+def consultas_sql():
+    with ContadorConsultas() as contador:
+        yield contador
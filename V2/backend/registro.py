@@ -0,0 +1,160 @@
+# library_project/backend/registro.py
+"""
+Configuración del logging de la API: registros estructurados (una línea JSON por evento) escritos
+por un hilo aparte, para que ninguna petición espere a la E/S de stdout.
+
+- Los loggers escriben en una cola acotada (LOG_COLA). Un QueueListener la vacía en su hilo y
+  formatea y escribe cada registro. Si la cola está llena el registro se descarta y se cuenta en
+  biblioteca_logs_descartados_total, en lugar de bloquear la petición.
+- Cada petición tiene un id de correlación: el de la cabecera X-Request-ID si la trae, o uno
+  nuevo. Se devuelve en la respuesta y aparece en todos los registros de esa petición
+  (metricas.RutaMedida lo asigna).
+- Log de accesos (logger "backend.acceso"): una línea por petición con el id, usuario, ruta,
+  estado, latencia, tiempo en la base de datos y número de sentencias SQL. Se muestrea con
+  LOG_ACCESO_MUESTREO (fracción de 0 a 1). Nunca se descartan por muestreo las peticiones que
+  modifican datos (registro de auditoría), las que fallan ni las más lentas que LOG_ACCESO_LENTA_MS.
+- LOG_FORMATO=texto escribe líneas legibles en lugar de JSON (desarrollo); LOG_NIVEL fija el nivel.
+
+La configuración se aplica al importar este módulo (main.py lo importa el primero). Tras un fork
+(workers de gunicorn con preload_app) se crea un listener nuevo en el hijo, porque los hilos no
+sobreviven al fork.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from prometheus_client import Counter
+
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+LOG_FORMATO = os.getenv("LOG_FORMATO", "json")
+LOG_COLA = int(os.getenv("LOG_COLA", "10000"))
+LOG_ACCESO_MUESTREO = float(os.getenv("LOG_ACCESO_MUESTREO", "1"))
+LOG_ACCESO_LENTA_MS = float(os.getenv("LOG_ACCESO_LENTA_MS", "500"))
+CABECERA_ID_PETICION = "X-Request-ID"
+
+DESCARTADOS = Counter("biblioteca_logs_descartados_total", "Registros de log descartados por tener la cola llena")
+
+# Id de correlación de la petición en curso
+_id_peticion: ContextVar[Optional[str]] = ContextVar("id_peticion", default=None)
+
+logger_acceso = logging.getLogger("backend.acceso")
+
+
+def id_peticion() -> Optional[str]:
+    return _id_peticion.get()
+
+
+def asignar_id_peticion(request):
+    """Fija el id de correlación de la petición (el del cliente si es razonable) y devuelve el token del ContextVar."""
+    recibido = request.headers.get(CABECERA_ID_PETICION)
+    valor = recibido if recibido and len(recibido) <= 128 else uuid.uuid4().hex
+    return _id_peticion.set(valor)
+
+
+def restaurar_id_peticion(token):
+    _id_peticion.reset(token)
+
+
+def registrar_acceso(metodo: str, ruta: str, estado: int, duracion_s: float, db_s: float, consultas: int, usuario: Optional[str]):
+    duracion_ms = duracion_s * 1000
+    # Las escrituras, los errores y las peticiones lentas se registran siempre
+    siempre = metodo != "GET" or estado >= 500 or duracion_ms >= LOG_ACCESO_LENTA_MS
+    if not siempre and random.random() >= LOG_ACCESO_MUESTREO:
+        return
+    if not logger_acceso.isEnabledFor(logging.INFO):
+        return
+    logger_acceso.info("%s %s %d", metodo, ruta, estado, extra={"campos": {
+        "metodo": metodo, "ruta": ruta, "estado": estado, "duracion_ms": round(duracion_ms, 2),
+        "db_ms": round(db_s * 1000, 2), "consultas_sql": consultas, "usuario": usuario,
+        "muestreo": 1.0 if siempre else LOG_ACCESO_MUESTREO,
+    }})
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        evento = {
+            "fecha": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+        }
+        if getattr(record, "id_peticion", None):
+            evento["id_peticion"] = record.id_peticion
+        evento.update(getattr(record, "campos", None) or {})
+        if record.exc_info:
+            evento["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+class FormatoTexto(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(id_peticion)s] %(message)s%(campos_texto)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.id_peticion = getattr(record, "id_peticion", None) or "-"
+        campos = getattr(record, "campos", None)
+        record.campos_texto = (" " + " ".join(f"{k}={v}" for k, v in campos.items())) if campos else ""
+        return super().format(record)
+
+
+class ColaSinBloqueo(QueueHandler):
+    """QueueHandler que descarta (y cuenta) en lugar de bloquear o fallar cuando la cola está llena."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El id de correlación vive en el contexto de la petición, que el hilo del listener no ve.
+        # El formateo (lo caro) se deja al listener; aquí solo se fija el mensaje.
+        record.id_peticion = _id_peticion.get()
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DESCARTADOS.inc()
+
+
+_manejador_cola: Optional[ColaSinBloqueo] = None
+_listener: Optional[QueueListener] = None
+
+
+def _iniciar_listener():
+    global _listener
+    cola = queue.Queue(LOG_COLA)
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(FormatoTexto() if LOG_FORMATO == "texto" else FormatoJSON())
+    _manejador_cola.queue = cola
+    _listener = QueueListener(cola, salida, respect_handler_level=False)
+    _listener.start()
+
+
+def detener():
+    """Escribe lo que quede en la cola y detiene el hilo del listener."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def configurar():
+    global _manejador_cola
+    if _manejador_cola is not None:
+        return
+    _manejador_cola = ColaSinBloqueo(None)
+    _iniciar_listener()
+    raiz = logging.getLogger()
+    raiz.handlers = [_manejador_cola]
+    raiz.setLevel(LOG_NIVEL)
+    os.register_at_fork(after_in_child=_iniciar_listener)
+    atexit.register(detener)
+
+
+configurar()
@@ -0,0 +1,152 @@
+# library_project/backend/replicas.py
+"""
+Enrutado de lecturas a réplicas de PostgreSQL (opcional, DATABASE_REPLICA_URLS).
+
+Las peticiones GET usan una SesionEnrutada con una réplica: los SELECT van a la réplica y cualquier
+escritura (flush, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE) va a la primaria; a partir de la primera
+escritura toda la sesión usa la primaria para leer lo que acaba de escribir. El resto de métodos
+usan siempre la primaria.
+
+- Lecturas propias: tras una petición de escritura con éxito (2xx, cualquier método salvo GET/HEAD/OPTIONS,
+  excepto POST /batch, que solo agrupa lecturas) el middleware LecturasPropias añade a la respuesta la
+  cookie "lectura_primaria" y durante DB_REPLICA_STICKY_S segundos los GET de ese cliente se leen de la
+  primaria, aunque la réplica vaya retrasada.
+- Retraso: cada DB_REPLICA_LAG_CHECK_S segundos se mide el retraso de cada réplica; las que superan
+  DB_REPLICA_MAX_LAG_S o no responden se dejan de usar hasta la siguiente comprobación. Sin réplicas
+  sanas las lecturas van a la primaria.
+"""
+import itertools
+import os
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .metricas_pool import instalar_pre_ping_inactivas, opciones_engine
+
+# URLs separadas por comas. Conviene añadir ?connect_timeout=2 para que una réplica caída no bloquee la comprobación.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_MAX_LAG_S = float(os.getenv("DB_REPLICA_MAX_LAG_S", "5"))
+DB_REPLICA_LAG_CHECK_S = float(os.getenv("DB_REPLICA_LAG_CHECK_S", "2"))
+DB_REPLICA_STICKY_S = int(os.getenv("DB_REPLICA_STICKY_S", "5"))
+COOKIE_LECTURA_PRIMARIA = "lectura_primaria"
+
+# Retraso de aplicación del WAL en segundos. Si la réplica está conectada a la primaria y ya aplicó todo
+# lo recibido el retraso es 0 (una primaria sin escrituras no debe hacer "envejecer" a la réplica); un
+# nodo que no está en recuperación (p. ej. la propia primaria) también cuenta como 0.
+# Sin receptor de WAL en streaming, "aplicó todo lo recibido" no dice nada (no recibe): el retraso es
+# el tiempo desde la última transacción aplicada, y NULL (réplica no sana) si nunca aplicó ninguna.
+# Sin el rol pg_read_all_stats, pg_stat_wal_receiver solo muestra el pid y status es NULL.
+SQL_RETRASO = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE COALESCE(status, 'streaming') = 'streaming')
+            THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = create_engine(url, **opciones_engine())
+        instalar_pre_ping_inactivas(self.engine)
+        self.retraso_s: Optional[float] = None # None = no responde (o aún sin comprobar)
+        self.error: Optional[str] = None
+
+    @property
+    def sana(self) -> bool:
+        return self.retraso_s is not None and self.retraso_s <= DB_REPLICA_MAX_LAG_S
+
+    def comprobar(self):
+        try:
+            with self.engine.connect() as conn:
+                retraso = conn.execute(SQL_RETRASO).scalar()
+            self.retraso_s = None if retraso is None else float(retraso)
+            self.error = None if retraso is not None else "sin receptor de WAL"
+        except Exception as e:
+            self.retraso_s = None
+            self.error = type(e).__name__
+
+
+class EnrutadorReplicas:
+    def __init__(self, urls: List[str]):
+        self.replicas = [Replica(url) for url in urls]
+        self._turno = itertools.count()
+        self._lock = threading.Lock()
+        self._comprobado_el = float("-inf")
+
+    def _comprobar_si_toca(self):
+        if time.monotonic() - self._comprobado_el < DB_REPLICA_LAG_CHECK_S:
+            return
+        # Solo un hilo hace la comprobación; los demás siguen con el último estado conocido
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            for replica in self.replicas:
+                replica.comprobar()
+            self._comprobado_el = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def elegir(self) -> Optional[Engine]:
+        """Réplica sana para la siguiente lectura (por turnos), o None para leer de la primaria."""
+        self._comprobar_si_toca()
+        sanas = [replica for replica in self.replicas if replica.sana]
+        if not sanas:
+            return None
+        return sanas[next(self._turno) % len(sanas)].engine
+
+    def estado(self) -> List[dict]:
+        return [
+            {
+                "url": replica.engine.url.render_as_string(hide_password=True),
+                "sana": replica.sana,
+                "retraso_s": replica.retraso_s,
+                "error": replica.error,
+                "pool": replica.engine.pool.metricas(),
+            }
+            for replica in self.replicas
+        ]
+
+
+class LecturasPropias:
+    """Middleware ASGI: añade la cookie de lecturas propias a las respuestas de las escrituras con éxito."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS") or scope["path"] == "/batch":
+            await self.app(scope, receive, send)
+            return
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start" and 200 <= mensaje["status"] < 300:
+                cookie = (f"{COOKIE_LECTURA_PRIMARIA}={time.time() + DB_REPLICA_STICKY_S}; HttpOnly; "
+                          f"Max-Age={DB_REPLICA_STICKY_S}; Path=/; SameSite=lax")
+                mensaje = dict(mensaje, headers=list(mensaje.get("headers", [])) + [(b"set-cookie", cookie.encode("latin-1"))])
+            await send(mensaje)
+
+        await self.app(scope, receive, enviar)
+
+
+class SesionEnrutada(Session):
+    """Session que lee de `replica` (si se indica) y escribe en su bind normal (la primaria)."""
+
+    def __init__(self, *args, replica: Optional[Engine] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica = replica
+        self._solo_primaria = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.replica is not None and not self._solo_primaria:
+            es_lectura = getattr(clause, "is_select", False) and getattr(clause, "_for_update_arg", None) is None
+            if es_lectura and not self._flushing:
+                return self.replica
+            self._solo_primaria = True
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
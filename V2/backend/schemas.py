@@ -1,7 +1,7 @@
 # library_project/backend/schemas.py
 from pydantic import BaseModel, Field
-from typing import Optional, List, Union
-from datetime import date
+from typing import Any, Optional, List, Union
+from datetime import date, datetime
 from enum import Enum
 
 # --- Enum para el estado del usuario ---
@@ -10,6 +10,11 @@ class EstadoUsuario(str, Enum):
     MOROSO = "MOROSO"
     MULTADO = "MULTADO"
 
+# --- Enum para el estado de una reserva ---
+class EstadoReserva(str, Enum):
+    EN_ESPERA = "EN_ESPERA"
+    ASIGNADA = "ASIGNADA"
+
 # --- Esquemas para Libro ---
 class LibroBase(BaseModel):
     isbn: str = Field(..., example="978-3-16-148410-0", max_length=17, description="Número ISBN del libro (único)") # Obligatorio
@@ -149,6 +154,28 @@ class Recomendacion(RecomendacionBase):
     class Config:
         from_attributes = True
 
+# --- Esquemas del catálogo público (/catalogo, sin autenticación) ---
+
+class DisponibilidadLibro(BaseModel):
+    id: int
+    numEjemplares: int
+    numEjemplaresDisponibles: int
+    numReservas: int # Usuarios en la cola de reservas
+
+class LibroRecomendado(BaseModel):
+    id: int
+    titulo: str
+    autor: str
+    portadaURI: Optional[str] = None
+
+# --- Esquema de Libro con expansiones (?expand=ejemplares,recomendaciones) ---
+class LibroExpandido(Libro):
+    ejemplares: Optional[List[Ejemplar]] = None # Solo se incluye si se pide con expand
+    recomendaciones: Optional[List[Recomendacion]] = None # Recomendaciones donde el libro es el origen
+
+    class Config:
+        from_attributes = True
+
 # --- Esquemas para Históricos ---
 class PrestamoHistoricoBase(BaseModel):
     id_ejemplar: int = Field(..., description="ID del ejemplar prestado históricamente")
@@ -180,4 +207,87 @@ class MultaHistorica(MultaHistoricaBase):
     id: int # El ID se genera en la base de datos
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# --- Esquemas para Reserva ---
+class ReservaCreate(BaseModel):
+    id_libro: int = Field(..., example=1, description="ID del libro que se quiere reservar")
+    id_usuario: int = Field(..., example=1, description="ID del usuario que reserva")
+
+class Reserva(ReservaCreate):
+    id: int # El ID se genera en la base de datos
+    estado: EstadoReserva = Field(..., description="EN_ESPERA en la cola, o ASIGNADA con un ejemplar apartado")
+    fecha_reserva: date
+    id_ejemplar: Optional[int] = Field(default=None, description="Ejemplar apartado (solo si está ASIGNADA)")
+    fecha_limite_recogida: Optional[date] = Field(default=None, description="Último día para recoger el ejemplar apartado")
+
+    class Config:
+        from_attributes = True
+
+class ReservaEnCola(Reserva):
+    delante: int = Field(..., description="Reservas en espera del mismo libro por delante de esta (0 si ya está asignada)")
+
+# --- Esquemas para el resumen de cuenta de un usuario ---
+class PrestamoConLibro(Prestamo):
+    id_libro: int # Libro al que pertenece el ejemplar prestado
+    titulo: str # Título del libro, para no tener que consultarlo aparte
+
+class ResumenUsuario(BaseModel):
+    usuario: Union[Profesor, Alumno]
+    prestamos_activos: List[PrestamoConLibro] = []
+    multa_activa: Optional[Multa] = None
+    num_prestamos_historicos: int = 0
+    num_prestamos_historicos_con_multa: int = 0
+    num_multas_historicas: int = 0
+
+
+# --- Esquemas para métricas del pool de conexiones ---
+class MetricasPool(BaseModel):
+    pool_size: int
+    max_overflow: int
+    checked_in: int # Conexiones libres en el pool
+    checked_out: int # Conexiones en uso
+    overflow: int # Conexiones abiertas por encima de pool_size
+    overflow_max: int # Máximo overflow usado desde el arranque
+    checkouts_total: int
+    esperas_total: int # Checkouts que tuvieron que esperar a una conexión libre
+    tiempo_espera_total_s: float
+    tiempo_espera_max_s: float
+    timeouts_total: int # Esperas que terminaron en "QueuePool limit ... reached"
+    pre_pings_total: int # Comprobaciones hechas con DB_PRE_PING=inactivas
+
+class EstadoReplica(BaseModel):
+    url: str # Sin contraseña
+    sana: bool # False si no responde o su retraso supera DB_REPLICA_MAX_LAG_S
+    retraso_s: Optional[float] = None
+    error: Optional[str] = None
+    pool: MetricasPool
+
+class MetricasPools(BaseModel):
+    pid: int # Las métricas son por proceso (worker)
+    estrategia_pre_ping: str
+    sync: MetricasPool
+    async_: Optional[MetricasPool] = Field(None, alias="async")
+    replicas: List[EstadoReplica] = []
+
+class ConsultaLenta(BaseModel):
+    fecha: datetime
+    duracion_ms: float
+    ruta: Optional[str] = None # "METODO /plantilla"; None si no viene de una petición (arranque, scripts)
+    sentencia: str
+    parametros: str
+    plan: Optional[str] = None # Salida de EXPLAIN (ANALYZE, BUFFERS)
+    estado_plan: str # pendiente, capturado, no capturado (muestreo, no es SELECT, asyncpg...) o error: ...
+
+# --- Esquemas para peticiones agrupadas (/batch) ---
+class SubPeticionBatch(BaseModel):
+    id: Optional[str] = Field(None, example="multa", description="Identificador libre para localizar la respuesta")
+    path: str = Field(..., example="/usuarios/1/multa_activa/", description="Ruta GET existente, con query string opcional")
+
+class PeticionBatch(BaseModel):
+    peticiones: List[SubPeticionBatch] = Field(..., min_length=1, max_length=20)
+
+class RespuestaSubPeticion(BaseModel):
+    id: Optional[str] = None
+    status: int
+    body: Any = None # JSON decodificado, o texto si la subpetición no devuelve JSON
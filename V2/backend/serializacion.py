@@ -0,0 +1,65 @@
+# library_project/backend/serializacion.py
+import os
+from typing import Any, List, Optional, Union
+
+import orjson
+from fastapi import HTTPException, Response, status
+from pydantic import TypeAdapter
+
+from . import schemas
+from .metricas import medir
+
+# Si está activo, cada respuesta rápida se valida contra su esquema antes de enviarse.
+# Útil en desarrollo para detectar diferencias entre las columnas seleccionadas y el esquema.
+VALIDAR_RESPUESTAS = os.getenv("VALIDAR_RESPUESTAS", "0") == "1"
+
+
+class ORJSONResponse(Response):
+    """
+    Respuesta JSON serializada con orjson. Sirve diccionarios y filas de SQLAlchemy
+    (fechas y enums incluidos) sin pasar por la validación de Pydantic.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        with medir("serializacion"):
+            return orjson.dumps(content)
+
+
+# --- TypeAdapters precompilados (se construyen una sola vez al importar el módulo) ---
+# Se usan para validar (VALIDAR_RESPUESTAS=1) y en el calentamiento, pero no para serializar: con filas
+# que ya son diccionarios, dump_json no puede usar el serializador del modelo sin validar antes cada
+# fila, y sin validar cae en la inferencia de tipos genérica. Para 100 libros: orjson.dumps 28 µs,
+# dump_json 119 µs, validate_python + dump_json 214 µs. Las filas ya traen exactamente las columnas
+# del esquema (crud.py las proyecta), así que la salida de orjson es la misma.
+ADAPTADORES = {
+    "libros": TypeAdapter(List[schemas.Libro]),
+    "libros_expandidos": TypeAdapter(List[schemas.LibroExpandido]),
+    "ejemplares": TypeAdapter(List[schemas.Ejemplar]),
+    "usuarios": TypeAdapter(List[Union[schemas.Profesor, schemas.Alumno]]),
+    "prestamos": TypeAdapter(List[schemas.Prestamo]),
+    "prestamos_historicos": TypeAdapter(List[schemas.PrestamoHistorico]),
+    "multas_historicas": TypeAdapter(List[schemas.MultaHistorica]),
+}
+
+
+def parse_lista_param(valor: Optional[str], permitidos, nombre: str) -> List[str]:
+    # Convierte "a,b,c" en ["a", "b", "c"] y rechaza valores desconocidos con un 400
+    if not valor:
+        return []
+    elementos = [v.strip() for v in valor.split(",") if v.strip()]
+    desconocidos = [v for v in elementos if v not in permitidos]
+    if desconocidos:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Valores no válidos en '{nombre}': {', '.join(desconocidos)}. Permitidos: {', '.join(permitidos)}")
+    return list(dict.fromkeys(elementos))
+
+
+def respuesta_lista(filas: List[dict], adaptador: Optional[str]) -> ORJSONResponse:
+    """
+    Construye la respuesta de un listado a partir de filas ya proyectadas.
+    Las filas vienen de la base de datos con los tipos del esquema, así que no se validan una a una.
+    Con adaptador=None (p. ej. respuestas recortadas con ?fields=) no se valida nunca.
+    """
+    if VALIDAR_RESPUESTAS and adaptador:
+        ADAPTADORES[adaptador].validate_python(filas)
+    return ORJSONResponse(filas)
@@ -0,0 +1,4 @@
+#!/bin/bash
+# Se ejecuta al inicializar la primaria: permite conexiones de replicación (pg_basebackup y streaming)
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,14 @@
+#!/bin/bash
+# Arranque de la réplica: la primera vez clona la primaria y después arranca como hot standby
+set -e
+PGDATA=/var/lib/postgresql/data
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    until pg_basebackup -h db -U postgres -D "$PGDATA" -R -X stream; do
+        echo "Esperando a la primaria..."
+        rm -rf "${PGDATA:?}"/*
+        sleep 2
+    done
+    chown -R postgres:postgres "$PGDATA"
+    chmod 700 "$PGDATA"
+fi
+exec gosu postgres postgres -c hot_standby=on